@@ -1,4 +1,5 @@
 import base64
+import json
 import os
 import io
 import time
@@ -7,10 +8,8 @@ import pandas as pd
 import math # Potentially needed by pandas implicitly
 import random # Import random for adding jitter to backoff
 import mimetypes
-import zipfile # For creating ZIP archives
-import PIL.Image
-from io import BytesIO
 import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 import nltk
 from nltk.tokenize import sent_tokenize
 
@@ -24,12 +23,28 @@ try:
 except ImportError:
     HAS_NEW_GENAI = False
 
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file, session, send_from_directory
+from flask import Flask, Request, current_app, render_template, request, redirect, url_for, flash, send_file, session, send_from_directory, jsonify
 from dotenv import load_dotenv
 import google.generativeai as genai
 from google.generativeai import types # For file API status checks
 from werkzeug.utils import secure_filename
 from config import Config
+from jobs import JobManager, JobProgressVar, JobStatusVar
+from rate_limiter import gemini_limiter, estimate_tokens, is_rate_limit_error, parse_retry_delay
+from response_cache import response_cache
+from checkpoint import checkpoints, file_sha256, make_job_key
+from context_cache import context_cache, GeminiContextBackend, LocalContextBackend
+from excel_profile import EXCEL_MODES, build_workbook_context, chunk_sheets, estimate_workbook_tokens
+from excel_stream import cell_text, count_rows, iter_column, read_header
+from workbook_cache import workbook_cache
+from gemini_files import gemini_file_index, gemini_file_poller
+from upload_stream import HashingUploadStream, store_upload
+from output_sink import OUTPUT_FORMATS, OrderedRowWriter, open_complete_lines, open_sink
+from preupload import prepared_uploads
+from image_prep import prepare_image
+from asset_store import asset_store
+from image_derivatives import derivative_pool
+from zip_stream import archive_cache
 
 # Ensure NLTK data is properly downloaded for sentence tokenization
 try:
@@ -82,6 +97,7 @@ ALLOWED_EXTENSIONS_IMG = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 ALLOWED_EXTENSIONS_PDF = {'pdf'}
 ALLOWED_EXTENSIONS_VID = {'mp4', 'mov', 'avi', 'mpeg', 'mpg', 'webm', 'wmv'} # Added wmv
 ALLOWED_EXTENSIONS_XLS = {'xlsx', 'xls'} # Excel files
+ALLOWED_EXTENSIONS_AUDIO = {'mp3', 'wav', 'ogg', 'm4a', 'flac'}
 
 # File Upload Configuration
 UPLOAD_FOLDER = 'uploads' # For temporary storage of user uploads
@@ -97,7 +113,21 @@ if not os.path.exists(PROCESSED_FOLDER):
 
 
 # --- Flask App Setup ---
+class StreamingUploadRequest(Request):
+    """
+    Parses uploaded files into HashingUploadStreams: hashed and size-checked while the body
+    is read, kept in memory when small and spilled straight into UPLOAD_FOLDER when large,
+    so store_upload() can move the file into place instead of copying it again.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingUploadStream(current_app.config['UPLOAD_FOLDER'],
+                                   max_bytes=current_app.config['MAX_CONTENT_LENGTH'],
+                                   filename=filename)
+
+
 app = Flask(__name__)
+app.request_class = StreamingUploadRequest
 app.config.from_object(Config)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['PROCESSED_FOLDER'] = PROCESSED_FOLDER
@@ -113,6 +143,59 @@ Config.init_app(app)
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
 
+# Worker pool for long-running jobs (e.g. Excel row processing) so requests return immediately
+job_manager = JobManager(max_workers=app.config['JOB_WORKERS'],
+                         retention_seconds=app.config['JOB_RETENTION_SECONDS'])
+# Image generation and editor jobs get their own pool so they never queue behind long Excel or story jobs
+image_job_manager = JobManager(max_workers=app.config['IMAGE_JOB_WORKERS'],
+                               retention_seconds=app.config['JOB_RETENTION_SECONDS'])
+
+
+def find_job(job_id):
+    """Looks a job up in every job pool."""
+    return job_manager.get(job_id) or image_job_manager.get(job_id)
+
+# Every Gemini call goes through the shared limiter so concurrent users stay inside the quota
+gemini_limiter.configure(app.config['GEMINI_RATE_LIMITS'])
+
+# Disk-backed cache of Gemini text responses (repeated prompts cost no quota)
+response_cache.configure(path=app.config['RESPONSE_CACHE_PATH'],
+                         max_bytes=app.config['RESPONSE_CACHE_MAX_BYTES'],
+                         max_age_seconds=app.config['RESPONSE_CACHE_MAX_AGE_SECONDS'])
+
+# Journal of finished rows so interrupted row-by-row jobs can resume
+checkpoints.configure(path=app.config['CHECKPOINT_PATH'])
+
+# Uploaded media is indexed by content hash so the same file is not uploaded to Gemini twice
+gemini_file_index.configure(path=app.config['GEMINI_FILE_INDEX_PATH'])
+# One background thread waits for uploaded files to finish PROCESSING, with adaptive intervals
+gemini_file_poller.configure(get_file=lambda name: genai.get_file(name),
+                             initial_interval=app.config['GEMINI_FILE_POLL_INITIAL_SECONDS'],
+                             max_interval=app.config['GEMINI_FILE_POLL_MAX_SECONDS'],
+                             timeout_seconds=app.config['GEMINI_FILE_PROCESSING_TIMEOUT_SECONDS'])
+
+# Generated and edited images live in a content-addressed store with a disk quota
+asset_store.configure(directory=app.config['ASSET_STORE_DIR'], index_path=app.config['ASSET_INDEX_PATH'],
+                      max_bytes=app.config['ASSET_STORE_MAX_BYTES'], max_age_seconds=app.config['ASSET_STORE_MAX_AGE_SECONDS'])
+# "Download all" archives are streamed and kept, so the same batch is zipped only once
+archive_cache.configure(directory=app.config['ARCHIVE_CACHE_DIR'], max_bytes=app.config['ARCHIVE_CACHE_MAX_BYTES'])
+# Thumbnails and previews for the galleries are built in the background as images are saved
+derivative_pool.configure(max_workers=app.config['IMAGE_DERIVATIVE_WORKERS'],
+                          sizes=app.config['IMAGE_DERIVATIVE_SIZES'], quality=app.config['IMAGE_DERIVATIVE_QUALITY'])
+
+# Parsed workbooks are kept as sidecars so re-uploading the same file skips Excel parsing
+workbook_cache.configure(directory=app.config['WORKBOOK_CACHE_DIR'], max_bytes=app.config['WORKBOOK_CACHE_MAX_BYTES'])
+
+# Large shared prompt prefixes (e.g. a long Excel row template) are registered once as cached content
+if app.config['CONTEXT_CACHE_BACKEND'] == 'gemini' and hasattr(genai, 'caching'):
+    context_cache.configure(GeminiContextBackend(genai),
+                            ttl_seconds=app.config['CONTEXT_CACHE_TTL_SECONDS'],
+                            min_prefix_tokens=app.config['CONTEXT_CACHE_MIN_TOKENS'])
+elif app.config['CONTEXT_CACHE_BACKEND'] == 'local':
+    context_cache.configure(LocalContextBackend(lambda model, prompt: genai.GenerativeModel(model).generate_content(prompt).text),
+                            ttl_seconds=app.config['CONTEXT_CACHE_TTL_SECONDS'],
+                            min_prefix_tokens=app.config['CONTEXT_CACHE_MIN_TOKENS'])
+
 # --- Helper Functions ---
 
 def allowed_file(filename, allowed_extensions):
@@ -120,62 +203,93 @@ def allowed_file(filename, allowed_extensions):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
-def upload_file_to_gemini(filepath, mime_type=None):
+def _discard_gemini_file(file, reason):
+    """Deletes a Gemini file that never became usable and drops it from the index."""
+    try:
+        gemini_file_index.forget(file.name)
+        genai.delete_file(file.name)
+        print(f"Deleted {reason} Gemini file: {file.name}")
+    except Exception as del_e:
+        print(f"Could not delete {reason} Gemini file {file.name}: {del_e}")
+
+
+def start_gemini_upload(filepath, mime_type=None, sha256=None):
     """
-    Uploads a file to the Gemini API Files service and waits for it to become ACTIVE.
-    Handles PROCESSING, FAILED states, and includes a timeout.
-    Returns the file object if successful, None otherwise.
+    Uploads a file to the Gemini API Files service (or reuses the live Gemini file with the
+    same content hash) and returns a Future that resolves to the ACTIVE file object, or to
+    None if upload or processing failed. Waiting for PROCESSING to finish is done by the
+    shared background poller, so no request thread is tied up while Gemini processes the file.
     """
-    print(f"Uploading file to Gemini: {filepath}")
+    result = Future()
     try:
-        file = genai.upload_file(path=filepath, mime_type=mime_type)
-        print(f"Uploaded file '{file.display_name}' as: {file.name} ({file.uri}). Initial State: {file.state.name}")
-
-        processing_start_time = time.time()
-        processing_timeout_seconds = 600 # 10 minutes timeout for Gemini processing
-
-        while file.state.name == "PROCESSING":
-            print(f"Processing file... (URI: {file.name}) Elapsed: {time.time() - processing_start_time:.0f}s")
-            time.sleep(10) # Check status every 10 seconds
-            file = genai.get_file(file.name) # Get updated status
-
-            if time.time() - processing_start_time > processing_timeout_seconds:
-                 print(f"File processing timed out after {processing_timeout_seconds} seconds. URI: {file.name}")
-                 try:
-                     genai.delete_file(file.name)
-                     print(f"Attempted to delete timed-out Gemini file: {file.name}")
-                 except Exception as del_e:
-                     print(f"Could not delete timed-out Gemini file {file.name}: {del_e}")
-                 return None # Indicate timeout failure
-
-        if file.state.name == "FAILED":
-            print(f"Gemini file processing failed. URI: {file.name}, State Details: {file.state}")
+        sha256 = sha256 or file_sha256(filepath)
+        file = None
+        cached_name = gemini_file_index.lookup(sha256, mime_type)
+        if cached_name:
             try:
-                genai.delete_file(file.name)
-                print(f"Deleted failed Gemini file resource: {file.name}")
-            except Exception as del_e:
-                print(f"Could not delete failed Gemini file {file.name}: {del_e}")
-            return None # Indicate failure
+                file = genai.get_file(cached_name)
+                if file.state.name in ("ACTIVE", "PROCESSING"):
+                    print(f"Reusing Gemini file {file.name} for {filepath} (state {file.state.name}).")
+                else:
+                    gemini_file_index.forget(cached_name)
+                    file = None
+            except Exception as get_e:
+                print(f"Indexed Gemini file {cached_name} is no longer available: {get_e}")
+                gemini_file_index.forget(cached_name)
+                file = None
+
+        if file is None:
+            print(f"Uploading file to Gemini: {filepath}")
+            file = genai.upload_file(path=filepath, mime_type=mime_type)
+            print(f"Uploaded file '{file.display_name}' as: {file.name} ({file.uri}). Initial State: {file.state.name}")
+    except Exception as e:
+        print(f"Error during file upload for {filepath} with Gemini: {e}")
+        # If a file object exists from the upload attempt, try deleting it
+        if 'file' in locals() and hasattr(file, 'name'):
+            _discard_gemini_file(file, "partially uploaded")
+        result.set_result(None) # Indicate failure
+        return result
 
-        if file.state.name != "ACTIVE":
-             print(f"File is not active after processing. State: {file.state.name}. URI: {file.name}")
-             # Optional: Delete if not active? Depends on policy.
-             # delete_gemini_file(file) # Consider uncommenting if non-ACTIVE states should be cleaned up
-             return None # Indicate non-active state failure
+    processing_start_time = time.time()
 
-        print(f"File is ACTIVE and ready: {file.uri}")
-        return file
+    def on_processed(poll_future):
+        try:
+            processed = poll_future.result()
+        except Exception as poll_e:
+            print(f"File processing failed or timed out for {file.name}: {poll_e}")
+            _discard_gemini_file(file, "timed-out")
+            result.set_result(None)
+            return
+        if processed.state.name == "FAILED":
+            print(f"Gemini file processing failed. URI: {processed.name}, State Details: {processed.state}")
+            _discard_gemini_file(processed, "failed")
+            result.set_result(None)
+        elif processed.state.name != "ACTIVE":
+            print(f"File is not active after processing. State: {processed.state.name}. URI: {processed.name}")
+            result.set_result(None)
+        else:
+            print(f"File is ACTIVE and ready after {time.time() - processing_start_time:.1f}s: {processed.uri}")
+            gemini_file_index.record(sha256, mime_type, processed)
+            result.set_result(processed)
 
-    except Exception as e:
-        print(f"Error during file upload/processing for {filepath} with Gemini: {e}")
-        # If a file object exists from upload attempt but failed during status checks, try deleting
-        if 'file' in locals() and hasattr(file, 'name'):
-             try:
-                 genai.delete_file(file.name)
-                 print(f"Attempted delete on Gemini file due to exception during processing: {file.name}")
-             except Exception as del_e:
-                  print(f"Could not delete Gemini file {file.name} after exception: {del_e}")
-        return None # Indicate failure
+    gemini_file_poller.watch(file).add_done_callback(on_processed)
+    return result
+
+
+def upload_file_to_gemini(filepath, mime_type=None, sha256=None):
+    """
+    Uploads a file to the Gemini API Files service and waits for it to become ACTIVE.
+    Same as start_gemini_upload() but blocking; returns the file object, or None on failure.
+    Blocking is intentional: the form routes call this only when no prepared upload was
+    sent, and their very next step is the generation call that needs the file. The
+    processing wait itself runs on the shared poller, not in a per-request loop.
+    """
+    return start_gemini_upload(filepath, mime_type=mime_type, sha256=sha256).result()
+
+
+# Files picked in the browser start uploading right away (POST /uploads) and the form only sends their id
+prepared_uploads.configure(start_upload=start_gemini_upload,
+                           retention_seconds=app.config['PREPARED_UPLOAD_RETENTION_SECONDS'])
 
 
 def delete_gemini_file(file_obj):
@@ -183,6 +297,7 @@ def delete_gemini_file(file_obj):
     if file_obj and hasattr(file_obj, 'name'):
         try:
             print(f"Attempting to delete Gemini file: {file_obj.name}")
+            gemini_file_index.forget(file_obj.name)
             genai.delete_file(file_obj.name)
             print(f"Successfully deleted Gemini file: {file_obj.name}")
         except Exception as e:
@@ -192,6 +307,30 @@ def delete_gemini_file(file_obj):
         print("No valid Gemini file object provided for deletion.")
 
 
+def prepare_uploaded_image(filepath):
+    """Downscaled/stripped copy of an uploaded image, or the original bytes if it already fits (see image_prep)."""
+    prepared = prepare_image(filepath, max_side=app.config['IMAGE_MAX_SIDE'], jpeg_quality=app.config['IMAGE_JPEG_QUALITY'])
+    print(f"Image {os.path.basename(filepath)}: {prepared.describe()}")
+    return prepared
+
+
+def shrink_uploaded_image(filepath):
+    """
+    Replaces an uploaded image with its downscaled copy when that is smaller and returns the
+    MIME type to upload it with, or None (let Gemini detect it) if the file was left as is.
+    """
+    try:
+        prepared = prepare_uploaded_image(filepath)
+    except Exception as e:
+        print(f"Could not preprocess image {filepath}, uploading the original: {e}")
+        return None
+    if not prepared.reencoded:
+        return None
+    with open(filepath, 'wb') as f:
+        f.write(prepared.data)
+    return prepared.mime_type
+
+
 # --- Context processor to add year to footer ---
 @app.context_processor
 def inject_now():
@@ -219,10 +358,16 @@ def feature_text():
 
         try:
             print(f"Generating text for prompt: {prompt[:100]}...")
-            model = genai.GenerativeModel(model_name)
-            response = model.generate_content(prompt)
-            result_text = response.text
-            print("Text generation successful.")
+            result_text = response_cache.get(model_name, prompt)
+            if result_text is not None:
+                print("Text generation served from cache.")
+            else:
+                model = genai.GenerativeModel(model_name)
+                gemini_limiter.acquire(model_name, estimate_tokens(prompt))
+                response = model.generate_content(prompt)
+                result_text = response.text
+                response_cache.set(model_name, prompt, result_text)
+                print("Text generation successful.")
             # Pass prompts data along with results
             return render_template('feature_text.html',
                                    prompt=prompt,
@@ -254,29 +399,37 @@ def feature_pdf():
         original_filename = None
         local_filepath = None # Renamed for clarity
         gemini_file = None
+        # File picked earlier and already sent to Gemini in the background (see /uploads)
+        prepared = prepared_uploads.get(request.form.get('upload_id', ''), 'pdf')
 
         # Validation
         if not prompt: flash('Please enter a prompt for the PDF.', 'error'); return render_template('feature_pdf.html', prompts_data=PROMPT_CATEGORIES)
-        if not file or file.filename == '': flash('No PDF file selected.', 'error'); return render_template('feature_pdf.html', prompt=prompt, prompts_data=PROMPT_CATEGORIES)
-        if not allowed_file(file.filename, ALLOWED_EXTENSIONS_PDF): flash('Invalid file type. Please upload a PDF.', 'error'); return render_template('feature_pdf.html', prompt=prompt, prompts_data=PROMPT_CATEGORIES)
+        if not prepared and (not file or file.filename == ''): flash('No PDF file selected.', 'error'); return render_template('feature_pdf.html', prompt=prompt, prompts_data=PROMPT_CATEGORIES)
+        if not prepared and not allowed_file(file.filename, ALLOWED_EXTENSIONS_PDF): flash('Invalid file type. Please upload a PDF.', 'error'); return render_template('feature_pdf.html', prompt=prompt, prompts_data=PROMPT_CATEGORIES)
 
         try:
-            original_filename = secure_filename(file.filename)
-            timestamp = time.strftime("%Y%m%d-%H%M%S")
-            filename = f"{timestamp}-{original_filename}"
-            local_filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            if prepared:
+                original_filename = prepared.filename
+                print(f"Using pre-uploaded pdf '{original_filename}' ({prepared.status}).")
+                gemini_file = prepared.future.result()
+            else:
+                original_filename = secure_filename(file.filename)
+                timestamp = time.strftime("%Y%m%d-%H%M%S")
+                filename = f"{timestamp}-{original_filename}"
+                local_filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
 
-            file.save(local_filepath)
-            print(f"PDF saved locally: {local_filepath}")
+                file_hash = store_upload(file, local_filepath)
+                print(f"PDF saved locally: {local_filepath}")
 
-            # Upload local file to Gemini Files API
-            gemini_file = upload_file_to_gemini(local_filepath, mime_type='application/pdf')
+                # Upload local file to Gemini Files API (reused if the same PDF is still live there)
+                gemini_file = upload_file_to_gemini(local_filepath, mime_type='application/pdf', sha256=file_hash)
             if not gemini_file:
                 flash('Failed to upload or process PDF file with Gemini. Check logs.', 'error')
                 raise ValueError("Gemini file upload/processing failed.") # Go to finally for cleanup
 
             print(f"Generating content for PDF '{original_filename}' with prompt: {prompt[:50]}...")
             model = genai.GenerativeModel(model_name)
+            gemini_limiter.acquire(model_name, estimate_tokens(prompt))
             response = model.generate_content([prompt, gemini_file]) # Pass file obj
 
             result_text = response.text
@@ -299,10 +452,8 @@ def feature_pdf():
                     print(f"Removed temporary local file: {local_filepath}")
                 except Exception as e:
                     print(f"Warning: Could not remove temporary file {local_filepath}: {e}")
-
-            # Clean up Gemini file if it exists and we had an error
-            if gemini_file and 'error_message' in locals():
-                delete_gemini_file(gemini_file)
+            # The Gemini file is shared through the file index and prepared uploads, so a failed
+            # generation (e.g. a 429) keeps it; failed uploads are discarded by start_gemini_upload
 
     # GET request: show the empty form and pass prompt data
     return render_template('feature_pdf.html', prompts_data=PROMPT_CATEGORIES)
@@ -318,27 +469,37 @@ def feature_image():
         original_filename = None
         local_filepath = None
         gemini_file = None
+        # File picked earlier and already sent to Gemini in the background (see /uploads)
+        prepared = prepared_uploads.get(request.form.get('upload_id', ''), 'image')
 
         # Validation
         if not prompt: flash('Please enter a prompt for the image.', 'error'); return render_template('feature_image.html', prompts_data=PROMPT_CATEGORIES)
-        if not file or file.filename == '': flash('No image file selected.', 'error'); return render_template('feature_image.html', prompt=prompt, prompts_data=PROMPT_CATEGORIES)
-        if not allowed_file(file.filename, ALLOWED_EXTENSIONS_IMG): flash(f'Invalid file type. Allowed: {", ".join(ALLOWED_EXTENSIONS_IMG)}', 'error'); return render_template('feature_image.html', prompt=prompt, prompts_data=PROMPT_CATEGORIES)
+        if not prepared and (not file or file.filename == ''): flash('No image file selected.', 'error'); return render_template('feature_image.html', prompt=prompt, prompts_data=PROMPT_CATEGORIES)
+        if not prepared and not allowed_file(file.filename, ALLOWED_EXTENSIONS_IMG): flash(f'Invalid file type. Allowed: {", ".join(ALLOWED_EXTENSIONS_IMG)}', 'error'); return render_template('feature_image.html', prompt=prompt, prompts_data=PROMPT_CATEGORIES)
 
         try:
-            original_filename = secure_filename(file.filename)
-            timestamp = time.strftime("%Y%m%d-%H%M%S")
-            filename = f"{timestamp}-{original_filename}"
-            local_filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(local_filepath)
-            print(f"Image saved locally: {local_filepath}")
-
-            gemini_file = upload_file_to_gemini(local_filepath) # Let Gemini detect mime type
+            if prepared:
+                original_filename = prepared.filename
+                print(f"Using pre-uploaded image '{original_filename}' ({prepared.status}).")
+                gemini_file = prepared.future.result()
+            else:
+                original_filename = secure_filename(file.filename)
+                timestamp = time.strftime("%Y%m%d-%H%M%S")
+                filename = f"{timestamp}-{original_filename}"
+                local_filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+                file_hash = store_upload(file, local_filepath)
+                print(f"Image saved locally: {local_filepath}")
+
+                # Oversized photos are downscaled first; the index still keys on the original's hash
+                mime_type = shrink_uploaded_image(local_filepath)
+                gemini_file = upload_file_to_gemini(local_filepath, mime_type=mime_type, sha256=file_hash) # None: let Gemini detect mime type
             if not gemini_file:
                 flash('Failed to upload or process image file with Gemini. Check logs.', 'error')
                 raise ValueError("Gemini file upload/processing failed.")
 
             print(f"Generating content for Image '{original_filename}' with prompt: {prompt[:50]}...")
             model = genai.GenerativeModel(model_name) # 1.5 models handle vision
+            gemini_limiter.acquire(model_name, estimate_tokens(prompt))
             response = model.generate_content([prompt, gemini_file])
 
             result_text = response.text
@@ -355,12 +516,11 @@ def feature_image():
             return render_template('feature_image.html', prompt=request.form.get('prompt_image'), prompts_data=PROMPT_CATEGORIES)
 
         finally:
-            # Cleanup local temp file AND Gemini file resource
+            # Cleanup local temp file; the Gemini file stays live for reuse, even if generation
+            # failed (failed uploads are already discarded by start_gemini_upload)
             if local_filepath and os.path.exists(local_filepath):
                 try: os.remove(local_filepath); print(f"Removed local file: {local_filepath}")
                 except Exception as e_rem: print(f"Error removing local file {local_filepath}: {e_rem}")
-            if gemini_file:
-                delete_gemini_file(gemini_file)
 
     # GET request
     return render_template('feature_image.html', prompts_data=PROMPT_CATEGORIES)
@@ -376,29 +536,37 @@ def feature_video():
         original_filename = None
         local_filepath = None
         gemini_file = None
+        # File picked earlier and already sent to Gemini in the background (see /uploads)
+        prepared = prepared_uploads.get(request.form.get('upload_id', ''), 'video')
 
         # Validation
         if not prompt: flash('Please enter a prompt for the video.', 'error'); return render_template('feature_video.html', prompts_data=PROMPT_CATEGORIES)
-        if not file or file.filename == '': flash('No video file selected.', 'error'); return render_template('feature_video.html', prompt=prompt, prompts_data=PROMPT_CATEGORIES)
-        if not allowed_file(file.filename, ALLOWED_EXTENSIONS_VID): flash(f'Invalid file type. Allowed: {", ".join(ALLOWED_EXTENSIONS_VID)}', 'error'); return render_template('feature_video.html', prompt=prompt, prompts_data=PROMPT_CATEGORIES)
+        if not prepared and (not file or file.filename == ''): flash('No video file selected.', 'error'); return render_template('feature_video.html', prompt=prompt, prompts_data=PROMPT_CATEGORIES)
+        if not prepared and not allowed_file(file.filename, ALLOWED_EXTENSIONS_VID): flash(f'Invalid file type. Allowed: {", ".join(ALLOWED_EXTENSIONS_VID)}', 'error'); return render_template('feature_video.html', prompt=prompt, prompts_data=PROMPT_CATEGORIES)
 
         try:
-            original_filename = secure_filename(file.filename)
-            timestamp = time.strftime("%Y%m%d-%H%M%S")
-            filename = f"{timestamp}-{original_filename}"
-            local_filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(local_filepath)
-            file_size_mb = os.path.getsize(local_filepath) / (1024*1024)
-            print(f"Video saved locally: {local_filepath}, Size: {file_size_mb:.2f} MB")
-
-            print("Starting video upload/processing with Gemini (can take minutes)...")
-            gemini_file = upload_file_to_gemini(local_filepath) # Let Gemini detect mime type
+            if prepared:
+                original_filename = prepared.filename
+                print(f"Using pre-uploaded video '{original_filename}' ({prepared.status}).")
+                gemini_file = prepared.future.result()
+            else:
+                original_filename = secure_filename(file.filename)
+                timestamp = time.strftime("%Y%m%d-%H%M%S")
+                filename = f"{timestamp}-{original_filename}"
+                local_filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+                file_hash = store_upload(file, local_filepath)
+                file_size_mb = os.path.getsize(local_filepath) / (1024*1024)
+                print(f"Video saved locally: {local_filepath}, Size: {file_size_mb:.2f} MB")
+
+                print("Starting video upload/processing with Gemini (can take minutes)...")
+                gemini_file = upload_file_to_gemini(local_filepath, sha256=file_hash) # Let Gemini detect mime type
             if not gemini_file:
                 flash('Failed to upload or process video file with Gemini. Check logs. This can take time.', 'error')
                 raise ValueError("Gemini file upload/processing failed.")
 
             print(f"Video processed. Generating content for '{original_filename}' with prompt: {prompt[:50]}...")
             model = genai.GenerativeModel(model_name) # Ensure model supports video (e.g., 1.5 Pro)
+            gemini_limiter.acquire(model_name, estimate_tokens(prompt))
             response = model.generate_content([prompt, gemini_file])
 
             result_text = response.text
@@ -417,23 +585,145 @@ def feature_video():
             return render_template('feature_video.html', prompt=request.form.get('prompt_video'), prompts_data=PROMPT_CATEGORIES)
 
         finally:
-            # Cleanup local temp file AND Gemini file resource
+            # Cleanup local temp file; the Gemini file stays live for reuse, even if generation
+            # failed (failed uploads are already discarded by start_gemini_upload)
             if local_filepath and os.path.exists(local_filepath):
                 try: os.remove(local_filepath); print(f"Removed local file: {local_filepath}")
                 except Exception as e_rem: print(f"Error removing local file {local_filepath}: {e_rem}")
-            if gemini_file:
-                delete_gemini_file(gemini_file)
 
     # GET request
     return render_template('feature_video.html', prompts_data=PROMPT_CATEGORIES)
 
 
 # --- 5. Excel AI Prompter (Summary) ---
+def analyze_excel_chunk(model, prompt, chunk, part_number, total_parts):
+    """Map step: answers the prompt for one row range of one sheet."""
+    sheet_name, first_row, last_row, chunk_csv = chunk
+    map_prompt = (f"User Prompt: {prompt}\n\nThis is part {part_number} of {total_parts} of a large Excel workbook: "
+                  f"sheet '{sheet_name}', rows {first_row}-{last_row}. Answer the prompt for this part only and "
+                  "keep the key figures (counts, totals, extremes, notable rows) so the parts can be combined later.\n"
+                  f"```csv\n{chunk_csv}```")
+    cached_result = response_cache.get(model_name, map_prompt)
+    if cached_result is not None:
+        return cached_result
+
+    def call():
+        gemini_limiter.acquire(model_name, estimate_tokens(map_prompt))
+        return model.generate_content(map_prompt).text
+
+    result, error_marker = call_with_backoff(call, f"EXCEL PART {part_number}/{total_parts}")
+    if error_marker:
+        return error_marker
+    response_cache.set(model_name, map_prompt, result)
+    return result
+
+
+def reduce_excel_answers(model, prompt, partials, overview, final):
+    """Reduce step: merges partial answers into one (the final answer, or a bigger partial)."""
+    if final:
+        instruction = ("Combine the partial analyses into one answer to the user prompt for the whole workbook. "
+                       "Add up or reconcile figures across parts where needed and do not mention the parts.")
+    else:
+        instruction = "Merge these partial analyses into one partial analysis covering all of their rows, keeping the key figures."
+    reduce_prompt = (f"User Prompt: {prompt}\n\nThe workbook was too large for one request, so it was split into row "
+                     f"ranges that were analysed separately.\n{overview}\n\nPartial analyses:\n"
+                     + "\n\n".join(partials) + f"\n\n{instruction}")
+
+    def call():
+        gemini_limiter.acquire(model_name, estimate_tokens(reduce_prompt))
+        return model.generate_content(reduce_prompt).text
+
+    result, error_marker = call_with_backoff(call, "EXCEL REDUCE")
+    if error_marker:
+        raise RuntimeError(f"Could not combine the partial analyses: {error_marker}")
+    return result
+
+
+def map_reduce_workbook(model, prompt, sheets, original_filename, job=None):
+    """
+    Analyses a workbook that does not fit the context budget: every sheet is split into row
+    chunks of EXCEL_MAP_CHUNK_TOKENS, the chunks are analysed concurrently (under the shared
+    rate limit) and the partial answers are merged by a final reduce call. If the partial
+    answers are too large for one reduce call, they are merged in groups first.
+    Chunks that fail are left out of the reduce step and listed in a note after the answer.
+    """
+    chunk_tokens = app.config['EXCEL_MAP_CHUNK_TOKENS']
+    total_tokens = estimate_workbook_tokens(sheets)
+    # Grow the chunks rather than exceed the chunk cap on huge workbooks
+    chunk_tokens = max(chunk_tokens, math.ceil(total_tokens / app.config['EXCEL_MAP_MAX_CHUNKS']))
+    chunks = list(chunk_sheets(sheets, chunk_tokens))
+    total_parts = len(chunks)
+    print(f"[EXCEL MAP-REDUCE] {total_parts} chunks of ~{chunk_tokens} tokens from {len(sheets)} sheets.")
+    if job:
+        job.set_total(total_parts + 1)  # Every chunk plus the final reduce
+
+    partials = [None] * total_parts
+    failed_parts = []
+    with ThreadPoolExecutor(max_workers=app.config['EXCEL_MAP_CONCURRENCY'], thread_name_prefix="excel-map") as executor:
+        futures = {executor.submit(analyze_excel_chunk, model, prompt, chunk, number + 1, total_parts): number
+                   for number, chunk in enumerate(chunks)}
+        for future in as_completed(futures):
+            number = futures[future]
+            sheet_name, first_row, last_row, _ = chunks[number]
+            try:
+                answer = future.result()
+            except Exception as chunk_e:
+                answer = f"[API_ERROR: {str(chunk_e)[:100]}]"
+            if answer.startswith("[API_ERROR"):
+                # An error marker is not an analysis: keep it out of the reduce prompt
+                failed_parts.append((number, f"sheet '{sheet_name}', rows {first_row}-{last_row}: {answer}"))
+                print(f"[EXCEL MAP-REDUCE] Part {number + 1}/{total_parts} failed: {answer}")
+            else:
+                partials[number] = f"--- Part {number + 1}: sheet '{sheet_name}', rows {first_row}-{last_row} ---\n{answer}"
+                print(f"[EXCEL MAP-REDUCE] Part {number + 1}/{total_parts} done.")
+            if job:
+                job.advance(message=f"Part {number + 1}/{total_parts} analysed")
+
+    partials = [partial for partial in partials if partial is not None]
+    failed_parts = [description for _, description in sorted(failed_parts)]
+    if not partials:
+        raise RuntimeError(f"None of the {total_parts} parts could be analysed. First error: {failed_parts[0]}")
+    overview, _ = build_workbook_context(sheets, 'profile', app.config['EXCEL_CONTEXT_TOKEN_BUDGET'] // 10)
+    overview = f"Overview of '{original_filename}':\n{overview}"
+    reduce_budget = app.config['EXCEL_CONTEXT_TOKEN_BUDGET']
+    while len(partials) > 1 and estimate_tokens("\n\n".join(partials)) > reduce_budget:
+        groups = list(iter_row_batches(enumerate(partials), len(partials), reduce_budget))
+        if len(groups) == len(partials):
+            break  # Every answer is already as big as the budget; merging cannot shrink further
+        print(f"[EXCEL MAP-REDUCE] Merging {len(partials)} partial answers in {len(groups)} groups.")
+        with ThreadPoolExecutor(max_workers=app.config['EXCEL_MAP_CONCURRENCY'], thread_name_prefix="excel-reduce") as executor:
+            partials = list(executor.map(
+                lambda group: reduce_excel_answers(model, prompt, [text for _, text in group], overview, final=False),
+                groups))
+    if job:
+        job.set_message("Combining the partial analyses...")
+    result_text = reduce_excel_answers(model, prompt, partials, overview, final=True)
+    if failed_parts:
+        result_text += (f"\n\n[Note: {len(failed_parts)} of {total_parts} parts could not be analysed and are not "
+                        "included above:\n" + "\n".join(f"- {description}" for description in failed_parts) + "]")
+    return result_text
+
+
+def run_excel_mapreduce_job(job, model, prompt, sheets, original_filename, output_filepath):
+    """Background worker for map-reduce mode: analyses the workbook and saves the answer as a text file."""
+    result_text = map_reduce_workbook(model, prompt, sheets, original_filename, job)
+    with open(output_filepath, 'w', encoding='utf-8') as f:
+        f.write(result_text)
+    job.advance(message="Analysis complete.")
+    job.set_result(output_filepath, os.path.basename(output_filepath))
+
+
 @app.route('/feature/excel', methods=['GET', 'POST'])
 def feature_excel():
-    """Handles Excel upload, extracts text, sends to Gemini for summary/insights."""
+    """
+    Handles Excel upload, turns the workbook into a token-bounded profile, raw CSV or both
+    (the 'excel_mode' form field) and sends it to Gemini for summary/insights.
+    """
     if request.method == 'POST':
         prompt = request.form.get('prompt_excel')
+        excel_mode = request.form.get('excel_mode', app.config['EXCEL_DEFAULT_MODE'])
+        if excel_mode not in EXCEL_MODES:
+            excel_mode = app.config['EXCEL_DEFAULT_MODE']
         file = request.files.get('file_excel')
         original_filename = None
         local_filepath = None
@@ -451,51 +741,55 @@ def feature_excel():
             file.save(local_filepath)
             print(f"Excel file saved locally: {local_filepath}")
 
-            # Read Excel Content using Pandas
-            excel_data_string = ""
-            max_chars_to_read = 150000 # Increased limit slightly
+            # Read Excel Content using Pandas and turn it into a token-bounded summary
             try:
-                xls = pd.ExcelFile(local_filepath)
-                temp_string = io.StringIO()
-                temp_string.write(f"Summary of Excel file '{original_filename}':\n")
-                total_chars = len(temp_string.getvalue())
-
-                for sheet_name in xls.sheet_names:
-                    if total_chars >= max_chars_to_read: temp_string.write("\n[Data truncated]"); break
-                    df = pd.read_excel(xls, sheet_name=sheet_name)
-                    sheet_csv = df.to_csv(index=False, lineterminator='\n')
-                    sheet_header = f"\n--- Sheet: {sheet_name} ---\n"
-                    chars_to_add = len(sheet_header) + len(sheet_csv)
-
-                    if total_chars + chars_to_add <= max_chars_to_read:
-                        temp_string.write(sheet_header)
-                        temp_string.write(sheet_csv)
-                        total_chars += chars_to_add
-                    else:
-                         remaining_chars = max_chars_to_read - total_chars
-                         if remaining_chars > len(sheet_header) + 50: # Need space for header + some data
-                            temp_string.write(sheet_header)
-                            temp_string.write(sheet_csv[:remaining_chars - len(sheet_header) - 1])
-                         temp_string.write("\n[Data truncated]")
-                         break
-
-                excel_data_string = temp_string.getvalue()
-                temp_string.close()
-                print(f"Extracted data from Excel (approx {len(excel_data_string)} chars).")
+                sheets = workbook_cache.load_sheets(local_filepath)
+                truncated = False
+                if excel_mode == 'mapreduce':
+                    # Map-reduce only kicks in when the raw sheets do not fit in one request;
+                    # the size is estimated from a sample so large workbooks are not rendered twice
+                    workbook_tokens = estimate_workbook_tokens(sheets)
+                    print(f"Workbook '{original_filename}' is approx {workbook_tokens} tokens as CSV.")
+                    excel_context = None
+                    if workbook_tokens <= app.config['EXCEL_CONTEXT_TOKEN_BUDGET']:
+                        excel_context, truncated = build_workbook_context(sheets, 'raw', app.config['EXCEL_CONTEXT_TOKEN_BUDGET'])
+                        if truncated:
+                            excel_context = None
+                else:
+                    excel_context, truncated = build_workbook_context(sheets, excel_mode, app.config['EXCEL_CONTEXT_TOKEN_BUDGET'])
+                    print(f"Built '{excel_mode}' context from {len(sheets)} sheets (approx {estimate_tokens(excel_context)} tokens, truncated: {truncated}).")
+                if truncated and excel_mode == 'raw':
+                    flash("The workbook is larger than the context budget, so only part of the raw data was sent. Profile or hybrid mode cover every sheet.", 'info')
             except Exception as read_e:
                 print(f"Error reading Excel file {local_filepath}: {read_e}")
                 flash(f"Could not read the Excel file. Error: {read_e}", 'error')
                 raise # Trigger cleanup
 
-            # Generate Content using Gemini with extracted text
-            combined_prompt = f"User Prompt: {prompt}\n\nData from the uploaded Excel file:\n```csv\n{excel_data_string}\n```"
-            print(f"Generating content based on Excel data and prompt: {prompt[:50]}...")
+            # Generate Content using Gemini with the workbook context
             model = genai.GenerativeModel(model_name)
+            if excel_mode == 'mapreduce' and excel_context is None:
+                # One call per chunk can take minutes: run it as a background job
+                print(f"Workbook exceeds the context budget, analysing it in chunks for prompt: {prompt[:50]}...")
+                output_filename = f"{os.path.splitext(filename)[0]}_analysis.txt"
+                output_filepath = os.path.join(app.config['PROCESSED_FOLDER'], output_filename)
+                job = job_manager.submit('excel_mapreduce', run_excel_mapreduce_job, model, prompt, sheets,
+                                         original_filename, output_filepath)
+                flash("The workbook is larger than one request, so it is being analysed in parts in the background.", 'info')
+                return render_template('feature_excel.html', prompt=prompt, job_id=job.id, filename=original_filename,
+                                       excel_mode=excel_mode, prompts_data=PROMPT_CATEGORIES)
+
+            if excel_mode in ('raw', 'mapreduce'):
+                combined_prompt = f"User Prompt: {prompt}\n\nData from the uploaded Excel file:\n```csv\nSummary of Excel file '{original_filename}':\n{excel_context}\n```"
+            else:
+                combined_prompt = (f"User Prompt: {prompt}\n\nProfile of the uploaded Excel file '{original_filename}' "
+                                   f"(column statistics and representative rows):\n{excel_context}")
+            print(f"Generating content based on Excel data and prompt: {prompt[:50]}...")
+            gemini_limiter.acquire(model_name, estimate_tokens(combined_prompt))
             response = model.generate_content(combined_prompt)
             result_text = response.text
             print("Excel-based content generation successful.")
 
-            return render_template('feature_excel.html', prompt=prompt, result=result_text, filename=original_filename, prompts_data=PROMPT_CATEGORIES)
+            return render_template('feature_excel.html', prompt=prompt, result=result_text, filename=original_filename, excel_mode=excel_mode, prompts_data=PROMPT_CATEGORIES)
 
         except Exception as e:
             error_message = f"An error occurred processing the Excel file request: {e}"
@@ -514,26 +808,358 @@ def feature_excel():
 
 
 # --- 6. Modified AGAIN: Excel Row-by-Row AI Processor with Retry Logic ---
+# Retry configuration for row-by-row processing
+MAX_RETRIES = 7
+INITIAL_RETRY_DELAY_SECONDS = 5 # Start delay at 5 seconds
+MAX_RETRY_DELAY_SECONDS = 60    # Cap delay at 60 seconds
+
+def call_with_backoff(call, label, job=None):
+    """
+    Runs `call()`, retrying with exponential backoff on 429 errors. Only the calling
+    thread sleeps while backing off, so other rows keep going.
+    Returns (result, None) on success or (None, "[API_ERROR: ...]") on failure.
+    """
+    retries = 0
+    current_delay = INITIAL_RETRY_DELAY_SECONDS
+    while True:
+        try:
+            if retries > 0:
+                print(f"[{label}] Retry {retries}/{MAX_RETRIES}...")
+            return call(), None
+
+        except Exception as api_e:
+            # --- Check for Quota Error (429) ---
+            if is_rate_limit_error(api_e):
+                retries += 1
+                if retries > MAX_RETRIES:
+                    print(f"[{label}] ERROR: Max retries ({MAX_RETRIES}) exceeded for quota error.")
+                    return None, f"[API_ERROR: Max retries exceeded - {str(api_e)[:100]}]"
+                # Apply exponential backoff with jitter
+                wait_time = current_delay + random.uniform(0, 1) # Add jitter
+                print(f"[{label}] WARNING: Quota error (429) detected. Retrying in {wait_time:.1f} seconds (Attempt {retries}/{MAX_RETRIES})...")
+                if job:
+                    job.set_message(f"{label}: rate limited, retrying in {wait_time:.0f}s")
+                time.sleep(wait_time)
+                # Increase delay for next time, cap it
+                current_delay = min(current_delay * 2, MAX_RETRY_DELAY_SECONDS)
+            else:
+                # --- Handle Other API Errors ---
+                print(f"[{label}] ERROR: Non-retryable API error: {api_e}")
+                return None, f"[API_ERROR: {str(api_e)[:100]}]"
+
+
+def row_prompt_parts(prompt_template, row_input_text):
+    """Splits a row prompt into the shared template prefix and the per-row suffix."""
+    return f"User Prompt: {prompt_template}\n\n", f"Input Text from Excel Row: {row_input_text}"
+
+
+def process_excel_row(model, prompt_template, row_input_text, row_number, total_rows, job=None):
+    """
+    Sends one row to Gemini, retrying with exponential backoff on 429 errors.
+    Long templates are sent once through the context cache (scoped to the job) and
+    only the row text is sent per call; if the cache cannot be created the full prompt is sent.
+    Returns the AI output, or an [API_ERROR: ...] marker on failure.
+    """
+    template_prefix, row_suffix = row_prompt_parts(prompt_template, row_input_text)
+    combined_row_prompt = template_prefix + row_suffix
+    use_context_cache = job is not None and context_cache.should_cache(template_prefix)
+    cached_result = response_cache.get(model_name1, combined_row_prompt)
+    if cached_result is not None:
+        print(f"[ROW {row_number}/{total_rows}] Served from cache.")
+        return cached_result
+
+    def call():
+        gemini_limiter.acquire(model_name1, estimate_tokens(combined_row_prompt))
+        if use_context_cache:
+            return context_cache.generate(model_name1, template_prefix, row_suffix, scope=job.id,
+                                          fallback=lambda prompt: model.generate_content(prompt).text)
+        return model.generate_content(combined_row_prompt).text
+
+    ai_result, error_marker = call_with_backoff(call, f"ROW {row_number}/{total_rows}", job)
+    if error_marker:
+        return error_marker
+    response_cache.set(model_name1, combined_row_prompt, ai_result)
+    print(f"[ROW {row_number}/{total_rows}] API Success. Output: '{ai_result[:70]}...'")
+    return ai_result
+
+
+def iter_row_batches(rows, batch_size, token_budget):
+    """
+    Groups (position, text) rows into batches of at most `batch_size` rows whose combined
+    input stays under `token_budget` estimated tokens. A row that alone exceeds the
+    budget gets a batch of its own. Batches are yielded as soon as they are full, so
+    `rows` can be a stream.
+    """
+    current, current_tokens = [], 0
+    for position, text in rows:
+        tokens = estimate_tokens(text)
+        if current and (len(current) >= batch_size or current_tokens + tokens > token_budget):
+            yield current
+            current, current_tokens = [], 0
+        current.append((position, text))
+        current_tokens += tokens
+    if current:
+        yield current
+
+
+def parse_batch_response(text, expected_ids):
+    """
+    Parses a batched reply of the form [{"id": 1, "output": "..."}, ...] into {id: output}.
+    Raises ValueError unless every expected id has an answer.
+    """
+    text = text.strip()
+    if text.startswith("```"):
+        # Strip a ```json ... ``` fence in case the model added one anyway
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        text = text.rsplit("```", 1)[0]
+    items = json.loads(text)
+    if isinstance(items, dict):
+        items = items.get("results", items.get("items", []))
+    outputs = {}
+    for item in items:
+        try:
+            outputs[int(item["id"])] = str(item["output"])
+        except (KeyError, TypeError, ValueError):
+            continue
+    missing = [item_id for item_id in expected_ids if item_id not in outputs]
+    if missing:
+        raise ValueError(f"Batch reply is missing items {missing}")
+    return outputs
+
+
+# Batch answers are cached apart from single-row answers (see process_excel_row_batch)
+BATCH_CACHE_CONFIG = {'batch': True}
+
+
+def process_excel_row_batch(model, prompt_template, batch, total_rows, job=None):
+    """
+    Sends several short rows in one request as numbered items and asks for a JSON array
+    with one answer per item (asked for in the prompt and parsed tolerantly). Rows already
+    answered (in a batch or on their own) are not sent again; batch answers are cached under
+    their own key so single-row calls never reuse them.
+    If the reply cannot be split back into rows, the batch falls back to one call per row.
+    Returns {position: output}.
+    """
+    outputs = {}
+    pending = []
+    for position, row_input_text in batch:
+        row_prompt = "".join(row_prompt_parts(prompt_template, row_input_text))
+        cached_result = response_cache.get(model_name1, row_prompt, BATCH_CACHE_CONFIG)
+        if cached_result is None:
+            cached_result = response_cache.get(model_name1, row_prompt)
+        if cached_result is not None:
+            outputs[position] = cached_result
+        else:
+            pending.append((position, row_input_text))
+    if not pending:
+        return outputs
+
+    first_row, last_row = pending[0][0] + 1, pending[-1][0] + 1
+    label = f"ROWS {first_row}-{last_row}/{total_rows}"
+    numbered_items = "\n\n".join(f"Item {item_id}:\n{text}" for item_id, (_, text) in enumerate(pending, start=1))
+    batch_prompt = (
+        f"User Prompt: {prompt_template}\n\n"
+        f"Apply the prompt above separately to each of the {len(pending)} numbered input texts below. "
+        'Reply with only a JSON array containing one object per item, like '
+        '[{"id": 1, "output": "..."}, {"id": 2, "output": "..."}], keeping the item ids.\n\n'
+        f"{numbered_items}"
+    )
+
+    def call():
+        gemini_limiter.acquire(model_name1, estimate_tokens(batch_prompt))
+        return model.generate_content(batch_prompt).text
+
+    try:
+        reply, error_marker = call_with_backoff(call, label, job)
+        if error_marker:
+            raise ValueError(error_marker)
+        answers = parse_batch_response(reply, range(1, len(pending) + 1))
+    except Exception as batch_e:
+        print(f"[{label}] WARNING: Batch failed ({str(batch_e)[:100]}), falling back to single-row calls.")
+        for position, row_input_text in pending:
+            outputs[position] = process_excel_row(model, prompt_template, row_input_text, position + 1, total_rows, job)
+        return outputs
+
+    for item_id, (position, row_input_text) in enumerate(pending, start=1):
+        outputs[position] = answers[item_id]
+        response_cache.set(model_name1, "".join(row_prompt_parts(prompt_template, row_input_text)), answers[item_id],
+                           BATCH_CACHE_CONFIG)
+    print(f"[{label}] API Success. {len(pending)} rows answered in one request.")
+    return outputs
+
+
+def run_excel_row_job(job, input_filepath, input_column_name, prompt_template, output_filepath, concurrency=1,
+                      batch_size=1, batch_token_budget=4000):
+    """
+    Background worker for the Excel row processor. Streams the input column from the workbook
+    and sends rows to Gemini as they are parsed, with up to `concurrency` requests in flight,
+    and writes the results (in the original row order) to `output_filepath` (.xlsx, .csv or
+    .jsonl). Progress is reported through `job` so /jobs/<id> can show it.
+    With `batch_size` > 1, up to that many rows (within `batch_token_budget` tokens) share a request.
+    Finished rows are checkpointed, so resubmitting the same file, column and prompt resumes
+    where an interrupted run stopped. Rows are appended to the output file as they finish,
+    so the results so far can be downloaded from /jobs/<id>/partial while the job runs.
+    """
+    writer = None
+    column_writer = None
+    try:
+        input_digest = file_sha256(input_filepath)
+        checkpoint_key = make_job_key('excel_row', input_digest, input_column_name, prompt_template, model_name1)
+        completed_rows = checkpoints.completed(checkpoint_key)
+        if completed_rows:
+            print(f"[INFO] Resuming from checkpoint: {len(completed_rows)} rows already done.")
+
+        model = genai.GenerativeModel(model_name1)
+        # Row count from the sheet dimensions (cheap); corrected once the stream is exhausted
+        total_rows = count_rows(input_filepath) or 0
+        job.set_total(total_rows)
+        print(f"\n[INFO] Starting row-by-row processing for ~{total_rows} rows ({concurrency} in flight, batches of {batch_size})...")
+        print("-" * 30)
+
+        # Rows are written (in order) as soon as they finish, so only rows in flight stay in memory
+        writer = OrderedRowWriter(open_sink(output_filepath, ['AI Output', f'Original Text ({input_column_name})']))
+        job.set_partial(writer.sink.partial_path)
+        row_inputs = {}  # Input text of rows that are still in flight
+        total_rows_seen = 0
+
+        # Re-runs of the same file (e.g. with a tweaked template) read the column's text from
+        # its sidecar instead of parsing the workbook again. Only the column sidecar is used:
+        # the pickled 'sheets' entry would load the whole workbook, and pandas turns cells such
+        # as "NA" or "null" into missing values (i.e. skipped rows).
+        column_cache_name = f"column-text-{input_column_name}"
+        column_writer = None
+        cached_column = workbook_cache.open_stream(input_digest, column_cache_name)
+        if cached_column is not None:
+            print(f"[INFO] Reading column '{input_column_name}' from the workbook cache.")
+            column_rows = enumerate(cached_column)
+        else:
+            column_rows = ((position, cell_text(value)) for position, value in iter_column(input_filepath, input_column_name))
+            # This column's text is written to a sidecar as it is read and kept once the job succeeds
+            column_writer = workbook_cache.stream_writer(input_digest, column_cache_name)
+
+        def pending_rows():
+            nonlocal total_rows_seen
+            # Handles empty and checkpointed rows inline and passes the rest on to the API stage
+            for position, row_input_text in column_rows:
+                if column_writer is not None:
+                    column_writer.append(row_input_text)
+                total_rows_seen += 1
+
+                if not row_input_text.strip():
+                    print(f"[ROW {position + 1}] Skipping API call (empty input).")
+                    writer.put(position, ["[skipped_empty_input]", row_input_text])
+                    job.advance(message=f"Processed row {position + 1}")
+                    continue
+
+                if position in completed_rows:
+                    writer.put(position, [completed_rows[position], row_input_text])
+                    job.advance(message=f"Row {position + 1} restored from checkpoint")
+                    continue
+
+                row_inputs[position] = row_input_text
+                yield position, row_input_text
+
+        def collect(done_futures):
+            for future in done_futures:
+                positions = futures.pop(future)
+                try:
+                    outputs = future.result()
+                    if not isinstance(outputs, dict):
+                        outputs = {positions[0]: outputs}
+                except Exception as row_e:
+                    outputs = {position: f"[API_ERROR: {str(row_e)[:100]}]" for position in positions}
+                for position in positions:
+                    # Failed rows are not checkpointed so a resubmitted job retries them
+                    if not outputs[position].startswith("[API_ERROR"):
+                        checkpoints.record(checkpoint_key, position, outputs[position])
+                    writer.put(position, [outputs[position], row_inputs.pop(position)])
+                job.advance(len(positions), message=f"Processed row {positions[-1] + 1}")
+
+        # Only a few requests are queued ahead of the workers, so parsing never runs far ahead
+        max_queued = max(1, concurrency) * 2
+        futures = {}
+        with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="excel-row") as executor:
+            for batch in iter_row_batches(pending_rows(), max(1, batch_size), batch_token_budget):
+                if batch_size > 1:
+                    print(f"[ROWS {batch[0][0] + 1}-{batch[-1][0] + 1}] Queued batch of {len(batch)} rows.")
+                    future = executor.submit(process_excel_row_batch, model, prompt_template, batch, total_rows, job)
+                else:
+                    position, row_input_text = batch[0]
+                    print(f"[ROW {position + 1}] Queued Input: '{row_input_text[:70]}...'")
+                    future = executor.submit(process_excel_row, model, prompt_template, row_input_text,
+                                             position + 1, total_rows, job)
+                futures[future] = [position for position, _ in batch]
+                if len(futures) >= max_queued:
+                    collect(wait(list(futures), return_when=FIRST_COMPLETED).done)
+            collect(as_completed(list(futures)))
+
+        total_rows = total_rows_seen
+        job.set_total(total_rows)
+        if column_writer is not None:
+            column_writer.commit()
+            column_writer = None
+        print(f"\n[INFO] Finished processing all {total_rows} rows.")
+
+        # Finalize the output file (the xlsx sink saves its workbook here)
+        writer.close()
+        writer = None
+        print(f"[INFO] Processed file saved locally: {output_filepath}")
+        checkpoints.clear(checkpoint_key)
+        job.set_partial(None)
+        job.set_result(output_filepath, os.path.basename(output_filepath))
+        job.set_message(f"Processing complete for {total_rows} rows.")
+
+    finally:
+        if column_writer is not None:
+            column_writer.discard()
+        if writer is not None:
+            # Job failed: keep what was written so far downloadable as a partial result
+            try:
+                writer.sink.close()
+                job.set_partial(output_filepath)
+            except Exception as e_close:
+                print(f"[ERROR] Could not close partial output {output_filepath}: {e_close}")
+        # Drop the job's cached template prefix (no-op if it was never cached)
+        context_cache.release(job.id)
+        # Cleanup: ONLY remove the temporary INPUT file
+        if input_filepath and os.path.exists(input_filepath):
+            try:
+                os.remove(input_filepath)
+                print(f"[INFO] Removed temporary INPUT file: {input_filepath}")
+            except Exception as e_rem:
+                print(f"[ERROR] Failed to remove temp input file {input_filepath}: {e_rem}")
+        # The processed file in PROCESSED_FOLDER remains for download
+
+
 @app.route('/feature/excel_row', methods=['GET', 'POST'])
 def feature_excel_row():
     """
-    Handles Excel upload, processes specified column row by row with a prompt,
-    retries on 429 errors, saves results to a new Excel file, provides download link.
+    Handles Excel upload and queues a background job that processes the specified column
+    row by row with a prompt. Returns a job id straight away; progress and the result
+    file are served by /jobs/<id> and /jobs/<id>/result.
     """
+    max_batch_size = app.config['EXCEL_ROW_MAX_BATCH_SIZE']
     if request.method == 'POST':
         prompt_template = request.form.get('prompt_excel_row')
         input_column_name = request.form.get('input_column_name')
+        try:
+            batch_size = int(request.form.get('batch_size') or 1)
+        except ValueError:
+            batch_size = 1
+        batch_size = max(1, min(batch_size, max_batch_size))
+        output_format = request.form.get('output_format', 'xlsx')
+        if output_format not in OUTPUT_FORMATS:
+            output_format = 'xlsx'
         file = request.files.get('file_excel_row')
         original_filename = None
         input_filepath = None
-        output_filename = None
-        output_filepath = None
+        job_submitted = False
 
         # Validation (keep existing)
-        if not prompt_template: flash('Please enter a prompt template.', 'error'); return render_template('feature_excel_row.html', prompts_data=PROMPT_CATEGORIES)
+        if not prompt_template: flash('Please enter a prompt template.', 'error'); return render_template('feature_excel_row.html', prompts_data=PROMPT_CATEGORIES, max_batch_size=max_batch_size)
         # ... (rest of validation) ...
-        if not file or file.filename == '': flash('No Excel file selected.', 'error'); return render_template('feature_excel_row.html', prompt_template=prompt_template, input_column_name=input_column_name, prompts_data=PROMPT_CATEGORIES)
-        if not allowed_file(file.filename, ALLOWED_EXTENSIONS_XLS): flash(f'Invalid file type. Allowed: {", ".join(ALLOWED_EXTENSIONS_XLS)}', 'error'); return render_template('feature_excel_row.html', prompt_template=prompt_template, input_column_name=input_column_name, prompts_data=PROMPT_CATEGORIES)
+        if not file or file.filename == '': flash('No Excel file selected.', 'error'); return render_template('feature_excel_row.html', prompt_template=prompt_template, input_column_name=input_column_name, prompts_data=PROMPT_CATEGORIES, max_batch_size=max_batch_size)
+        if not allowed_file(file.filename, ALLOWED_EXTENSIONS_XLS): flash(f'Invalid file type. Allowed: {", ".join(ALLOWED_EXTENSIONS_XLS)}', 'error'); return render_template('feature_excel_row.html', prompt_template=prompt_template, input_column_name=input_column_name, prompts_data=PROMPT_CATEGORIES, max_batch_size=max_batch_size)
 
         try:
             original_filename = secure_filename(file.filename)
@@ -543,136 +1169,305 @@ def feature_excel_row():
             file.save(input_filepath)
             print(f"[INFO] Temporary input Excel file saved: {input_filepath}")
 
-            # Read Excel
+            # Check the column exists before queueing (header row only)
             try:
-                df = pd.read_excel(input_filepath, sheet_name=0) # Process first sheet
-                if input_column_name not in df.columns:
-                    flash(f"Error: Column '{input_column_name}' not found. Available: {', '.join(df.columns)}", 'error')
+                header = read_header(input_filepath)
+                if input_column_name not in header:
+                    flash(f"Error: Column '{input_column_name}' not found. Available: {', '.join(header)}", 'error')
                     raise ValueError(f"Input column '{input_column_name}' not found.")
-                print(f"[INFO] Successfully read Excel. Columns: {df.columns.tolist()}. Rows: {len(df)}")
             except Exception as read_e:
                 flash(f"Could not read Excel file (Sheet 1) or column not found. Error: {read_e}", 'error')
                 raise # Trigger cleanup
 
-            # Process Rows with Retry Logic
-            results_ai_output = []
-            results_original_input = []
-            model = genai.GenerativeModel(model_name1)
-            total_rows = len(df)
-            print(f"\n[INFO] Starting row-by-row processing for {total_rows} rows...")
-            print("-" * 30)
-
-            # Retry configuration
-            MAX_RETRIES = 7
-            INITIAL_RETRY_DELAY_SECONDS = 5 # Start delay at 5 seconds
-            MAX_RETRY_DELAY_SECONDS = 60    # Cap delay at 60 seconds
-
-            for index, row in df.iterrows():
-                row_input_text = row[input_column_name]
-                if pd.isna(row_input_text) or not isinstance(row_input_text, str):
-                    row_input_text = str(row_input_text) if not pd.isna(row_input_text) else ""
-
-                # --- Log Start of Row Processing ---
-                print(f"[ROW {index + 1}/{total_rows}] Processing Input: '{str(row_input_text)[:70]}...'")
-                results_original_input.append(row_input_text)
-
-                if not row_input_text.strip():
-                    print(f"[ROW {index + 1}/{total_rows}] Skipping API call (empty input).")
-                    results_ai_output.append("[skipped_empty_input]")
-                    print("-" * 30) # Separator for next row
-                    continue # Move to next row immediately
-
-                # --- API Call with Retry Loop ---
-                retries = 0
-                current_delay = INITIAL_RETRY_DELAY_SECONDS
-                while True: # Loop for retries on the current row
-                    try:
-                        if retries > 0:
-                            print(f"[ROW {index + 1}/{total_rows}] Retry {retries}/{MAX_RETRIES}...")
-
-                        combined_row_prompt = f"User Prompt: {prompt_template}\n\nInput Text from Excel Row: {row_input_text}"
-                        response = model.generate_content(combined_row_prompt)
-                        ai_result = response.text
-                        results_ai_output.append(ai_result)
-                        print(f"[ROW {index + 1}/{total_rows}] API Success. Output: '{ai_result[:70]}...'")
-                        break # Success, exit retry loop for this row
-
-                    except Exception as api_e:
-                        error_str = str(api_e).lower()
-                        # --- Check for Quota Error (429) ---
-                        if "429" in error_str or "quota" in error_str or "resource has been exhausted" in error_str:
-                            retries += 1
-                            if retries > MAX_RETRIES:
-                                print(f"[ROW {index + 1}/{total_rows}] ERROR: Max retries ({MAX_RETRIES}) exceeded for quota error.")
-                                error_msg = f"[API_ERROR: Max retries exceeded - {str(api_e)[:100]}]"
-                                results_ai_output.append(error_msg)
-                                break # Exit retry loop, record error
-                            else:
-                                # Apply exponential backoff with jitter
-                                wait_time = current_delay + random.uniform(0, 1) # Add jitter
-                                print(f"[ROW {index + 1}/{total_rows}] WARNING: Quota error (429) detected. Retrying in {wait_time:.1f} seconds (Attempt {retries}/{MAX_RETRIES})...")
-                                time.sleep(wait_time)
-                                # Increase delay for next time, cap it
-                                current_delay = min(current_delay * 2, MAX_RETRY_DELAY_SECONDS)
-                                # Continue to the next iteration of the retry loop
-                        else:
-                            # --- Handle Other API Errors ---
-                            print(f"[ROW {index + 1}/{total_rows}] ERROR: Non-retryable API error: {api_e}")
-                            error_msg = f"[API_ERROR: {str(api_e)[:100]}]"
-                            results_ai_output.append(error_msg)
-                            break # Exit retry loop for non-quota errors
-                # --- End API Call Retry Loop ---
-                print("-" * 30) # Separator for next row
-
-            print(f"\n[INFO] Finished processing all {total_rows} rows.")
-
-            # Create Output DataFrame
-            print("[INFO] Creating output DataFrame...")
-            output_df = pd.DataFrame({
-                'AI Output': results_ai_output,
-                f'Original Text ({input_column_name})': results_original_input
-            })
-            # Optional: Add to original df instead
-            # df['AI_Output'] = results_ai_output; output_df = df
-
-            # Save Output Excel Locally
-            output_filename = f"{timestamp}-{os.path.splitext(original_filename)[0]}_processed.xlsx"
+            output_filename = f"{timestamp}-{os.path.splitext(original_filename)[0]}_processed.{output_format}"
             output_filepath = os.path.join(PROCESSED_FOLDER, output_filename)
-            output_df.to_excel(output_filepath, index=False, engine='openpyxl')
-            print(f"[INFO] Processed file saved locally: {output_filepath}")
 
-            # Signal Completion and Provide Download Link
-            success_message = f"Processing complete for {total_rows} rows. Click the link below to download."
-            print(f"[INFO] Rendering template with success message and download link for {output_filename}")
+            job = job_manager.submit('excel_row', run_excel_row_job,
+                                     input_filepath, input_column_name, prompt_template, output_filepath,
+                                     concurrency=app.config['EXCEL_ROW_CONCURRENCY'],
+                                     batch_size=batch_size,
+                                     batch_token_budget=app.config['EXCEL_ROW_BATCH_TOKEN_BUDGET'])
+            job_submitted = True
+
             return render_template('feature_excel_row.html',
                                    prompt_template=prompt_template,
                                    input_column_name=input_column_name,
-                                   processed_filename=output_filename,
-                                   success_message=success_message,
-                                   prompts_data=PROMPT_CATEGORIES)
+                                   batch_size=batch_size,
+                                   output_format=output_format,
+                                   job_id=job.id,
+                                   prompts_data=PROMPT_CATEGORIES, max_batch_size=max_batch_size)
 
         except Exception as e:
             # General error handling
             error_message = f"An error occurred during row-by-row processing: {e}"
-            print(f"[ERROR] Overall processing failed: {error_message}") # Log the error
+            print(f"[ERROR] Could not queue row processing: {error_message}") # Log the error
             flash(error_message, 'error')
             return render_template('feature_excel_row.html',
                                    prompt_template=request.form.get('prompt_excel_row'),
                                    input_column_name=request.form.get('input_column_name'),
-                                   prompts_data=PROMPT_CATEGORIES)
+                                   prompts_data=PROMPT_CATEGORIES, max_batch_size=max_batch_size)
 
         finally:
-            # Cleanup: ONLY remove the temporary INPUT file
-            if input_filepath and os.path.exists(input_filepath):
+            # The job owns the input file once queued; otherwise clean it up here
+            if not job_submitted and input_filepath and os.path.exists(input_filepath):
                 try:
                     os.remove(input_filepath)
                     print(f"[INFO] Removed temporary INPUT file: {input_filepath}")
                 except Exception as e_rem:
                     print(f"[ERROR] Failed to remove temp input file {input_filepath}: {e_rem}")
-            # The processed file in PROCESSED_FOLDER remains for download
 
     # GET request
-    return render_template('feature_excel_row.html', prompts_data=PROMPT_CATEGORIES)
+    return render_template('feature_excel_row.html', prompts_data=PROMPT_CATEGORIES, max_batch_size=max_batch_size)
+
+
+# --- Eager Media Uploads ---
+PREUPLOAD_EXTENSIONS = {
+    'pdf': ALLOWED_EXTENSIONS_PDF,
+    'image': ALLOWED_EXTENSIONS_IMG,
+    'video': ALLOWED_EXTENSIONS_VID,
+    'audio': ALLOWED_EXTENSIONS_AUDIO,
+}
+
+
+@app.route('/uploads', methods=['POST'])
+def preupload_media():
+    """
+    Accepts a media file as soon as it is picked in the browser and starts uploading it to
+    Gemini in the background. The feature form then submits only the returned upload id.
+    """
+    kind = request.form.get('kind', '')
+    file = request.files.get('file')
+    if kind not in PREUPLOAD_EXTENSIONS:
+        return jsonify({'error': f"Unknown upload kind '{kind}'."}), 400
+    if not file or file.filename == '':
+        return jsonify({'error': 'No file selected.'}), 400
+    if not allowed_file(file.filename, PREUPLOAD_EXTENSIONS[kind]):
+        return jsonify({'error': f'Invalid file type. Allowed: {", ".join(sorted(PREUPLOAD_EXTENSIONS[kind]))}'}), 400
+
+    original_filename = secure_filename(file.filename)
+    timestamp = time.strftime("%Y%m%d-%H%M%S")
+    local_filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{timestamp}-{uuid.uuid4().hex[:8]}-{original_filename}")
+    file_hash = store_upload(file, local_filepath)
+
+    mime_type = None  # Let Gemini detect image and video types, as the feature routes do
+    if kind == 'pdf':
+        mime_type = 'application/pdf'
+    elif kind == 'image':
+        mime_type = shrink_uploaded_image(local_filepath)
+    elif kind == 'audio':
+        mime_type = mimetypes.guess_type(local_filepath)[0] or 'audio/mpeg'
+    prepared = prepared_uploads.submit(kind, original_filename, local_filepath, mime_type=mime_type, sha256=file_hash)
+    return jsonify(prepared.to_dict()), 202
+
+
+@app.route('/uploads/<upload_id>')
+def preupload_status(upload_id):
+    """Returns whether a pre-uploaded file is still processing, ready or failed."""
+    prepared = prepared_uploads.get(upload_id)
+    if not prepared:
+        return jsonify({'error': 'Upload not found or expired.'}), 404
+    return jsonify(prepared.to_dict())
+
+
+# --- Background Job Status & Results ---
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Returns the status and progress of a background job as JSON, with events after ?since=<seq>."""
+    job = find_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found or expired.'}), 404
+    status = job.to_dict()
+    status['events'] = job.events_since(request.args.get('since', 0, type=int))
+    return jsonify(status)
+
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    """Downloads the file produced by a completed background job."""
+    job = find_job(job_id)
+    if not job:
+        flash("Error: Job not found or expired.", "error")
+        return redirect(url_for('index'))
+    if job.status != 'completed' or not job.result_path:
+        flash("The job has not finished yet.", "error")
+        return redirect(url_for('index'))
+    if not os.path.exists(job.result_path):
+        flash("Error: Processed file not found or expired.", "error")
+        return redirect(url_for('index'))
+
+    print(f"[DOWNLOAD] Sending result of job {job_id}: {job.result_path}")
+    return send_file(os.path.abspath(job.result_path), as_attachment=True, download_name=job.result_name)
+
+
+@app.route('/jobs/<job_id>/partial')
+def job_partial(job_id):
+    """Downloads the rows a background job has written so far (while running or after a failure)."""
+    job = find_job(job_id)
+    if not job:
+        flash("Error: Job not found or expired.", "error")
+        return redirect(url_for('index'))
+    partial_path = job.partial_path
+    if not partial_path or not os.path.exists(partial_path):
+        flash("No partial results are available for this job.", "error")
+        return redirect(url_for('index'))
+
+    file_name = os.path.basename(partial_path)
+    if file_name.endswith('.partial.csv'):
+        file_name = file_name[:-len('.partial.csv')]
+        extension = '.csv'
+    else:
+        extension = os.path.splitext(file_name)[1]
+    download_name = f"{os.path.splitext(file_name)[0]}_partial{extension}"
+    print(f"[DOWNLOAD] Sending partial result of job {job_id}: {partial_path}")
+    if extension.lower() == '.xlsx':
+        return send_file(os.path.abspath(partial_path), as_attachment=True, download_name=download_name)
+    # Text files are still being appended to: stream them up to the last complete line
+    length, chunks = open_complete_lines(partial_path)
+    return app.response_class(chunks, mimetype=mimetypes.guess_type(download_name)[0] or 'application/octet-stream',
+                              headers={'Content-Disposition': f'attachment; filename="{download_name}"',
+                                       'Content-Length': str(length)})
+
+
+@app.route('/cache/stats')
+def cache_stats():
+    """Returns hit/miss counters and size of the Gemini response cache (and the workbook cache) as JSON."""
+    stats = response_cache.stats()
+    stats['workbooks'] = workbook_cache.stats()
+    stats['gemini_files'] = gemini_file_index.stats()
+    stats['assets'] = asset_store.stats()
+    stats['archives'] = archive_cache.stats()
+    return jsonify(stats)
+
+
+IMAGE_GENERATION_MODEL = "gemini-2.0-flash-exp-image-generation"
+
+
+def store_image_asset(data, extension):
+    """Saves an image to the asset store and queues its WebP thumbnail and preview; returns the asset name."""
+    asset_name = asset_store.put(data, extension)
+    derivative_pool.submit(asset_store.path(asset_name))
+    return asset_name
+
+
+def generate_image_with_gemini(client, prompt, display_name):
+    """
+    Runs one streaming image generation request and saves every image it returns to the
+    asset store. Returns a list of (asset name, download name) pairs, where the download
+    name is `display_name` plus the extension of the image's MIME type (empty if the model
+    only answered with text).
+    """
+    saved_files = []
+    
+    # Create content structure
+    contents = [
+        genai_types.Content(
+            role="user",
+            parts=[
+                genai_types.Part.from_text(text=prompt),
+            ],
+        ),
+    ]
+    
+    # Configure generation parameters
+    generate_content_config = genai_types.GenerateContentConfig(
+        response_modalities=[
+            "image",
+            "text",
+        ],
+        response_mime_type="text/plain",
+    )
+    
+    # Generate image using the streaming API
+    gemini_limiter.acquire(IMAGE_GENERATION_MODEL, estimate_tokens(prompt))
+    response_stream = client.models.generate_content_stream(
+        model=IMAGE_GENERATION_MODEL,
+        contents=contents,
+        config=generate_content_config,
+    )
+    
+    # Process the full response stream to ensure everything is read
+    try:
+        for chunk in response_stream:
+            if (
+                chunk.candidates is None
+                or chunk.candidates[0].content is None
+                or chunk.candidates[0].content.parts is None
+            ):
+                continue
+                
+            # Check if the response contains image data
+            if chunk.candidates[0].content.parts[0].inline_data:
+                # Extract image data
+                inline_data = chunk.candidates[0].content.parts[0].inline_data
+                data_buffer = inline_data.data
+                file_extension = mimetypes.guess_extension(inline_data.mime_type)
+                
+                if not file_extension:
+                    file_extension = ".jpg"  # Default to jpg
+                
+                # Save the image (identical images are stored once)
+                asset_name = store_image_asset(data_buffer, file_extension)
+                suffix = f"_{len(saved_files) + 1}" if saved_files else ""
+                saved_files.append((asset_name, f"{display_name}{suffix}{file_extension}"))
+                print(f"Image saved as asset {asset_name}")
+            else:
+                # If we get text instead of image
+                if hasattr(chunk, 'text') and chunk.text:
+                    print(f"Text response: {chunk.text}")
+    except Exception as stream_error:
+        print(f"Error processing response stream: {stream_error}")
+        # Make sure to fully consume the stream even on error
+        try:
+            # Exhaust the stream to avoid "Response not read" errors
+            for _ in response_stream:
+                pass
+        except Exception as exhaust_error:
+            print(f"Error exhausting stream: {exhaust_error}")
+        raise stream_error  # Re-raise the original error
+    
+    return saved_files
+
+
+def run_image_generation_job(job, client, prompt, num_images, manifest_id, concurrency=1):
+    """
+    Background job for image generation: all `num_images` requests are in flight at once (up
+    to `concurrency`, each still waiting for the shared rate limiter), and every saved image is
+    added to the manifest and published as a job event so the page shows it without waiting
+    for the rest.
+    """
+    job.set_total(num_images)
+    timestamp = time.strftime("%Y%m%d-%H%M%S")
+    image_count = 0
+    errors = []
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, num_images)), thread_name_prefix="image-gen") as executor:
+        futures = {}
+        for i in range(num_images):
+            display_name = f"generated_{timestamp}_{i+1}"
+            print(f"Generating image {i+1} of {num_images}...")
+            future = executor.submit(call_with_backoff,
+                                     lambda display_name=display_name: generate_image_with_gemini(client, prompt, display_name),
+                                     f"Image {i+1}/{num_images}", job)
+            futures[future] = i
+        
+        for future in as_completed(futures):
+            i = futures[future]
+            saved_files, api_error = future.result()
+            if saved_files:
+                for asset_name, display_name in saved_files:
+                    image_count += 1
+                    asset_store.add_to_manifest(manifest_id, asset_name, display_name)
+                    job.add_event(type='image', index=i, filename=asset_name, display_name=display_name)
+            else:
+                error_msg = f"Error generating image {i+1}: {api_error}" if api_error else f"No image returned for image {i+1}."
+                print(error_msg)
+                errors.append(error_msg)
+                job.add_event(type='error', index=i, message=error_msg)
+            job.advance(message=f"Generated {image_count} of {num_images} images"
+                                + (f" ({len(errors)} failed)" if errors else ""))
+    
+    if not image_count:
+        raise RuntimeError("No images were generated. Please try a different prompt.")
 
 
 # --- 7. Image Generation ---
@@ -693,13 +1488,6 @@ def feature_image_generation():
             return render_template('feature_image_generation.html', prompt=prompt, prompts_data=PROMPT_CATEGORIES)
         
         try:
-            # Create generated directory if it doesn't exist
-            generated_folder = os.path.join('static', 'generated')
-            if not os.path.exists(generated_folder):
-                os.makedirs(generated_folder)
-            
-            image_files = []
-            
             # Get API key from environment variable
             api_key = os.environ.get("GEMINI_API_KEY")
             if not api_key:
@@ -710,101 +1498,19 @@ def feature_image_generation():
             if HAS_NEW_GENAI:
                 # Initialize the client
                 client = google_genai.Client(api_key=api_key)
-                model_name_image = "gemini-2.0-flash-exp-image-generation"
-                
-                # Generate images
-                for i in range(num_images):
-                    timestamp = time.strftime("%Y%m%d-%H%M%S")
-                    file_name = f"generated_{timestamp}_{i+1}"
-                    
-                    try:
-                        print(f"Generating image {i+1} of {num_images}...")
-                        
-                        # Create content structure
-                        contents = [
-                            genai_types.Content(
-                                role="user",
-                                parts=[
-                                    genai_types.Part.from_text(text=prompt),
-                                ],
-                            ),
-                        ]
-                        
-                        # Configure generation parameters
-                        generate_content_config = genai_types.GenerateContentConfig(
-                            response_modalities=[
-                                "image",
-                                "text",
-                            ],
-                            response_mime_type="text/plain",
-                        )
-                        
-                        # Generate image using the streaming API
-                        response_stream = client.models.generate_content_stream(
-                            model=model_name_image,
-                            contents=contents,
-                            config=generate_content_config,
-                        )
-                        
-                        # Process the full response stream to ensure everything is read
-                        try:
-                            for chunk in response_stream:
-                                if (
-                                    chunk.candidates is None
-                                    or chunk.candidates[0].content is None
-                                    or chunk.candidates[0].content.parts is None
-                                ):
-                                    continue
-                                    
-                                # Check if the response contains image data
-                                if chunk.candidates[0].content.parts[0].inline_data:
-                                    # Extract image data
-                                    inline_data = chunk.candidates[0].content.parts[0].inline_data
-                                    data_buffer = inline_data.data
-                                    file_extension = mimetypes.guess_extension(inline_data.mime_type)
-                                    
-                                    if not file_extension:
-                                        file_extension = ".jpg"  # Default to jpg
-                                    
-                                    # Save the image
-                                    image_path = os.path.join(generated_folder, f"{file_name}{file_extension}")
-                                    with open(image_path, "wb") as f:
-                                        f.write(data_buffer)
-                                    
-                                    # Add to list of generated images
-                                    image_files.append(os.path.basename(image_path))
-                                    print(f"Image saved to {image_path}")
-                                else:
-                                    # If we get text instead of image
-                                    if hasattr(chunk, 'text') and chunk.text:
-                                        print(f"Text response: {chunk.text}")
-                        except Exception as stream_error:
-                            print(f"Error processing response stream: {stream_error}")
-                            # Make sure to fully consume the stream even on error
-                            try:
-                                # Exhaust the stream to avoid "Response not read" errors
-                                for _ in response_stream:
-                                    pass
-                            except Exception as exhaust_error:
-                                print(f"Error exhausting stream: {exhaust_error}")
-                            raise stream_error  # Re-raise the original error
-                        
-                    except Exception as e:
-                        print(f"Error generating image {i+1}: {e}")
-                        flash(f'Error generating image {i+1}: {str(e)}', 'error')
                 
-                # If we successfully generated at least one image
-                if image_files:
-                    session['generated_images'] = image_files
-                    return render_template('feature_image_generation.html', 
-                                         prompt=prompt,
-                                         image_files=image_files,
-                                         prompts_data=PROMPT_CATEGORIES)
-                else:
-                    flash('No images were generated. Please try a different prompt.', 'error')
-                    return render_template('feature_image_generation.html', 
-                                         prompt=prompt,
-                                         prompts_data=PROMPT_CATEGORIES)
+                # Images are requested concurrently by a background job and shown as each one is saved;
+                # the session only remembers the manifest of the latest batch
+                manifest_id = asset_store.create_manifest('generated')
+                session['asset_manifests'] = {**session.get('asset_manifests', {}), 'generated': manifest_id}
+                job = image_job_manager.submit('image_generation', run_image_generation_job, client, prompt, num_images,
+                                         manifest_id, concurrency=app.config['IMAGE_GENERATION_CONCURRENCY'])
+                return render_template('feature_image_generation.html',
+                                     prompt=prompt,
+                                     job_id=job.id,
+                                     manifest_id=manifest_id,
+                                     num_images=num_images,
+                                     prompts_data=PROMPT_CATEGORIES)
             else:
                 # If the required Client class is not available, fall back to text generation
                 flash('The required modules for image generation are not available. Falling back to text descriptions.', 'error')
@@ -817,6 +1523,7 @@ def feature_image_generation():
                 result_text = None
                 for i in range(1):  # Just generate one description
                     image_prompt = f"Create a detailed artistic description of this image: {prompt}. Include details about style, colors, composition, and mood."
+                    gemini_limiter.acquire(model_name2, estimate_tokens(image_prompt))
                     response = model.generate_content(image_prompt)
                     result_text = response.text
                 
@@ -836,41 +1543,228 @@ def feature_image_generation():
     # GET request: show the empty form with prompts data
     return render_template('feature_image_generation.html', prompts_data=PROMPT_CATEGORIES)
 
+@app.route('/assets/<name>')
+def asset_file(name):
+    """Serves a generated or edited image from the asset store."""
+    path = asset_store.path(name)
+    if not path:
+        return "Image not found or expired.", 404
+    return send_asset_file(path)
+
+
+@app.route('/assets/<name>/<variant>')
+def asset_derivative(name, variant):
+    """Serves the WebP thumbnail or preview of an asset (built on demand if it is not ready yet)."""
+    path = asset_store.path(name)
+    derivative = derivative_pool.ensure(path, variant) if path else None
+    if not derivative:
+        return "Image not found or expired.", 404
+    return send_asset_file(derivative, mimetype='image/webp')
+
+
+def send_asset_file(path, mimetype=None):
+    """Sends an asset file with long-lived cache headers; the content behind a URL never changes."""
+    response = send_file(os.path.abspath(path), mimetype=mimetype, max_age=app.config['ASSET_CACHE_MAX_AGE_SECONDS'])
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def send_asset_download(name, fallback_endpoint):
+    """Sends an asset as an attachment, named after ?name= (its download name) when given."""
+    path = asset_store.path(name)
+    if not path:
+        flash('Image file not found.', 'error')
+        return redirect(url_for(fallback_endpoint))
+    download_name = secure_filename(request.args.get('name', '')) or name
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=download_name)
+
+
+def send_manifest_zip(kind, zip_prefix, fallback_endpoint):
+    """
+    Zips the images of a manifest (?manifest=<id>, else the session's latest one of `kind`).
+    The archive is streamed as it is written; an identical manifest is served from the cached copy.
+    """
+    manifest_id = request.args.get('manifest') or session.get('asset_manifests', {}).get(kind)
+    items = [(name, display_name, asset_store.path(name)) for name, display_name in asset_store.manifest(manifest_id, kind)]
+    items = [item for item in items if item[2]]
+    if not items:
+        flash('No images to download.', 'error')
+        return redirect(url_for(fallback_endpoint))
+    
+    zip_filename = f"{zip_prefix}_{time.strftime('%Y%m%d-%H%M%S')}.zip"
+    key = archive_cache.key((display_name, name) for name, display_name, _ in items)
+    cached_path = archive_cache.get(key)
+    if cached_path:
+        print(f"[DOWNLOAD] Serving cached archive for {len(items)} images.")
+        try:
+            return send_file(os.path.abspath(cached_path), as_attachment=True, download_name=zip_filename, mimetype='application/zip')
+        except FileNotFoundError:
+            pass  # Evicted just now: build it again below
+    
+    print(f"[DOWNLOAD] Streaming archive of {len(items)} images.")
+    entries = [(display_name, path) for _, display_name, path in items]
+    return app.response_class(archive_cache.stream(key, entries), mimetype='application/zip',
+                              headers={'Content-Disposition': f'attachment; filename="{zip_filename}"'})
+
+
 @app.route('/download_image/<filename>')
 def download_image(filename):
     """Downloads a single generated image."""
-    image_path = os.path.join('static', 'generated', filename)
-    if not os.path.exists(image_path):
-        flash('Image file not found.', 'error')
-        return redirect(url_for('feature_image_generation'))
-    
-    return send_file(image_path, as_attachment=True)
+    return send_asset_download(filename, 'feature_image_generation')
 
 @app.route('/download_all_images')
 def download_all_images():
-    """Downloads all generated images as a ZIP file."""
-    # Get image files from session
-    image_files = session.get('generated_images', [])
+    """Downloads all images of the latest generation batch (or ?manifest=<id>) as a ZIP file."""
+    return send_manifest_zip('generated', 'generated_images', 'feature_image_generation')
+
+# --- End of Image Generation Routes ---
+
+# --- 8. Image Editor ---
+def edit_image_with_gemini(client, model_name, prompt, prepared, file_path):
+    """
+    Sends one preprocessed image (image_prep.PreparedImage for `file_path`) with the editing
+    instructions to the image model and saves the edited image to the asset store.
+    Returns (asset name, download name), or None if the response held no image.
+    """
+    # Raw bytes go straight into the request, with no PIL decode/re-encode in the SDK
+    image = genai_types.Part.from_bytes(data=prepared.data, mime_type=prepared.mime_type)
     
-    if not image_files:
-        flash('No images to download.', 'error')
-        return redirect(url_for('feature_image_generation'))
+    # Format prompt as tuple to match example code
+    text_input = (f"Edit this image: {prompt}",)
     
-    # Create a ZIP file
-    zip_filename = f"generated_images_{time.strftime('%Y%m%d-%H%M%S')}.zip"
-    zip_path = os.path.join(app.config['PROCESSED_FOLDER'], zip_filename)
+    # Set explicit response modalities to ensure we get back image data
+    generation_config = genai_types.GenerateContentConfig(
+        response_modalities=['TEXT', 'IMAGE']
+    )
     
-    with zipfile.ZipFile(zip_path, 'w') as zipf:
-        for img in image_files:
-            img_path = os.path.join('static', 'generated', img)
-            if os.path.exists(img_path):
-                zipf.write(img_path, os.path.basename(img_path))
+    # Use streaming API for more reliable response handling
+    try:
+        gemini_limiter.acquire(model_name, estimate_tokens(prompt))
+        response_stream = client.models.generate_content_stream(
+            model=model_name,
+            contents=[text_input, image],
+            config=generation_config
+        )
+        
+        # Process the response stream
+        output_image_data = None
+        output_mime_type = None
+        output_text = ""
+        
+        for chunk in response_stream:
+            if hasattr(chunk, 'text') and chunk.text:
+                output_text += chunk.text
+            
+            # Process candidates if available
+            if (hasattr(chunk, 'candidates') and chunk.candidates and 
+                chunk.candidates[0].content and chunk.candidates[0].content.parts):
+                for part in chunk.candidates[0].content.parts:
+                    if hasattr(part, 'text') and part.text is not None:
+                        output_text += part.text
+                    elif hasattr(part, 'inline_data') and part.inline_data is not None:
+                        output_image_data = part.inline_data.data
+                        output_mime_type = getattr(part.inline_data, 'mime_type', None)
+                        print(f"Found image data in response")
+        
+        # Print text response summary if available
+        if output_text:
+            print(f"Text response: {output_text[:100]}...")
+            
+    except Exception as stream_error:
+        print(f"Error processing response stream: {stream_error}")
+        # Make sure to fully consume the stream even on error
+        try:
+            # Exhaust the stream to avoid "Response not read" errors
+            if 'response_stream' in locals():
+                for _ in response_stream:
+                    pass
+        except Exception as exhaust_error:
+            print(f"Error exhausting stream: {exhaust_error}")
+        raise Exception(f"Stream error: {stream_error}")
     
-    return send_file(zip_path, as_attachment=True, download_name=zip_filename)
+    if not output_image_data:
+        return None
+    
+    # Name the download after the input, with the extension of the returned image
+    base, ext = os.path.splitext(os.path.basename(file_path))
+    ext = (mimetypes.guess_extension(output_mime_type) if isinstance(output_mime_type, str) else None) or ext
+    
+    # Save the edited image (identical outputs are stored once)
+    asset_name = store_image_asset(output_image_data, ext)
+    print(f"Saved edited image as asset {asset_name}")
+    return asset_name, f"edited_{base}{ext}"
+
+
+def run_image_edit_job(job, saved_files, prompt, manifest_id, concurrency=1):
+    """
+    Background job for the image editor. Up to `concurrency` images are edited at once (every
+    call still goes through the shared rate limiter and backs off on 429s), and each finished
+    image is published as a job event so the page can show it while the rest of the batch runs.
+    """
+    client = google_genai.Client(api_key=API_KEY)
+    # Use the image generation model explicitly
+    model_name_edit = "gemini-2.0-flash-exp-image-generation"
+    total_images = len(saved_files)
+    job.set_total(total_images)
+    edited_images = []
+    errors = []
+    bytes_saved = 0
+    
+    def edit_one(file_path, label):
+        try:
+            prepared = prepare_uploaded_image(file_path)
+        except Exception as e:
+            return None, f"[IMAGE_ERROR: {str(e)[:100]}]", None
+        edited, api_error = call_with_backoff(
+            lambda: edit_image_with_gemini(client, model_name_edit, prompt, prepared, file_path), label, job)
+        return edited, api_error, prepared
+    
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="image-edit") as executor:
+            futures = {}
+            for i, file_path in enumerate(saved_files):
+                print(f"Queueing image {i+1}/{total_images}: {os.path.basename(file_path)}")
+                futures[executor.submit(edit_one, file_path, f"Image {i+1}/{total_images}")] = i
+            
+            for future in as_completed(futures):
+                i = futures[future]
+                edited, api_error, prepared = future.result()
+                if prepared:
+                    bytes_saved += prepared.bytes_saved
+                if edited:
+                    asset_name, display_name = edited
+                    edited_images.append(asset_name)
+                    asset_store.add_to_manifest(manifest_id, asset_name, display_name)
+                    job.add_event(type='image', index=i, filename=asset_name, display_name=display_name,
+                                  original_bytes=prepared.original_bytes, sent_bytes=len(prepared.data))
+                else:
+                    if api_error:
+                        error_msg = f"Error processing image {i+1}: {api_error}"
+                    else:
+                        error_msg = f"No image data in response for image {i+1}. Model may not support image editing. Try a different prompt or image."
+                    print(error_msg)
+                    errors.append(error_msg)
+                    job.add_event(type='error', index=i, message=error_msg)
+                job.advance(message=f"Edited {len(edited_images)} of {total_images} images"
+                                    + (f" ({len(errors)} failed)" if errors else "")
+                                    + (f", {bytes_saved / (1024 * 1024):.1f} MB less uploaded" if bytes_saved > 0 else ""))
+    finally:
+        # Clean up temporary files
+        for file_path in saved_files:
+            try:
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                    print(f"Removed temporary file: {file_path}")
+            except Exception as e:
+                print(f"Error removing temporary file {file_path}: {e}")
+    
+    # If no successful edits, fail the job
+    if not edited_images and errors:
+        raise RuntimeError("Failed to generate any edited images. The model may not currently support image editing "
+                           "or the prompt may need to be more specific.")
 
-# --- End of Image Generation Routes ---
 
-# --- 8. Image Editor ---
 @app.route('/feature/image_editor', methods=['GET', 'POST'])
 def feature_image_editor():
     if request.method == 'POST':
@@ -899,10 +1793,9 @@ def feature_image_editor():
                 flash(f'File {file.filename} has an invalid extension. Allowed extensions: {", ".join(allowed_extensions)}', 'error')
                 return render_template('feature_image_editor.html', prompts_data=PROMPT_CATEGORIES)
         
-        # Create output directory if it doesn't exist
-        output_dir = os.path.join(app.static_folder, 'edited')
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
+        if not HAS_NEW_GENAI:
+            flash("The required Google AI client library for new Gemini API is not available. Please install the latest version.", 'error')
+            return render_template('feature_image_editor.html', prompts_data=PROMPT_CATEGORIES)
         
         # Save images temporarily
         timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
@@ -918,126 +1811,15 @@ def feature_image_editor():
             file.save(filepath)
             saved_files.append(filepath)
         
-        # Process images with Gemini AI
-        edited_images = []
-        errors = []
-        
-        try:
-            # Check if we have access to the new API style
-            if HAS_NEW_GENAI:
-                # Initialize the client
-                client = google_genai.Client(api_key=API_KEY)
-                # Use the image generation model explicitly
-                model_name_edit = "gemini-2.0-flash-exp-image-generation"
-                
-                for i, file_path in enumerate(saved_files):
-                    try:
-                        print(f"Processing image {i+1}/{len(saved_files)}: {os.path.basename(file_path)}")
-                        
-                        # Open the image with PIL
-                        image = PIL.Image.open(file_path)
-                        
-                        # Format prompt as tuple to match example code
-                        text_input = (f"Edit this image: {prompt}",)
-                        
-                        # Set explicit response modalities to ensure we get back image data
-                        generation_config = genai_types.GenerateContentConfig(
-                            response_modalities=['TEXT', 'IMAGE']
-                        )
-                        
-                        # Use streaming API for more reliable response handling
-                        try:
-                            response_stream = client.models.generate_content_stream(
-                                model=model_name_edit,
-                                contents=[text_input, image],
-                                config=generation_config
-                            )
-                            
-                            # Process the response stream
-                            output_image_data = None
-                            output_text = ""
-                            
-                            for chunk in response_stream:
-                                if hasattr(chunk, 'text') and chunk.text:
-                                    output_text += chunk.text
-                                
-                                # Process candidates if available
-                                if (hasattr(chunk, 'candidates') and chunk.candidates and 
-                                    chunk.candidates[0].content and chunk.candidates[0].content.parts):
-                                    for part in chunk.candidates[0].content.parts:
-                                        if hasattr(part, 'text') and part.text is not None:
-                                            output_text += part.text
-                                        elif hasattr(part, 'inline_data') and part.inline_data is not None:
-                                            output_image_data = part.inline_data.data
-                                            print(f"Found image data in response")
-                            
-                            # Print text response summary if available
-                            if output_text:
-                                print(f"Text response: {output_text[:100]}...")
-                                
-                        except Exception as stream_error:
-                            print(f"Error processing response stream: {stream_error}")
-                            # Make sure to fully consume the stream even on error
-                            try:
-                                # Exhaust the stream to avoid "Response not read" errors
-                                if 'response_stream' in locals():
-                                    for _ in response_stream:
-                                        pass
-                            except Exception as exhaust_error:
-                                print(f"Error exhausting stream: {exhaust_error}")
-                            raise Exception(f"Stream error: {stream_error}")
-                        
-                        if output_image_data:
-                            # Create output filename
-                            base, ext = os.path.splitext(os.path.basename(file_path))
-                            output_filename = f"edited_{base}{ext}"
-                            output_path = os.path.join(output_dir, output_filename)
-                            
-                            # Save the edited image
-                            with open(output_path, "wb") as f:
-                                f.write(output_image_data)
-                            
-                            edited_images.append(output_filename)
-                            print(f"Saved edited image to {output_path}")
-                        else:
-                            error_msg = f"No image data in response for image {i+1}. Model may not support image editing. Try a different prompt or image."
-                            print(error_msg)
-                            errors.append(error_msg)
-                    
-                    except Exception as e:
-                        error_msg = f"Error processing image {i+1}: {str(e)}"
-                        print(error_msg)
-                        errors.append(error_msg)
-            else:
-                flash("The required Google AI client library for new Gemini API is not available. Please install the latest version.", 'error')
-                return render_template('feature_image_editor.html', prompts_data=PROMPT_CATEGORIES)
-                
-        except Exception as e:
-            flash(f"Error processing images: {str(e)}", 'error')
-            return render_template('feature_image_editor.html', prompts_data=PROMPT_CATEGORIES)
-        finally:
-            # Clean up temporary files
-            for file_path in saved_files:
-                try:
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                        print(f"Removed temporary file: {file_path}")
-                except Exception as e:
-                    print(f"Error removing temporary file {file_path}: {e}")
-        
-        # If no successful edits, show error
-        if not edited_images and errors:
-            flash("Failed to generate any edited images. The model may not currently support image editing or the prompt may need to be more specific.", 'error')
-            for error in errors:
-                flash(error, 'warning')
-        elif errors:
-            # Show warnings for partial successes
-            for error in errors:
-                flash(error, 'warning')
-        
-        # Return results
-        return render_template('feature_image_editor.html', 
-                             edited_images=edited_images,
+        # Edit the images on the background job pool; the page shows each one as it finishes
+        manifest_id = asset_store.create_manifest('edited')
+        session['asset_manifests'] = {**session.get('asset_manifests', {}), 'edited': manifest_id}
+        job = image_job_manager.submit('image_edit', run_image_edit_job, saved_files, prompt, manifest_id,
+                                 concurrency=app.config['IMAGE_EDIT_CONCURRENCY'])
+        return render_template('feature_image_editor.html',
+                             job_id=job.id,
+                             manifest_id=manifest_id,
+                             total_images=len(saved_files),
                              prompts_data=PROMPT_CATEGORIES)
     
     # GET request - just show the form
@@ -1045,30 +1827,12 @@ def feature_image_editor():
 
 @app.route('/download_edited_image/<filename>')
 def download_edited_image(filename):
-    return send_from_directory(os.path.join(app.static_folder, 'edited'),
-                               filename, as_attachment=True)
+    return send_asset_download(filename, 'feature_image_editor')
 
 @app.route('/download_all_edited_images')
 def download_all_edited_images():
-    # Create a temporary ZIP file
-    memory_file = BytesIO()
-    with zipfile.ZipFile(memory_file, 'w') as zf:
-        edited_dir = os.path.join(app.static_folder, 'edited')
-        for filename in os.listdir(edited_dir):
-            file_path = os.path.join(edited_dir, filename)
-            if os.path.isfile(file_path):
-                zf.write(file_path, arcname=filename)
-    
-    # Reset file pointer and create response
-    memory_file.seek(0)
-    
-    timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-    return send_file(
-        memory_file,
-        mimetype='application/zip',
-        as_attachment=True,
-        download_name=f'edited_images_{timestamp}.zip'
-    )
+    """Downloads the images of the latest edit batch (or ?manifest=<id>) as a ZIP file."""
+    return send_manifest_zip('edited', 'edited_images', 'feature_image_editor')
 
 def get_mime_type(file_path):
     """Determine the MIME type of a file"""
@@ -1169,45 +1933,50 @@ def feature_audio():
         original_filename = None
         local_filepath = None
         gemini_file = None
+        # File picked earlier and already sent to Gemini in the background (see /uploads)
+        prepared = prepared_uploads.get(request.form.get('upload_id', ''), 'audio')
 
         # Validation
         if not prompt: 
             flash('Please enter a prompt for the audio.', 'error')
             return render_template('feature_audio.html', prompts_data=PROMPT_CATEGORIES)
         
-        if not file or file.filename == '': 
+        if not prepared and (not file or file.filename == ''): 
             flash('No audio file selected.', 'error')
             return render_template('feature_audio.html', prompt=prompt, prompts_data=PROMPT_CATEGORIES)
         
-        # Define allowed audio extensions
-        ALLOWED_EXTENSIONS_AUDIO = {'mp3', 'wav', 'ogg', 'm4a', 'flac'}
-        
-        if not allowed_file(file.filename, ALLOWED_EXTENSIONS_AUDIO): 
+        if not prepared and not allowed_file(file.filename, ALLOWED_EXTENSIONS_AUDIO): 
             flash('Invalid file type. Please upload a supported audio format (MP3, WAV, OGG, M4A, FLAC).', 'error')
             return render_template('feature_audio.html', prompt=prompt, prompts_data=PROMPT_CATEGORIES)
 
         try:
-            original_filename = secure_filename(file.filename)
-            timestamp = time.strftime("%Y%m%d-%H%M%S")
-            filename = f"{timestamp}-{original_filename}"
-            local_filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-
-            file.save(local_filepath)
-            print(f"Audio saved locally: {local_filepath}")
-
-            # Get MIME type for the audio file
-            mime_type, _ = mimetypes.guess_type(local_filepath)
-            if not mime_type:
-                mime_type = 'audio/mpeg'  # Default to common audio MIME type if not detected
+            if prepared:
+                original_filename = prepared.filename
+                print(f"Using pre-uploaded audio '{original_filename}' ({prepared.status}).")
+                gemini_file = prepared.future.result()
+            else:
+                original_filename = secure_filename(file.filename)
+                timestamp = time.strftime("%Y%m%d-%H%M%S")
+                filename = f"{timestamp}-{original_filename}"
+                local_filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+
+                file_hash = store_upload(file, local_filepath)
+                print(f"Audio saved locally: {local_filepath}")
+
+                # Get MIME type for the audio file
+                mime_type, _ = mimetypes.guess_type(local_filepath)
+                if not mime_type:
+                    mime_type = 'audio/mpeg'  # Default to common audio MIME type if not detected
                 
-            # Upload local file to Gemini Files API
-            gemini_file = upload_file_to_gemini(local_filepath, mime_type=mime_type)
+                # Upload local file to Gemini Files API
+                gemini_file = upload_file_to_gemini(local_filepath, mime_type=mime_type, sha256=file_hash)
             if not gemini_file:
                 flash('Failed to upload or process audio file with Gemini. Check logs.', 'error')
                 raise ValueError("Gemini file upload/processing failed.")  # Go to finally for cleanup
 
             print(f"Generating content for audio '{original_filename}' with prompt: {prompt[:50]}...")
             model = genai.GenerativeModel(model_name)
+            gemini_limiter.acquire(model_name, estimate_tokens(prompt))
             response = model.generate_content([prompt, gemini_file])  # Pass file obj
 
             result_text = response.text
@@ -1236,10 +2005,8 @@ def feature_audio():
                     print(f"Removed temporary local file: {local_filepath}")
                 except Exception as e:
                     print(f"Warning: Could not remove temporary file {local_filepath}: {e}")
-
-            # Clean up Gemini file if it exists and we had an error
-            if gemini_file and 'error_message' in locals():
-                delete_gemini_file(gemini_file)
+            # The Gemini file is shared through the file index and prepared uploads, so a failed
+            # generation (e.g. a 429) keeps it; failed uploads are discarded by start_gemini_upload
 
     # GET request: show the empty form
     return render_template('feature_audio.html', prompts_data=PROMPT_CATEGORIES)
@@ -1261,25 +2028,39 @@ def download_story_prompts(filename):
         flash("Could not download the Excel file.", "error")
         return redirect(url_for('feature_sentence_splitter'))
 
-def generate_with_gemini(prompt_text):
-    """Generate content using Google's Gemini API with retry logic for rate limits"""
+# Fallback texts returned by generate_with_gemini when no prompt could be generated
+GENERATION_ERROR_MESSAGE = "Unable to generate prompt. Please try again later."
+RATE_LIMIT_ERROR_MESSAGE = "API rate limit exceeded. Please try again later."
+
+def generate_with_gemini(prompt_text, pacer=None):
+    """
+    Generate content using Google's Gemini API with retry logic for rate limits.
+    An optional AdaptivePacer is waited on before each attempt and told about successes and 429s.
+    """
     max_retries = 5
     base_retry_delay = 2  # Start with 2 seconds
+
+    # Configure to use plain text
+    generation_config = {
+        "temperature": 0.2,  # Lower temperature for more focused response
+        "top_p": 0.8,
+        "top_k": 40,
+        "max_output_tokens": 200,  # Limit response length
+    }
+
+    cached_text = response_cache.get("gemini-2.0-flash", prompt_text, generation_config)
+    if cached_text is not None:
+        return cached_text
     
     for attempt in range(max_retries):
         try:
             # Use the standard API with streaming
             model = genai.GenerativeModel("gemini-2.0-flash")
             
-            # Configure to use plain text
-            generation_config = {
-                "temperature": 0.2,  # Lower temperature for more focused response
-                "top_p": 0.8,
-                "top_k": 40,
-                "max_output_tokens": 200,  # Limit response length
-            }
-            
             # Use streaming for better efficiency
+            if pacer:
+                pacer.wait()
+            gemini_limiter.acquire("gemini-2.0-flash", estimate_tokens(prompt_text) + generation_config["max_output_tokens"])
             response_text = ""
             for chunk in model.generate_content(
                 prompt_text,
@@ -1290,6 +2071,9 @@ def generate_with_gemini(prompt_text):
                 
             # Clean the response - remove extra whitespace
             response_text = response_text.strip()
+            response_cache.set("gemini-2.0-flash", prompt_text, response_text, generation_config)
+            if pacer:
+                pacer.on_success()
             
             return response_text
                 
@@ -1298,26 +2082,27 @@ def generate_with_gemini(prompt_text):
             app.logger.warning(f"Attempt {attempt+1}/{max_retries} failed: {error_str}")
             
             # Check if it's a rate limit error (429)
-            if "429" in error_str or "quota" in error_str.lower() or "exceeded" in error_str.lower():
-                # Extract retry delay from error message if available
-                import re
-                retry_seconds = base_retry_delay * (2 ** attempt)  # Exponential backoff
-                
+            if is_rate_limit_error(e):
                 # Try to extract the recommended retry delay from the error message
-                retry_match = re.search(r"retry_delay\s*{\s*seconds:\s*(\d+)", error_str)
-                if retry_match:
-                    retry_seconds = int(retry_match.group(1))
-                    app.logger.info(f"Using recommended retry delay: {retry_seconds} seconds")
+                recommended_delay = parse_retry_delay(error_str)
+                if recommended_delay is not None:
+                    app.logger.info(f"Using recommended retry delay: {recommended_delay} seconds")
+
+                if pacer:
+                    # The pacer halves its rate and holds the next attempt for the recommended delay
+                    pacer.on_rate_limited(recommended_delay)
+                    app.logger.info(f"Rate limit exceeded. Pacer slowed to {pacer.rate:.2f} requests/s (attempt {attempt+1}/{max_retries})")
+                    continue
+
+                retry_seconds = recommended_delay if recommended_delay is not None else base_retry_delay * (2 ** attempt)  # Exponential backoff
                 
                 # Add some jitter to avoid all clients retrying at exactly the same time
-                import random
                 jitter = random.uniform(0, 1)
                 retry_seconds = retry_seconds + jitter
                 
                 app.logger.info(f"Rate limit exceeded. Retrying in {retry_seconds:.1f} seconds (attempt {attempt+1}/{max_retries})")
                 
                 # Sleep before retry
-                import time
                 time.sleep(retry_seconds)
                 
                 # Continue to the next retry attempt
@@ -1325,10 +2110,10 @@ def generate_with_gemini(prompt_text):
             
             # If we get here, it wasn't a rate limit error or we're out of retries
             app.logger.error(f"Error generating content with Gemini: {e}")
-            return "Unable to generate prompt. Please try again later."
+            return GENERATION_ERROR_MESSAGE
     
     # If we've exhausted all retries
-    return "API rate limit exceeded. Please try again later."
+    return RATE_LIMIT_ERROR_MESSAGE
 
 @app.route('/feature/sentence_splitter', methods=['GET', 'POST'])
 def feature_sentence_splitter():
@@ -1393,9 +2178,36 @@ def download_sentence_excel(filename):
         return redirect(url_for('feature_sentence_splitter'))
 
 # --- Story Prompt Generator Route ---
+def run_story_prompts_job(job, filepath):
+    """Background worker: generates story prompts with story.py and keeps the result for download."""
+    from story import process_excel
+    try:
+        result = process_excel(filepath, JobProgressVar(job), JobStatusVar(job),
+                               concurrency=app.config['STORY_CONCURRENCY'])
+        if not result.startswith("Processing completed"):
+            raise RuntimeError(result)
+
+        # Extract output filename from result
+        output_file = result.split("Results saved to ")[1]
+        output_filename = os.path.basename(output_file)
+
+        # Move the file to the OUTPUT_FOLDER for better organization
+        new_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
+        os.rename(output_file, new_path)
+        job.set_result(new_path, "Story_Prompts.xlsx")
+        job.set_message("Your story prompts are ready.")
+    finally:
+        # Clean up the uploaded file
+        if os.path.exists(filepath):
+            try:
+                os.remove(filepath)
+                print(f"Removed temporary file: {filepath}")
+            except Exception as e:
+                print(f"Could not remove temporary file {filepath}: {e}")
+
 @app.route('/feature/story_prompts', methods=['GET', 'POST'])
 def feature_story_prompts():
-    """Handles the story prompt generation feature using the story.py module."""
+    """Handles the story prompt generation feature by queueing a story.py background job."""
     if request.method == 'POST':
         file = request.files.get('file_story')
         
@@ -1416,42 +2228,19 @@ def feature_story_prompts():
             filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
             file.save(filepath)
             
-            # Process the file using the function from story.py
-            from story import process_excel
-            result = process_excel(filepath)
-            
-            # Extract output filename from result
-            if result.startswith("Processing completed"):
-                output_file = result.split("Results saved to ")[1]
-                output_filename = os.path.basename(output_file)
-                
-                # Move the file to the OUTPUT_FOLDER for better organization
-                if os.path.exists(output_file):
-                    new_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
-                    os.rename(output_file, new_path)
-                    
-                return render_template('feature_story_prompts.html', 
-                                      success=True, 
-                                      output_filename=output_filename,
-                                      prompts_data=PROMPT_CATEGORIES)
-            else:
-                flash(result, 'error')
-                return render_template('feature_story_prompts.html', prompts_data=PROMPT_CATEGORIES)
+            # Process the file in the background; the page polls /jobs/<id> for progress
+            job = job_manager.submit('story_prompts', run_story_prompts_job, filepath)
+            return render_template('feature_story_prompts.html', 
+                                  job_id=job.id,
+                                  prompts_data=PROMPT_CATEGORIES)
                 
         except Exception as e:
             error_message = f"An error occurred processing your story: {e}"
             print(error_message)
             flash(error_message, 'error')
-            return render_template('feature_story_prompts.html', prompts_data=PROMPT_CATEGORIES)
-        
-        finally:
-            # Clean up the uploaded file
             if 'filepath' in locals() and os.path.exists(filepath):
-                try:
-                    os.remove(filepath)
-                    print(f"Removed temporary file: {filepath}")
-                except Exception as e:
-                    print(f"Could not remove temporary file {filepath}: {e}")
+                os.remove(filepath)
+            return render_template('feature_story_prompts.html', prompts_data=PROMPT_CATEGORIES)
     
     # GET request - just show the form
     return render_template('feature_story_prompts.html', prompts_data=PROMPT_CATEGORIES)
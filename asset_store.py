@@ -0,0 +1,211 @@
+# asset_store.py
+
+import glob
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+DEFAULT_STORE_DIR = os.environ.get('ASSET_STORE_DIR', os.path.join('cache', 'assets'))
+DEFAULT_INDEX_PATH = os.environ.get('ASSET_INDEX_PATH', os.path.join('cache', 'assets.sqlite3'))
+DEFAULT_MAX_BYTES = int(os.environ.get('ASSET_STORE_MAX_BYTES', 2 * 1024 * 1024 * 1024))  # 2 GB
+DEFAULT_MAX_AGE_SECONDS = int(os.environ.get('ASSET_STORE_MAX_AGE_SECONDS', 7 * 24 * 3600))  # 7 days
+TOUCH_INTERVAL_SECONDS = 60  # Access times are only rewritten this often per asset
+RECENT_ASSET_SECONDS = 600  # Assets stored or used this recently are never evicted for space (e.g. a batch still being built)
+
+ASSET_NAME_PATTERN = re.compile(r'^[0-9a-f]{64}\.[a-z0-9]{1,5}$')
+
+
+class AssetStore:
+    """
+    Content-addressed store for generated and edited images. Each asset is saved once under
+    the SHA-256 of its bytes (identical outputs are stored once), fanned out into
+    subdirectories, and tracked in a SQLite index so quota and age checks never scan the disk.
+    Assets unused for `max_age_seconds` are dropped, then least recently used ones until the
+    store fits `max_bytes` (tracked as a running total, so puts never sum the table).
+    Recently stored or used assets are not evicted for space.
+    Manifests are ordered lists of assets with download names (one per generation or edit
+    batch); the session only keeps manifest ids.
+    """
+
+    def __init__(self, directory=DEFAULT_STORE_DIR, index_path=DEFAULT_INDEX_PATH,
+                 max_bytes=DEFAULT_MAX_BYTES, max_age_seconds=DEFAULT_MAX_AGE_SECONDS):
+        self.directory = directory
+        self.index_path = index_path
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.deduplicated = 0
+        self._conn = None
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def configure(self, directory=None, index_path=None, max_bytes=None, max_age_seconds=None):
+        with self._lock:
+            if directory:
+                self.directory = directory
+            if index_path and index_path != self.index_path:
+                if self._conn:
+                    self._conn.close()
+                    self._conn = None
+                self.index_path = index_path
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            if max_age_seconds is not None:
+                self.max_age_seconds = max_age_seconds
+
+    def _db(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.index_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.index_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS assets ("
+                " name TEXT PRIMARY KEY, sha256 TEXT NOT NULL UNIQUE, size INTEGER NOT NULL,"
+                " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_assets_accessed ON assets (accessed_at)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS manifests ("
+                " id TEXT PRIMARY KEY, kind TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS manifest_items ("
+                " manifest_id TEXT NOT NULL, position INTEGER NOT NULL, name TEXT NOT NULL,"
+                " display_name TEXT NOT NULL, PRIMARY KEY (manifest_id, position))"
+            )
+            self._conn.commit()
+            # The only full scan: afterwards the total is kept up to date by put() and _evict()
+            self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM assets").fetchone()[0]
+        return self._conn
+
+    def _file_path(self, name):
+        return os.path.join(self.directory, name[:2], name)
+
+    def put(self, data, extension):
+        """Stores `data` (unless identical bytes are already stored) and returns the asset name."""
+        digest = hashlib.sha256(data).hexdigest()
+        extension = (extension or '.bin').lower()
+        if not extension.startswith('.'):
+            extension = f".{extension}"
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT name, size FROM assets WHERE sha256 = ?", (digest,)).fetchone()
+            if row and os.path.exists(self._file_path(row[0])):
+                db.execute("UPDATE assets SET accessed_at = ? WHERE name = ?", (now, row[0]))
+                db.commit()
+                self.deduplicated += 1
+                return row[0]
+
+            name = f"{digest}{extension}"
+            path = self._file_path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+            if row:
+                # Indexed, but the file is gone: replace the stale row
+                db.execute("DELETE FROM assets WHERE sha256 = ?", (digest,))
+                self._total_bytes -= row[1]
+            db.execute("INSERT OR REPLACE INTO assets (name, sha256, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                       (name, digest, len(data), now, now))
+            db.commit()
+            self._total_bytes += len(data)
+            self._evict(db, now, keep=name)
+        return name
+
+    def path(self, name):
+        """Returns the file path of asset `name` and marks it as used, or None if it is unknown or gone."""
+        if not ASSET_NAME_PATTERN.match(name or ''):
+            return None
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT accessed_at FROM assets WHERE name = ?", (name,)).fetchone()
+            path = self._file_path(name)
+            if not row or not os.path.exists(path):
+                return None
+            if now - row[0] > TOUCH_INTERVAL_SECONDS:
+                db.execute("UPDATE assets SET accessed_at = ? WHERE name = ?", (now, name))
+                db.commit()
+        return path
+
+    def create_manifest(self, kind):
+        """Starts an empty manifest (e.g. for one generation job) and returns its id."""
+        manifest_id = uuid.uuid4().hex
+        with self._lock:
+            db = self._db()
+            db.execute("INSERT INTO manifests (id, kind, created_at) VALUES (?, ?, ?)", (manifest_id, kind, time.time()))
+            db.commit()
+        return manifest_id
+
+    def add_to_manifest(self, manifest_id, name, display_name):
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT INTO manifest_items (manifest_id, position, name, display_name) VALUES"
+                " (?, (SELECT COALESCE(MAX(position), 0) + 1 FROM manifest_items WHERE manifest_id = ?), ?, ?)",
+                (manifest_id, manifest_id, name, display_name),
+            )
+            db.commit()
+
+    def manifest(self, manifest_id, kind=None):
+        """Returns [(name, display_name), ...] for the assets of a manifest that are still stored."""
+        if not manifest_id:
+            return []
+        with self._lock:
+            db = self._db()
+            query = ("SELECT i.name, i.display_name FROM manifest_items i"
+                     " JOIN manifests m ON m.id = i.manifest_id JOIN assets a ON a.name = i.name"
+                     " WHERE i.manifest_id = ?")
+            params = [manifest_id]
+            if kind:
+                query += " AND m.kind = ?"
+                params.append(kind)
+            rows = db.execute(query + " ORDER BY i.position", params).fetchall()
+        return [(name, display_name) for name, display_name in rows if os.path.exists(self._file_path(name))]
+
+    def _evict(self, db, now, keep=None):
+        cutoff = now - self.max_age_seconds
+        doomed = db.execute("SELECT name, size FROM assets WHERE accessed_at < ?", (cutoff,)).fetchall()
+        total = self._total_bytes - sum(size for _, size in doomed)
+        if total > self.max_bytes:
+            # Drop least recently used assets until we are back under the quota, sparing the
+            # asset just stored and anything recent (the rest of its batch may still be coming)
+            excess = total - self.max_bytes
+            for name, size in db.execute("SELECT name, size FROM assets WHERE accessed_at >= ? AND accessed_at < ?"
+                                         " AND name != ? ORDER BY accessed_at ASC",
+                                         (cutoff, now - RECENT_ASSET_SECONDS, keep or '')):
+                doomed.append((name, size))
+                excess -= size
+                if excess <= 0:
+                    break
+        if doomed:
+            for name, _ in doomed:
+                # The original plus any derivatives stored next to it (<sha256>.<variant>.webp)
+                for path in glob.glob(os.path.join(self.directory, name[:2], f"{name.split('.')[0]}.*")):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+            db.executemany("DELETE FROM assets WHERE name = ?", [(name,) for name, _ in doomed])
+            self._total_bytes -= sum(size for _, size in doomed)
+            print(f"[ASSETS] Evicted {len(doomed)} assets (older than {self.max_age_seconds}s or over {self.max_bytes} bytes).")
+        db.execute("DELETE FROM manifest_items WHERE manifest_id IN (SELECT id FROM manifests WHERE created_at < ?)", (cutoff,))
+        db.execute("DELETE FROM manifests WHERE created_at < ?", (cutoff,))
+        db.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._db().execute("SELECT COUNT(*) FROM assets").fetchone()[0]
+            return {'entries': entries, 'bytes': self._total_bytes, 'max_bytes': self.max_bytes, 'deduplicated': self.deduplicated}
+
+
+# Shared instance used by the image generation and editing features
+asset_store = AssetStore()
@@ -0,0 +1,96 @@
+# checkpoint.py
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CHECKPOINT_PATH = os.environ.get('CHECKPOINT_PATH', os.path.join('cache', 'checkpoints.sqlite3'))
+DEFAULT_MAX_AGE_SECONDS = 7 * 24 * 3600  # Abandoned checkpoints are dropped after a week
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """Returns the SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_job_key(*parts):
+    """Builds a checkpoint key from whatever identifies a job (input hash, prompt, column...)."""
+    payload = json.dumps(parts, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class CheckpointStore:
+    """
+    Durable journal of completed rows for long row-by-row jobs.
+    Each finished row is committed as soon as it completes, so a restarted job can
+    skip everything that was already done.
+    """
+
+    def __init__(self, path=DEFAULT_CHECKPOINT_PATH, max_age_seconds=DEFAULT_MAX_AGE_SECONDS):
+        self.path = path
+        self.max_age_seconds = max_age_seconds
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def configure(self, path=None, max_age_seconds=None):
+        with self._lock:
+            if path and path != self.path:
+                if self._conn:
+                    self._conn.close()
+                    self._conn = None
+                self.path = path
+            if max_age_seconds is not None:
+                self.max_age_seconds = max_age_seconds
+
+    def _db(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoint_rows ("
+                " job_key TEXT NOT NULL, row_index INTEGER NOT NULL, output TEXT NOT NULL,"
+                " updated_at REAL NOT NULL, PRIMARY KEY (job_key, row_index))"
+            )
+            self._conn.execute("DELETE FROM checkpoint_rows WHERE updated_at < ?",
+                               (time.time() - self.max_age_seconds,))
+            self._conn.commit()
+        return self._conn
+
+    def completed(self, job_key):
+        """Returns {row_index: output} for every row already finished under `job_key`."""
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT row_index, output FROM checkpoint_rows WHERE job_key = ?", (job_key,)
+            ).fetchall()
+        return dict(rows)
+
+    def record(self, job_key, row_index, output):
+        """Durably stores the output of one finished row."""
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO checkpoint_rows (job_key, row_index, output, updated_at) VALUES (?, ?, ?, ?)",
+                (job_key, row_index, output, time.time()),
+            )
+            db.commit()
+
+    def clear(self, job_key):
+        """Forgets a job once its final output has been written."""
+        with self._lock:
+            db = self._db()
+            db.execute("DELETE FROM checkpoint_rows WHERE job_key = ?", (job_key,))
+            db.commit()
+
+
+# Shared instance used by the row-by-row processors
+checkpoints = CheckpointStore()
@@ -5,6 +5,72 @@ class Config:
     # General configuration
     SECRET_KEY = 'your-secret-key'  # Change this in production
     MAX_CONTENT_LENGTH = 1024 * 1024 * 1024  # Limit uploads to 1GB
+
+    # Background jobs
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))  # Jobs that can run at the same time
+    IMAGE_JOB_WORKERS = int(os.environ.get('IMAGE_JOB_WORKERS', 2))  # Image jobs that can run at the same time (separate pool)
+    JOB_RETENTION_SECONDS = 24 * 3600  # How long finished jobs stay queryable
+    EXCEL_ROW_CONCURRENCY = int(os.environ.get('EXCEL_ROW_CONCURRENCY', 4))  # Rows in flight per Excel row job
+    EXCEL_ROW_MAX_BATCH_SIZE = int(os.environ.get('EXCEL_ROW_MAX_BATCH_SIZE', 25))  # Upper bound for rows packed into one request
+    EXCEL_ROW_BATCH_TOKEN_BUDGET = int(os.environ.get('EXCEL_ROW_BATCH_TOKEN_BUDGET', 4000))  # Estimated input tokens per batched request
+    STORY_CONCURRENCY = int(os.environ.get('STORY_CONCURRENCY', 4))  # Sentences in flight per story job
+    IMAGE_EDIT_CONCURRENCY = int(os.environ.get('IMAGE_EDIT_CONCURRENCY', 4))  # Images edited at once per image editor job
+    IMAGE_GENERATION_CONCURRENCY = int(os.environ.get('IMAGE_GENERATION_CONCURRENCY', 12))  # Images requested at once per generation job
+
+    # Images larger than this (longest side, px) are downscaled and stripped of metadata before they are sent
+    IMAGE_MAX_SIDE = int(os.environ.get('IMAGE_MAX_SIDE', 3072))
+    IMAGE_JPEG_QUALITY = 90
+
+    # /feature/excel: how workbooks are sent to Gemini ('profile', 'raw' or 'hybrid') and the token budget
+    EXCEL_DEFAULT_MODE = os.environ.get('EXCEL_DEFAULT_MODE', 'hybrid')
+    EXCEL_CONTEXT_TOKEN_BUDGET = int(os.environ.get('EXCEL_CONTEXT_TOKEN_BUDGET', 37500))  # ~150k characters
+    EXCEL_MAP_CHUNK_TOKENS = int(os.environ.get('EXCEL_MAP_CHUNK_TOKENS', 30000))  # Rows per map call in 'mapreduce' mode
+    EXCEL_MAP_CONCURRENCY = int(os.environ.get('EXCEL_MAP_CONCURRENCY', 4))  # Chunks analysed at once
+    EXCEL_MAP_MAX_CHUNKS = 60  # Chunks grow beyond EXCEL_MAP_CHUNK_TOKENS rather than exceed this
+
+    # Gemini quota per model (requests and tokens per minute); other models use the
+    # GEMINI_DEFAULT_RPM / GEMINI_DEFAULT_TPM environment defaults in rate_limiter.py
+    GEMINI_RATE_LIMITS = {
+        'gemini-2.0-flash': {'rpm': 15, 'tpm': 1000000},
+        'gemini-2.5-pro-exp-03-25': {'rpm': 5, 'tpm': 250000},
+        'gemini-2.0-flash-exp-image-generation': {'rpm': 10, 'tpm': 200000},
+    }
+
+    # Response cache for repeated Gemini prompts
+    RESPONSE_CACHE_PATH = os.path.join('cache', 'responses.sqlite3')
+    RESPONSE_CACHE_MAX_BYTES = 200 * 1024 * 1024  # LRU eviction above 200 MB
+    RESPONSE_CACHE_MAX_AGE_SECONDS = 30 * 24 * 3600  # Entries expire after 30 days
+
+    # Index of uploaded Gemini files by content hash (reused until shortly before they expire)
+    GEMINI_FILE_INDEX_PATH = os.path.join('cache', 'gemini_files.sqlite3')
+    GEMINI_FILE_POLL_INITIAL_SECONDS = 0.5  # First processing check; the interval then grows 1.6x per check
+    GEMINI_FILE_POLL_MAX_SECONDS = 10
+    GEMINI_FILE_PROCESSING_TIMEOUT_SECONDS = 600
+    PREPARED_UPLOAD_RETENTION_SECONDS = 3600  # Files sent ahead of the form (POST /uploads) are kept this long
+
+    # Content-addressed store for generated and edited images (replaces static/generated and static/edited)
+    ASSET_STORE_DIR = os.path.join('cache', 'assets')
+    ASSET_INDEX_PATH = os.path.join('cache', 'assets.sqlite3')
+    ASSET_STORE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # LRU eviction above 2 GB
+    ASSET_STORE_MAX_AGE_SECONDS = 7 * 24 * 3600  # Images unused for a week are removed
+    IMAGE_DERIVATIVE_SIZES = {'thumb': 320, 'preview': 1024}  # WebP copies shown in galleries (longest side, px)
+    IMAGE_DERIVATIVE_QUALITY = 80
+    IMAGE_DERIVATIVE_WORKERS = 2
+    ASSET_CACHE_MAX_AGE_SECONDS = 365 * 24 * 3600  # Assets are content-addressed, so browsers may cache them for good
+    ARCHIVE_CACHE_DIR = os.path.join('cache', 'archives')  # Finished "download all" ZIPs, reused for identical batches
+    ARCHIVE_CACHE_MAX_BYTES = 1024 * 1024 * 1024  # LRU eviction above 1 GB
+
+    # Sidecar cache of parsed workbooks, keyed by file content hash
+    WORKBOOK_CACHE_DIR = os.path.join('cache', 'workbooks')
+    WORKBOOK_CACHE_MAX_BYTES = 1024 * 1024 * 1024  # LRU eviction above 1 GB
+
+    # Journal of finished rows for resuming interrupted row-by-row jobs
+    CHECKPOINT_PATH = os.path.join('cache', 'checkpoints.sqlite3')
+
+    # Context caching of large shared prompt prefixes: 'gemini', 'local' (stand-in) or 'off'
+    CONTEXT_CACHE_BACKEND = os.environ.get('CONTEXT_CACHE_BACKEND', 'gemini')
+    CONTEXT_CACHE_TTL_SECONDS = 3600
+    CONTEXT_CACHE_MIN_TOKENS = 4096  # Gemini's minimum cacheable prompt size
     
     @staticmethod
     def init_app(app):
@@ -0,0 +1,192 @@
+# context_cache.py
+
+import datetime
+import hashlib
+import threading
+import time
+from concurrent.futures import Future
+
+from rate_limiter import estimate_tokens
+
+# Gemini only accepts cached contents above a minimum size; smaller prefixes are sent inline
+DEFAULT_MIN_PREFIX_TOKENS = 4096
+DEFAULT_TTL_SECONDS = 3600
+REFRESH_MARGIN_SECONDS = 300  # Extend the TTL when a cache entry is this close to expiring
+
+
+class GeminiContextBackend:
+    """Registers prefixes with the Gemini cached-content facility (google.generativeai SDK)."""
+
+    def __init__(self, genai_module):
+        self.genai = genai_module
+
+    def create(self, model, prefix, ttl_seconds):
+        model_id = model if model.startswith("models/") else f"models/{model}"
+        return self.genai.caching.CachedContent.create(
+            model=model_id,
+            contents=[prefix],
+            ttl=datetime.timedelta(seconds=ttl_seconds),
+        )
+
+    def refresh(self, handle, ttl_seconds):
+        handle.update(ttl=datetime.timedelta(seconds=ttl_seconds))
+
+    def delete(self, handle):
+        handle.delete()
+
+    def generate(self, model, handle, suffix):
+        cached_model = self.genai.GenerativeModel.from_cached_content(cached_content=handle)
+        return cached_model.generate_content(suffix).text
+
+
+class LocalContextBackend:
+    """
+    Stand-in for tests and SDKs without cached contents: keeps the prefix locally and sends
+    prefix + suffix through `generate_fn(model, prompt)`.
+    """
+
+    def __init__(self, generate_fn):
+        self.generate_fn = generate_fn
+        self.created = 0
+        self.deleted = 0
+
+    def create(self, model, prefix, ttl_seconds):
+        self.created += 1
+        return {'prefix': prefix}
+
+    def refresh(self, handle, ttl_seconds):
+        pass
+
+    def delete(self, handle):
+        self.deleted += 1
+
+    def generate(self, model, handle, suffix):
+        return self.generate_fn(model, handle['prefix'] + suffix)
+
+
+class _CacheEntry:
+    def __init__(self, prefix_hash, handle, expires_at):
+        self.prefix_hash = prefix_hash
+        self.handle = handle
+        self.expires_at = expires_at
+        self.refreshing = False
+
+
+class ContextCacheManager:
+    """
+    Registers a large shared prompt prefix once and then sends only the per-call suffix.
+    Entries are tracked per `scope` (e.g. one Excel row job): when the prefix for a scope
+    changes, the old cached content is deleted and a new one is created. TTLs are extended
+    while the entry is in use and expired entries are recreated on demand.
+    Network calls run outside the lock; concurrent callers for the same (model, scope) wait
+    on a single in-flight create. If creating fails, the failure is remembered for that
+    (model, scope) and calls go through `fallback` (the plain prompt) until release().
+    """
+
+    def __init__(self, backend=None, ttl_seconds=DEFAULT_TTL_SECONDS, min_prefix_tokens=DEFAULT_MIN_PREFIX_TOKENS):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.min_prefix_tokens = min_prefix_tokens
+        self._entries = {}
+        self._pending = {}  # (model, scope) -> Future of the create in flight
+        self._failed = {}  # (model, scope) -> prefix hash whose create failed
+        self._lock = threading.Lock()
+
+    def configure(self, backend=None, ttl_seconds=None, min_prefix_tokens=None):
+        with self._lock:
+            self.backend = backend
+            if ttl_seconds is not None:
+                self.ttl_seconds = ttl_seconds
+            if min_prefix_tokens is not None:
+                self.min_prefix_tokens = min_prefix_tokens
+            self._entries = {}
+            self._failed = {}
+
+    def should_cache(self, prefix):
+        """True if the prefix is big enough to be worth (and allowed to be) cached."""
+        return self.backend is not None and estimate_tokens(prefix) >= self.min_prefix_tokens
+
+    def _handle_for(self, model, prefix, scope):
+        """Returns the cached-content handle for the prefix, or None if it could not be created."""
+        prefix_hash = hashlib.sha256(prefix.encode('utf-8')).hexdigest()
+        key = (model, scope)
+        while True:
+            with self._lock:
+                if self._failed.get(key) == prefix_hash:
+                    return None
+                now = time.time()
+                entry = self._entries.get(key)
+                if entry and entry.prefix_hash == prefix_hash and now < entry.expires_at:
+                    if entry.expires_at - now >= REFRESH_MARGIN_SECONDS or entry.refreshing:
+                        return entry.handle
+                    entry.refreshing = True
+                    break
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = Future()
+                    stale = self._entries.pop(key, None)
+                    entry = None
+                    break
+            # Another thread is creating the cached content for this key: wait and look again
+            pending.result()
+
+        if entry is not None:
+            try:
+                self.backend.refresh(entry.handle, self.ttl_seconds)
+                entry.expires_at = time.time() + self.ttl_seconds
+            except Exception as e:
+                print(f"[CONTEXT CACHE] Could not extend TTL for scope '{scope}': {e}")
+            finally:
+                entry.refreshing = False
+            return entry.handle
+
+        handle = None
+        try:
+            if stale:
+                # Prefix changed (or entry expired): drop the old cached content
+                self._delete(stale.handle, scope)
+            print(f"[CONTEXT CACHE] Registering ~{estimate_tokens(prefix)} token prefix for scope '{scope}'.")
+            handle = self.backend.create(model, prefix, self.ttl_seconds)
+        except Exception as e:
+            print(f"[CONTEXT CACHE] Could not create cached content for scope '{scope}', "
+                  f"sending full prompts instead: {e}")
+        with self._lock:
+            if handle is None:
+                self._failed[key] = prefix_hash
+            else:
+                self._entries[key] = _CacheEntry(prefix_hash, handle, time.time() + self.ttl_seconds)
+            self._pending.pop(key, None)
+        pending.set_result(handle)
+        return handle
+
+    def _delete(self, handle, scope):
+        try:
+            self.backend.delete(handle)
+        except Exception as e:
+            print(f"[CONTEXT CACHE] Could not delete cached content for scope '{scope}': {e}")
+
+    def generate(self, model, prefix, suffix, scope="default", fallback=None):
+        """
+        Generates a response for prefix + suffix, sending the prefix via the context cache.
+        When the cached content cannot be created, `fallback(prefix + suffix)` is used instead.
+        """
+        handle = self._handle_for(model, prefix, scope)
+        if handle is None:
+            if fallback is None:
+                raise RuntimeError(f"No cached content available for scope '{scope}'")
+            return fallback(prefix + suffix)
+        return self.backend.generate(model, handle, suffix)
+
+    def release(self, scope):
+        """Deletes the cached contents of a scope that is finished (e.g. a completed job)."""
+        with self._lock:
+            doomed = [key for key in self._entries if key[1] == scope]
+            handles = [self._entries.pop(key).handle for key in doomed]
+            for key in [key for key in self._failed if key[1] == scope]:
+                del self._failed[key]
+        for handle in handles:
+            self._delete(handle, scope)
+
+
+# Shared instance; app.py plugs in the backend at startup
+context_cache = ContextCacheManager()
@@ -0,0 +1,188 @@
+# excel_profile.py
+
+import numpy as np
+import pandas as pd
+
+from rate_limiter import estimate_tokens
+
+EXCEL_MODES = ('profile', 'raw', 'hybrid', 'mapreduce')
+DEFAULT_TOKEN_BUDGET = 37500  # ~150k characters, the old hard cut-off
+
+# Detail levels tried from richest to leanest until the profile fits the token budget
+DETAIL_LEVELS = (
+    {'top_k': 5, 'sample_rows': 5, 'correlations': 10},
+    {'top_k': 3, 'sample_rows': 3, 'correlations': 5},
+    {'top_k': 1, 'sample_rows': 1, 'correlations': 0},
+    {'top_k': 0, 'sample_rows': 0, 'correlations': 0},
+)
+TRUNCATED_MARKER = "\n[Data truncated]"
+
+
+def _fmt(value):
+    """Short, stable text for a statistic."""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return "-"
+    if isinstance(value, (float, np.floating)):
+        return f"{value:.4g}"
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    text = str(value)
+    return text if len(text) <= 60 else text[:57] + "..."
+
+
+def _column_lines(df, top_k):
+    """One line per column: dtype, nulls, distinct values and type-specific statistics."""
+    lines = []
+    null_counts = df.isna().sum()
+    distinct_counts = df.nunique(dropna=True)
+    numeric = df.select_dtypes(include='number')
+    quantiles = numeric.quantile([0, 0.25, 0.5, 0.75, 1.0]) if not numeric.empty else None
+    means = numeric.mean() if not numeric.empty else None
+
+    for column in df.columns:
+        series = df[column]
+        line = (f"- {column} [{series.dtype}]: {int(null_counts[column])} nulls, "
+                f"{int(distinct_counts[column])} distinct")
+        if quantiles is not None and column in numeric.columns:
+            q = quantiles[column]
+            line += (f"; min {_fmt(q.iloc[0])}, p25 {_fmt(q.iloc[1])}, median {_fmt(q.iloc[2])}, "
+                     f"p75 {_fmt(q.iloc[3])}, max {_fmt(q.iloc[4])}, mean {_fmt(means[column])}")
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            line += f"; from {_fmt(series.min())} to {_fmt(series.max())}"
+        elif top_k:
+            top = series.dropna().astype(str).value_counts().head(top_k)
+            if not top.empty:
+                line += "; top: " + ", ".join(f"{_fmt(value)} ({count})" for value, count in top.items())
+        lines.append(line)
+    return lines
+
+
+def _correlation_lines(df, limit):
+    """Strongest pairwise correlations between numeric columns (|r| >= 0.5)."""
+    numeric = df.select_dtypes(include='number')
+    if not limit or numeric.shape[1] < 2:
+        return []
+    corr = numeric.corr()
+    upper = corr.where(np.triu(np.ones(corr.shape, dtype=bool), k=1)).stack()
+    strong = upper[upper.abs() >= 0.5]
+    strongest = strong.iloc[np.argsort(-strong.abs().to_numpy(), kind='stable')].head(limit)
+    return [f"- {a} ~ {b}: r={r:.2f}" for (a, b), r in strongest.items()]
+
+
+def _sample_rows(df, count):
+    """First rows plus an evenly spread sample of the rest, as CSV."""
+    if not count or df.empty:
+        return ""
+    if len(df) <= count:
+        sample = df
+    else:
+        head = max(1, count // 2)
+        spread = np.linspace(head, len(df) - 1, count - head).astype(int)
+        sample = df.iloc[np.unique(np.concatenate([np.arange(head), spread]))]
+    return sample.to_csv(index=False, lineterminator='\n')
+
+
+def profile_sheet(df, sheet_name, top_k=5, sample_rows=5, correlations=10):
+    """Compact text profile of one sheet."""
+    parts = [f"\n--- Sheet: {sheet_name} ({len(df)} rows x {df.shape[1]} columns) ---", "Columns:"]
+    parts.extend(_column_lines(df, top_k))
+    correlation_lines = _correlation_lines(df, correlations)
+    if correlation_lines:
+        parts.append("Strongest correlations:")
+        parts.extend(correlation_lines)
+    sample = _sample_rows(df, sample_rows)
+    if sample:
+        parts.append(f"Representative rows:\n```csv\n{sample}```")
+    return "\n".join(parts) + "\n"
+
+
+def raw_sheets(sheets, max_chars):
+    """
+    Every sheet as CSV, cut at `max_chars` with a [Data truncated] marker.
+    Returns (text, truncated).
+    """
+    parts = []
+    total_chars = 0
+    for sheet_name, df in sheets.items():
+        sheet_text = f"\n--- Sheet: {sheet_name} ---\n" + df.to_csv(index=False, lineterminator='\n')
+        if total_chars + len(sheet_text) > max_chars:
+            remaining_chars = max_chars - total_chars
+            if remaining_chars > 50:
+                parts.append(sheet_text[:remaining_chars])
+            parts.append(TRUNCATED_MARKER)
+            return "".join(parts), True
+        parts.append(sheet_text)
+        total_chars += len(sheet_text)
+    return "".join(parts), False
+
+
+def estimate_workbook_tokens(sheets, sample_rows=200):
+    """
+    Estimated tokens of every sheet rendered as CSV, extrapolated from the header and an
+    evenly spaced sample of rows, so sizing a large workbook never renders all of it.
+    """
+    total_chars = 0
+    for sheet_name, df in sheets.items():
+        total_chars += len(f"\n--- Sheet: {sheet_name} ---\n") + len(",".join(map(str, df.columns))) + 1
+        if df.empty:
+            continue
+        sample = df.iloc[::max(1, len(df) // sample_rows)]
+        sample_chars = len(sample.to_csv(index=False, header=False, lineterminator='\n'))
+        total_chars += sample_chars * len(df) / len(sample)
+    return int(total_chars // 4)  # Same ~4 characters per token as estimate_tokens
+
+
+def build_workbook_context(sheets, mode='hybrid', token_budget=DEFAULT_TOKEN_BUDGET):
+    """
+    Turns {sheet_name: DataFrame} into prompt text that fits `token_budget` estimated tokens.
+      raw     - the sheets as CSV, truncated at the budget (the original behaviour)
+      profile - per-column statistics, correlations and a few representative rows per sheet
+      hybrid  - the profile followed by as much raw CSV as still fits
+    'mapreduce' needs one call per chunk (see chunk_sheets) and is handled by the caller.
+    Returns (text, truncated), where truncated means some raw data had to be left out.
+    """
+    if mode not in EXCEL_MODES:
+        raise ValueError(f"Unknown Excel mode '{mode}'. Allowed: {', '.join(EXCEL_MODES)}")
+    max_chars = token_budget * 4  # estimate_tokens counts ~4 characters per token
+    if mode == 'raw':
+        return raw_sheets(sheets, max_chars)
+    if mode == 'mapreduce':
+        raise ValueError("Map-reduce mode needs one call per chunk; use chunk_sheets() instead.")
+
+    for level in DETAIL_LEVELS:
+        profile = "".join(profile_sheet(df, name, **level) for name, df in sheets.items())
+        if estimate_tokens(profile) <= token_budget:
+            break
+    else:
+        # Even the leanest profile is too big (very many columns): cut it
+        profile = profile[:max_chars] + "\n[Profile truncated]"
+        return profile, True
+
+    if mode == 'profile':
+        return profile, False
+    raw_text, truncated = raw_sheets(sheets, max_chars - len(profile) - 100)
+    return f"{profile}\nRaw data:{raw_text}", truncated
+
+
+def chunk_sheets(sheets, chunk_tokens):
+    """
+    Splits every sheet into consecutive row ranges of about `chunk_tokens` estimated tokens
+    (each chunk repeats the header). Row sizes are estimated in one vectorized pass, so
+    only the chunks themselves are rendered to CSV.
+    Yields (sheet_name, first_row, last_row, csv_text) with 1-based row numbers.
+    """
+    max_chars = max(1, chunk_tokens) * 4
+    for sheet_name, df in sheets.items():
+        if df.empty:
+            continue
+        # Characters per CSV row: cell text plus one separator per column
+        row_chars = df.astype(str).apply(lambda column: column.str.len()).sum(axis=1).to_numpy() + df.shape[1]
+        boundaries = [0]
+        cumulative = np.cumsum(row_chars)
+        while boundaries[-1] < len(df):
+            start = boundaries[-1]
+            offset = cumulative[start - 1] if start else 0
+            end = int(np.searchsorted(cumulative, offset + max_chars, side='right'))
+            boundaries.append(max(end, start + 1))  # Oversized rows still get a chunk of their own
+        for start, end in zip(boundaries, boundaries[1:]):
+            yield sheet_name, start + 1, end, df.iloc[start:end].to_csv(index=False, lineterminator='\n')
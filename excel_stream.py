@@ -0,0 +1,112 @@
+# excel_stream.py
+
+import os
+
+import pandas as pd
+from openpyxl import load_workbook
+
+
+def _is_xlsx(path):
+    return os.path.splitext(path)[1].lower() in ('.xlsx', '.xlsm')
+
+
+def _open_sheet(path, sheet=0):
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    worksheet = workbook[sheet] if isinstance(sheet, str) else workbook.worksheets[sheet]
+    return workbook, worksheet
+
+
+def cell_text(value):
+    """
+    Text of a cell value as it is sent in prompts. pandas and openpyxl return different types
+    for the same cell (1.0 vs 1, Timestamp vs datetime, numpy scalars), so both are mapped
+    to the same text here; empty cells give "".
+    """
+    if value is None or isinstance(value, str):
+        return value or ""
+    try:
+        if pd.isna(value):
+            return ""
+    except (TypeError, ValueError):
+        pass
+    if isinstance(value, pd.Timestamp):
+        value = value.to_pydatetime()
+    elif hasattr(value, 'item'):
+        value = value.item()  # numpy scalar -> Python value
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+def read_header(path, sheet=0):
+    """Returns the header row of a sheet as a list of column names."""
+    if not _is_xlsx(path):
+        return [str(c) for c in pd.read_excel(path, sheet_name=sheet, nrows=0).columns]
+    workbook, worksheet = _open_sheet(path, sheet)
+    try:
+        for row in worksheet.iter_rows(min_row=1, max_row=1, values_only=True):
+            return ["" if value is None else str(value) for value in row]
+        return []
+    finally:
+        workbook.close()
+
+
+def count_rows(path, sheet=0):
+    """
+    Number of data rows (header excluded) according to the sheet's stored dimensions,
+    without parsing the cells. Returns None when the workbook does not record them.
+    """
+    if not _is_xlsx(path):
+        return None
+    workbook, worksheet = _open_sheet(path, sheet)
+    try:
+        return max(0, worksheet.max_row - 1) if worksheet.max_row else None
+    finally:
+        workbook.close()
+
+
+def iter_rows(path, sheet=0):
+    """
+    Yields (row_index, values) for every data row below the header, parsing the sheet lazily
+    with openpyxl's read-only mode so memory stays flat. row_index is 0-based like a
+    DataFrame position. Blank rows at the end of the sheet are dropped, as pandas does.
+    Legacy .xls files are not supported by openpyxl and are read through pandas instead.
+    """
+    if not _is_xlsx(path):
+        df = pd.read_excel(path, sheet_name=sheet)
+        for row_index, values in enumerate(df.itertuples(index=False, name=None)):
+            yield row_index, tuple(None if pd.isna(v) else v for v in values)
+        return
+
+    workbook, worksheet = _open_sheet(path, sheet)
+    try:
+        rows = worksheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        width = len(header)
+        blank_rows = []  # Held back until a non-blank row shows they are not trailing
+        for row_index, values in enumerate(rows):
+            values = tuple(values[:width]) + (None,) * (width - len(values))
+            if all(v is None for v in values):
+                blank_rows.append((row_index, values))
+                continue
+            yield from blank_rows
+            blank_rows = []
+            yield row_index, values
+    finally:
+        workbook.close()
+
+
+def iter_column(path, column=0, sheet=0):
+    """
+    Yields (row_index, value) for one column, selected by header name or 0-based position.
+    Raises KeyError if a named column is not in the header.
+    """
+    if isinstance(column, str):
+        header = read_header(path, sheet)
+        if column not in header:
+            raise KeyError(f"Column '{column}' not found. Available: {', '.join(header)}")
+        column = header.index(column)
+    for row_index, values in iter_rows(path, sheet):
+        yield row_index, values[column] if column < len(values) else None
@@ -0,0 +1,217 @@
+# gemini_files.py
+
+import hashlib
+import heapq
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+DEFAULT_INDEX_PATH = os.environ.get('GEMINI_FILE_INDEX_PATH', os.path.join('cache', 'gemini_files.sqlite3'))
+DEFAULT_FILE_TTL_SECONDS = 48 * 3600  # Gemini keeps uploaded files for 48 hours
+DEFAULT_REUSE_MARGIN_SECONDS = 3600  # Don't hand out handles that expire within the hour
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def save_and_hash(stream, path, chunk_size=COPY_CHUNK_SIZE):
+    """Copies an upload stream to `path` in chunks and returns the SHA-256 of its contents."""
+    digest = hashlib.sha256()
+    with open(path, 'wb') as f:
+        for chunk in iter(lambda: stream.read(chunk_size), b''):
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest()
+
+
+def _expires_at(file_obj):
+    expiration = getattr(file_obj, 'expiration_time', None)
+    if expiration is not None and hasattr(expiration, 'timestamp'):
+        try:
+            return expiration.timestamp()
+        except (OverflowError, OSError, ValueError):
+            pass
+    return time.time() + DEFAULT_FILE_TTL_SECONDS
+
+
+class GeminiFileIndex:
+    """
+    Persistent map from the SHA-256 of a local file (plus its MIME type) to the Gemini File
+    it was uploaded as, so the same bytes are not uploaded and processed twice while the
+    remote file is still alive. Entries close to their expiry are dropped on lookup.
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH, reuse_margin_seconds=DEFAULT_REUSE_MARGIN_SECONDS):
+        self.path = path
+        self.reuse_margin_seconds = reuse_margin_seconds
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def configure(self, path=None, reuse_margin_seconds=None):
+        with self._lock:
+            if path and path != self.path:
+                if self._conn:
+                    self._conn.close()
+                    self._conn = None
+                self.path = path
+            if reuse_margin_seconds is not None:
+                self.reuse_margin_seconds = reuse_margin_seconds
+
+    def _db(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS gemini_files ("
+                " sha256 TEXT NOT NULL, mime_type TEXT NOT NULL, name TEXT NOT NULL, uri TEXT,"
+                " expires_at REAL NOT NULL, created_at REAL NOT NULL, PRIMARY KEY (sha256, mime_type))"
+            )
+            self._conn.execute("DELETE FROM gemini_files WHERE expires_at < ?", (time.time(),))
+            self._conn.commit()
+        return self._conn
+
+    def lookup(self, sha256, mime_type=None):
+        """Returns the Gemini file name recorded for these bytes, or None if unknown or about to expire."""
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT name, expires_at FROM gemini_files WHERE sha256 = ? AND mime_type = ?",
+                             (sha256, mime_type or '')).fetchone()
+            if row and row[1] - self.reuse_margin_seconds > time.time():
+                self.hits += 1
+                return row[0]
+            if row:
+                db.execute("DELETE FROM gemini_files WHERE sha256 = ? AND mime_type = ?", (sha256, mime_type or ''))
+                db.commit()
+            self.misses += 1
+            return None
+
+    def record(self, sha256, mime_type, file_obj):
+        """Remembers that these bytes are now available as `file_obj` (an ACTIVE Gemini File)."""
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO gemini_files (sha256, mime_type, name, uri, expires_at, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (sha256, mime_type or '', file_obj.name, getattr(file_obj, 'uri', None), _expires_at(file_obj), time.time()),
+            )
+            db.commit()
+
+    def forget(self, name):
+        """Drops every entry pointing at the Gemini file `name` (deleted, failed or gone)."""
+        with self._lock:
+            db = self._db()
+            db.execute("DELETE FROM gemini_files WHERE name = ?", (name,))
+            db.commit()
+
+    def stats(self):
+        with self._lock:
+            count = self._db().execute("SELECT COUNT(*) FROM gemini_files").fetchone()[0]
+            return {'entries': count, 'hits': self.hits, 'misses': self.misses}
+
+
+# Shared instance used by the upload helpers in app.py
+gemini_file_index = GeminiFileIndex()
+
+
+class FileProcessingPoller:
+    """
+    Waits for many Gemini files to leave the PROCESSING state from one background thread.
+    Each file is polled at `initial_interval` seconds at first and the interval grows by
+    `backoff` up to `max_interval`, so small files are picked up within a second while long
+    videos cost only a few requests. watch() returns a Future resolved with the final file
+    object (ACTIVE, FAILED, ...) or failed with TimeoutError after `timeout_seconds`.
+    Futures are resolved on a small callback pool, so done-callbacks (e.g. deleting a remote
+    file) never hold up the polling thread.
+    """
+
+    def __init__(self, get_file=None, initial_interval=0.5, max_interval=10.0, backoff=1.6, timeout_seconds=600,
+                 callback_workers=4):
+        self.get_file = get_file
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.timeout_seconds = timeout_seconds
+        self._heap = []  # (next_check, sequence, name, interval, deadline, future)
+        self._sequence = 0
+        self.callback_workers = callback_workers
+        self._condition = threading.Condition()
+        self._thread = None
+        self._callbacks = None
+
+    def configure(self, get_file=None, initial_interval=None, max_interval=None, timeout_seconds=None):
+        with self._condition:
+            if get_file is not None:
+                self.get_file = get_file
+            if initial_interval is not None:
+                self.initial_interval = initial_interval
+            if max_interval is not None:
+                self.max_interval = max_interval
+            if timeout_seconds is not None:
+                self.timeout_seconds = timeout_seconds
+
+    def watch(self, file_obj):
+        """Returns a Future for `file_obj` that resolves once it is no longer PROCESSING."""
+        future = Future()
+        if file_obj.state.name != "PROCESSING":
+            future.set_result(file_obj)
+            return future
+        now = time.monotonic()
+        with self._condition:
+            self._schedule(now + self.initial_interval, file_obj.name, self.initial_interval,
+                           now + self.timeout_seconds, future)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="gemini-file-poller", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return future
+
+    def pending(self):
+        with self._condition:
+            return len(self._heap)
+
+    def _schedule(self, next_check, name, interval, deadline, future):
+        self._sequence += 1
+        heapq.heappush(self._heap, (next_check, self._sequence, name, interval, deadline, future))
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._condition.wait(timeout=(self._heap[0][0] - time.monotonic()) if self._heap else None)
+                _, _, name, interval, deadline, future = heapq.heappop(self._heap)
+            self._poll(name, interval, deadline, future)
+
+    def _resolve(self, resolve, value):
+        """Runs future.set_result/set_exception (and so its done-callbacks) on the callback pool."""
+        with self._condition:
+            if self._callbacks is None:
+                self._callbacks = ThreadPoolExecutor(max_workers=self.callback_workers,
+                                                     thread_name_prefix="gemini-file-callbacks")
+            callbacks = self._callbacks
+        callbacks.submit(resolve, value)
+
+    def _poll(self, name, interval, deadline, future):
+        try:
+            file_obj = self.get_file(name)
+            if file_obj.state.name != "PROCESSING":
+                self._resolve(future.set_result, file_obj)
+                return
+        except Exception as e:
+            print(f"[FILE POLLER] Could not check {name}, will retry: {e}")
+        now = time.monotonic()
+        if now >= deadline:
+            self._resolve(future.set_exception,
+                          TimeoutError(f"Gemini file {name} still PROCESSING after {self.timeout_seconds}s"))
+            return
+        interval = min(self.max_interval, interval * self.backoff)
+        with self._condition:
+            self._schedule(min(now + interval, deadline), name, interval, deadline, future)
+
+
+# Shared poller; app.py plugs in genai.get_file at startup
+gemini_file_poller = FileProcessingPoller()
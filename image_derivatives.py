@@ -0,0 +1,104 @@
+# image_derivatives.py
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import PIL.Image
+
+DEFAULT_SIZES = {'thumb': 320, 'preview': 1024}  # Variant name -> longest side in pixels
+DEFAULT_QUALITY = 80
+DEFAULT_WAIT_SECONDS = 30
+
+
+def derivative_path(original_path, variant):
+    """WebP derivative stored next to its original: <name>.<variant>.webp."""
+    return f"{os.path.splitext(original_path)[0]}.{variant}.webp"
+
+
+def build_derivatives(original_path, sizes=DEFAULT_SIZES, quality=DEFAULT_QUALITY):
+    """
+    Writes a WebP copy of the image at `original_path` for every variant in `sizes` that does
+    not exist yet. Variants are produced largest first, each one downscaled from the previous,
+    so the full-resolution image is only resampled once.
+    """
+    missing = [(variant, side) for variant, side in sizes.items()
+               if not os.path.exists(derivative_path(original_path, variant))]
+    if not missing:
+        return
+    with PIL.Image.open(original_path) as image:
+        working = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+    for variant, side in sorted(missing, key=lambda item: -item[1]):
+        working.thumbnail((side, side), PIL.Image.LANCZOS, reducing_gap=3.0)
+        path = derivative_path(original_path, variant)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        working.save(temp_path, format='WEBP', quality=quality, method=4)
+        os.replace(temp_path, path)
+
+
+class DerivativePool:
+    """
+    Builds thumbnails and previews on a small background pool as soon as an image is saved,
+    so galleries can load small WebP files instead of full-resolution originals. ensure()
+    waits for a pending build (or builds inline) when a derivative is requested early.
+    """
+
+    def __init__(self, max_workers=2, sizes=None, quality=DEFAULT_QUALITY):
+        self.max_workers = max_workers
+        self.sizes = dict(sizes or DEFAULT_SIZES)
+        self.quality = quality
+        self._executor = None
+        self._pending = {}  # original path -> Future
+        self._lock = threading.Lock()
+
+    def configure(self, max_workers=None, sizes=None, quality=None):
+        with self._lock:
+            if max_workers and max_workers != self.max_workers and self._executor is None:
+                self.max_workers = max_workers
+            if sizes:
+                self.sizes = dict(sizes)
+            if quality is not None:
+                self.quality = quality
+
+    def _build(self, original_path):
+        try:
+            build_derivatives(original_path, self.sizes, self.quality)
+        except Exception as e:
+            print(f"[DERIVATIVES] Could not build derivatives for {original_path}: {e}")
+
+    def submit(self, original_path):
+        """Queues derivative generation for `original_path` (no-op if they exist or are being built)."""
+        if not original_path or all(os.path.exists(derivative_path(original_path, variant)) for variant in self.sizes):
+            return None
+        with self._lock:
+            future = self._pending.get(original_path)
+            if future:
+                return future
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="derivatives")
+            future = self._executor.submit(self._build, original_path)
+            self._pending[original_path] = future
+        future.add_done_callback(lambda _: self._forget(original_path))
+        return future
+
+    def _forget(self, original_path):
+        with self._lock:
+            self._pending.pop(original_path, None)
+
+    def ensure(self, original_path, variant, timeout=DEFAULT_WAIT_SECONDS):
+        """Returns the path of one derivative, waiting for or building it if necessary (None on failure)."""
+        if variant not in self.sizes:
+            return None
+        path = derivative_path(original_path, variant)
+        if not os.path.exists(path):
+            with self._lock:
+                future = self._pending.get(original_path)
+            if future:
+                wait([future], timeout=timeout)
+            if not os.path.exists(path):
+                self._build(original_path)
+        return path if os.path.exists(path) else None
+
+
+# Shared pool; app.py sets its size and variants at startup
+derivative_pool = DerivativePool()
@@ -0,0 +1,74 @@
+# image_prep.py
+
+import io
+import mimetypes
+
+import PIL.Image
+import PIL.ImageOps
+
+DEFAULT_MAX_SIDE = 3072  # Gemini scales larger images down to fit 3072x3072 anyway
+DEFAULT_JPEG_QUALITY = 90
+
+# Formats sent as they are when they already fit; anything else is re-encoded
+PASSTHROUGH_FORMATS = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'WEBP': 'image/webp', 'GIF': 'image/gif'}
+
+
+class PreparedImage:
+    """Bytes to send to Gemini for one image, with the sizes before and after preprocessing."""
+
+    def __init__(self, data, mime_type, original_bytes, reencoded=False):
+        self.data = data
+        self.mime_type = mime_type
+        self.original_bytes = original_bytes
+        self.reencoded = reencoded
+
+    @property
+    def bytes_saved(self):
+        return self.original_bytes - len(self.data)
+
+    def describe(self):
+        if not self.reencoded:
+            return f"sent as is ({self.original_bytes / 1024:.0f} KB)"
+        return (f"re-encoded {self.original_bytes / 1024:.0f} KB -> {len(self.data) / 1024:.0f} KB "
+                f"({self.bytes_saved / 1024:.0f} KB saved)")
+
+
+def _has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def prepare_image(path, max_side=DEFAULT_MAX_SIDE, jpeg_quality=DEFAULT_JPEG_QUALITY):
+    """
+    Returns a PreparedImage for the image at `path`. Images that already fit `max_side` (and
+    animated images) are passed through as their original bytes; only the header is read.
+    Larger images are rotated upright, downscaled to fit `max_side`, stripped of metadata and
+    re-encoded (PNG when they have transparency, JPEG otherwise). The original bytes are kept
+    if the re-encoded image turns out no smaller.
+    """
+    with open(path, 'rb') as f:
+        original = f.read()
+
+    with PIL.Image.open(io.BytesIO(original)) as image:
+        mime_type = PASSTHROUGH_FORMATS.get(image.format) or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        fits = max(image.size) <= max_side
+        if (fits and image.format in PASSTHROUGH_FORMATS) or getattr(image, 'n_frames', 1) > 1:
+            return PreparedImage(original, mime_type, len(original))
+
+        if image.format == 'JPEG':
+            # Let the JPEG decoder skip detail we are about to throw away
+            image.draft('RGB', (max_side, max_side))
+        image = PIL.ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side), PIL.Image.LANCZOS)
+
+        output = io.BytesIO()
+        if _has_alpha(image):
+            image.save(output, format='PNG', optimize=True)
+            new_mime_type = 'image/png'
+        else:
+            image.convert('RGB').save(output, format='JPEG', quality=jpeg_quality, optimize=True)
+            new_mime_type = 'image/jpeg'
+
+    data = output.getvalue()
+    if len(data) >= len(original) and mime_type in PASSTHROUGH_FORMATS.values():
+        return PreparedImage(original, mime_type, len(original))
+    return PreparedImage(data, new_mime_type, len(original), reencoded=True)
@@ -0,0 +1,181 @@
+# jobs.py
+
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job:
+    """State and progress of a single background job."""
+
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = "queued"  # queued -> running -> completed | failed
+        self.total = 0
+        self.done = 0
+        self.percent = None  # Explicit percentage for jobs that do not count units
+        self.message = "Waiting for a free worker..."
+        self.error = None
+        self.result_path = None
+        self.result_name = None
+        self.partial_path = None  # Results written so far, downloadable while the job runs
+        self.events = []  # Per-item results (e.g. one per edited image) for pages that show them as they arrive
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self._lock = threading.Lock()
+
+    def set_status(self, status, message=None, error=None):
+        """Moves the job to `status` (running, completed or failed)."""
+        with self._lock:
+            self.status = status
+            if message:
+                self.message = message
+            if error is not None:
+                self.error = error
+            self.updated_at = time.time()
+
+    def set_total(self, total):
+        with self._lock:
+            self.total = total
+            self.updated_at = time.time()
+
+    def advance(self, count=1, message=None):
+        """Marks `count` more units of work as done."""
+        with self._lock:
+            self.done += count
+            if message:
+                self.message = message
+            self.updated_at = time.time()
+
+    def set_percent(self, percent):
+        with self._lock:
+            self.percent = percent
+            self.updated_at = time.time()
+
+    def set_message(self, message):
+        with self._lock:
+            self.message = message
+            self.updated_at = time.time()
+
+    def set_result(self, path, name=None):
+        """Records the file produced by the job for the download endpoint."""
+        with self._lock:
+            self.result_path = path
+            self.result_name = name
+            self.updated_at = time.time()
+
+    def set_partial(self, path):
+        """Records a file holding the results written so far (None once it is gone)."""
+        with self._lock:
+            self.partial_path = path
+            self.updated_at = time.time()
+
+    def add_event(self, **event):
+        """Appends a per-item event; clients fetch new ones with /jobs/<id>?since=<seq>."""
+        with self._lock:
+            event['seq'] = len(self.events) + 1
+            self.events.append(event)
+            self.updated_at = time.time()
+
+    def events_since(self, seq=0):
+        with self._lock:
+            return list(self.events[max(0, seq):])
+
+    @property
+    def finished(self):
+        with self._lock:
+            return self.status in ("completed", "failed")
+
+    def to_dict(self):
+        """Returns a JSON-serializable snapshot for the status endpoint."""
+        with self._lock:
+            if self.percent is not None:
+                percent = self.percent
+            else:
+                percent = (self.done / self.total * 100) if self.total else (100.0 if self.status == "completed" else 0.0)
+            return {
+                "id": self.id,
+                "kind": self.kind,
+                "status": self.status,
+                "total": self.total,
+                "done": self.done,
+                "percent": round(percent, 1),
+                "message": self.message,
+                "error": self.error,
+                "has_result": self.result_path is not None,
+                "has_partial": self.partial_path is not None and self.result_path is None,
+                "event_count": len(self.events),
+                "created_at": self.created_at,
+                "updated_at": self.updated_at,
+            }
+
+
+class JobProgressVar:
+    """Adapter with a tk.DoubleVar-style set() so code written for progress_var can report to a Job."""
+
+    def __init__(self, job):
+        self.job = job
+
+    def set(self, percent):
+        self.job.set_percent(percent)
+
+
+class JobStatusVar:
+    """Adapter with a tk.StringVar-style set() so code written for status_var can report to a Job."""
+
+    def __init__(self, job):
+        self.job = job
+
+    def set(self, message):
+        self.job.set_message(message)
+
+
+class JobManager:
+    """
+    Runs jobs on a fixed-size worker pool so HTTP requests can return immediately.
+    Finished jobs are kept for `retention_seconds` so their status and result stay available.
+    """
+
+    def __init__(self, max_workers=2, retention_seconds=24 * 3600):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.retention_seconds = retention_seconds
+
+    def submit(self, kind, func, *args, **kwargs):
+        """
+        Queues `func(job, *args, **kwargs)` on the pool and returns the Job right away.
+        The function reports progress through the job and may call job.set_result().
+        """
+        self.prune()
+        job = Job(kind)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, func, args, kwargs)
+        print(f"[JOB {job.id}] Queued '{kind}' job.")
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def prune(self):
+        """Forgets finished jobs older than the retention window."""
+        cutoff = time.time() - self.retention_seconds
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items() if job.finished and job.updated_at < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def _run(self, job, func, args, kwargs):
+        job.set_status("running", message="Running...")
+        print(f"[JOB {job.id}] Started '{job.kind}' job.")
+        try:
+            func(job, *args, **kwargs)
+            job.set_status("completed", message="Completed." if job.message == "Running..." else None)
+            print(f"[JOB {job.id}] Completed.")
+        except Exception as e:
+            job.set_status("failed", message=f"Failed: {e}", error=str(e))
+            print(f"[JOB {job.id}] ERROR: {e}")
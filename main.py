@@ -1,54 +1,115 @@
 import pandas as pd
-import time
 import os
-from app import generate_with_gemini
+from itertools import chain
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from app import generate_with_gemini, GENERATION_ERROR_MESSAGE, RATE_LIMIT_ERROR_MESSAGE
+from checkpoint import checkpoints, file_sha256, make_job_key
+from excel_stream import count_rows, iter_column
+from output_sink import OrderedRowWriter, open_sink
+from story_context import StoryContextBuilder
+from rate_limiter import AdaptivePacer
+
+DEFAULT_CONCURRENCY = 4  # Sentences in flight at once
+_NO_ROWS = object()
 
 def read_excel(file_path):
-    """Read sentences from the first column of an Excel file"""
+    """Read sentences from the first column of an Excel file (lazily, as they are processed)"""
     try:
-        df = pd.read_excel(file_path)
-        if df.empty:
+        # Streams the column instead of loading the whole workbook; the first value is read
+        # here so a missing or empty file is reported before processing starts
+        sentences = (value for _, value in iter_column(file_path, 0))
+        first = next(sentences, _NO_ROWS)
+        if first is _NO_ROWS:
             return None, "The uploaded Excel file is empty."
         
-        column_name = df.columns[0]
-        sentences = df[column_name].tolist()
-        return sentences, None
+        return chain([first], sentences), None
     except Exception as e:
         return None, f"Error reading Excel file: {str(e)}"
 
-def process_sentences(sentences):
-    """Process each sentence, building up the story and generating prompts"""
-    results = []
-    story_so_far = ""
+def summarize_story(previous_summary, new_text):
+    """Fold the next part of the story into the running summary"""
+    prompt = (
+        f"[Summary so far]\n{previous_summary or '(story just started)'}\n"
+        f"[Next part of the story]\n{new_text}\n\n"
+        "Update the summary so it covers the whole story so far: keep the characters, setting and key events. "
+        "Write at most 150 words and only the summary."
+    )
+    summary = generate_with_gemini(prompt)
+    if summary in (GENERATION_ERROR_MESSAGE, RATE_LIMIT_ERROR_MESSAGE):
+        raise RuntimeError(summary)
+    return summary
+
+def process_sentences(sentences, checkpoint_key=None, concurrency=DEFAULT_CONCURRENCY, writer=None):
+    """
+    Process each sentence, building up the story and generating prompts.
+    Prompts only depend on the input sentences, so each one is sent as soon as its story
+    context is built, up to `concurrency` are generated at once and results keep the
+    original sentence order.
+    With a checkpoint_key, each finished sentence is journaled and already finished
+    sentences are skipped when the same job is run again.
+    With an OrderedRowWriter, each result is written out as soon as it is ready instead of
+    being collected, and None is returned.
+    `sentences` can be any iterable (e.g. the stream from read_excel); only sentences in
+    flight are held in memory.
+    """
+    results = {} if writer is None else None
+    in_flight = {}  # Sentences whose prompt is still being generated
     
-    for i, sentence in enumerate(sentences):
-        if i > 0:
-            # Add a 4-second delay after the first API call
-            time.sleep(4)
-        
-        # Update the story with the current sentence
-        if i == 0:
-            story_so_far = sentence
+    def emit(i, sentence, generated_prompt):
+        if writer is not None:
+            writer.put(i, [sentence, generated_prompt])
         else:
-            story_so_far += " " + sentence
+            results[i] = {
+                "Original Sentence": sentence,
+                "Generated Prompt": generated_prompt
+            }
+    # Bounded story context: recent sentences verbatim plus a running summary
+    story_context = StoryContextBuilder(summarize=summarize_story, separator=" ")
+    # Speeds up while calls succeed and backs off on 429s (replaces the fixed 4-second sleep)
+    pacer = AdaptivePacer()
+    completed = checkpoints.completed(checkpoint_key) if checkpoint_key else {}
+    if completed:
+        print(f"Resuming from checkpoint: {len(completed)} sentences already done")
+    
+    processed = len(completed)
+    futures = {}
+    
+    def collect(done_futures):
+        nonlocal processed
+        for future in done_futures:
+            i = futures.pop(future)
+            generated_prompt = future.result()
+            if checkpoint_key and generated_prompt not in (GENERATION_ERROR_MESSAGE, RATE_LIMIT_ERROR_MESSAGE):
+                checkpoints.record(checkpoint_key, i, generated_prompt)
+            
+            # Store the result in the sentence's own slot
+            emit(i, in_flight.pop(i), generated_prompt)
+            
+            processed += 1
+            print(f"Processed sentence {i+1} ({processed} done)")
+    
+    # Each sentence is sent as soon as its context is built, so the calls overlap with the
+    # (occasionally blocking) summary updates instead of waiting for all contexts first
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        for i, sentence in enumerate(sentences):
+            # Update the story with the current sentence
+            story_context.add(sentence)
 
-       
-        
-        # Generate prompt for the current sentence using the format from the user's requirements
-        prompt = f"[Full_story]\n{story_so_far}\n[Sentence i] {sentence}\n\nGenerate a detailed prompt of this sentence related to the full story. Write only one prompt, no text in image ."
-        
-        # Call Gemini API through app.py's function
-        generated_prompt = generate_with_gemini(prompt)
-        
-        # Store the result
-        results.append({
-            "Original Sentence": sentence,
-            "Generated Prompt": generated_prompt
-        })
-        
-        print(f"Processed sentence {i+1}/{len(sentences)}")
+            if i in completed:
+                emit(i, sentence, completed[i])
+                continue
+            in_flight[i] = sentence
+            
+            # Generate prompt for the current sentence using the format from the user's requirements
+            prompt = f"[Full_story]\n{story_context.context()}\n[Sentence i] {sentence}\n\nGenerate a detailed prompt of this sentence related to the full story. Write only one prompt, no text in image ."
+            # Call Gemini API through app.py's function
+            futures[executor.submit(generate_with_gemini, prompt, pacer)] = i
+            # Keep the queue short so context building never runs far ahead of the API calls
+            if len(futures) >= max(1, concurrency) * 2:
+                collect(wait(list(futures), return_when=FIRST_COMPLETED).done)
+        collect(as_completed(list(futures)))
     
-    return results
+    return [results[i] for i in sorted(results)] if results is not None else None
 
 def save_results(results, output_file):
     """Save results to a new Excel file"""
@@ -73,13 +134,24 @@ def main(input_file, output_file="results.xlsx"):
         print(f"Error: {error}")
         return None, error
     
-    print(f"Found {len(sentences)} sentences to process")
+    expected = count_rows(input_file)
+    if expected is not None:
+        print(f"Found ~{expected} sentences to process")
+    
+    # Ensure output directory exists
+    output_dir = os.path.dirname(output_file)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
     
-    # Process sentences
-    results = process_sentences(sentences)
+    # Process sentences (resumable if the run is interrupted); results are written as they finish
+    checkpoint_key = make_job_key('main.process_sentences', file_sha256(input_file))
+    writer = OrderedRowWriter(open_sink(output_file, ["Original Sentence", "Generated Prompt"]))
+    process_sentences(sentences, checkpoint_key, writer=writer)
     
-    # Save results
-    output_path = save_results(results, output_file)
+    # Finalize the output file
+    writer.close()
+    output_path = output_file
+    checkpoints.clear(checkpoint_key)
     print(f"Results saved to: {output_path}")
     
     return output_path, None
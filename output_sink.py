@@ -0,0 +1,167 @@
+# output_sink.py
+
+import csv
+import json
+import os
+import threading
+
+from openpyxl import Workbook
+
+OUTPUT_FORMATS = ('xlsx', 'csv', 'jsonl')
+CHUNK_SIZE = 256 * 1024
+
+
+class CsvSink:
+    """Appends rows to a UTF-8 CSV file (with BOM so Excel opens it correctly)."""
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.partial_path = path  # The file itself is always a valid partial result
+        self.columns = list(columns)
+        self._file = open(path, 'w', newline='', encoding='utf-8-sig')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(self.columns)
+
+    def write_row(self, values):
+        self._writer.writerow(["" if v is None else v for v in values])
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class JsonlSink:
+    """Appends one JSON object per row."""
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.partial_path = path
+        self.columns = list(columns)
+        self._file = open(path, 'w', encoding='utf-8')
+
+    def write_row(self, values):
+        self._file.write(json.dumps(dict(zip(self.columns, values)), ensure_ascii=False, default=str) + "\n")
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class XlsxSink:
+    """
+    Streams rows into an openpyxl write-only workbook, which keeps memory flat but can only
+    be saved once at the end. Until then a CSV copy next to the output serves as the
+    partial result; it is removed when the workbook is closed.
+    """
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = list(columns)
+        self._workbook = Workbook(write_only=True)
+        self._sheet = self._workbook.create_sheet()
+        self._sheet.append(self.columns)
+        self._partial = CsvSink(path + '.partial.csv', columns)
+        self.partial_path = self._partial.path
+
+    def write_row(self, values):
+        self._sheet.append(list(values))
+        self._partial.write_row(values)
+
+    def flush(self):
+        self._partial.flush()
+
+    def close(self):
+        self._workbook.save(self.path)
+        self._partial.close()
+        if os.path.exists(self._partial.path):
+            os.remove(self._partial.path)
+        self.partial_path = None
+
+
+def open_sink(path, columns):
+    """Opens the sink matching the output file extension (.xlsx, .csv or .jsonl)."""
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    if extension == 'csv':
+        return CsvSink(path, columns)
+    if extension == 'jsonl':
+        return JsonlSink(path, columns)
+    if extension == 'xlsx':
+        return XlsxSink(path, columns)
+    raise ValueError(f"Unsupported output format '{extension}'. Allowed: {', '.join(OUTPUT_FORMATS)}")
+
+
+def open_complete_lines(path, chunk_size=CHUNK_SIZE):
+    """
+    Opens a text file that may still be appended to and returns (length, chunks): the number
+    of bytes up to its last complete line right now, and an iterator that streams exactly
+    those bytes. The file is opened here, so it can be removed while the chunks are sent.
+    """
+    f = open(path, 'rb')
+    try:
+        position = f.seek(0, os.SEEK_END)
+        length = 0
+        while position > 0:
+            # Scan backwards for the last newline
+            start = max(0, position - chunk_size)
+            f.seek(start)
+            newline = f.read(position - start).rfind(b'\n')
+            if newline != -1:
+                length = start + newline + 1
+                break
+            position = start
+        f.seek(0)
+    except Exception:
+        f.close()
+        raise
+    return length, _iter_prefix(f, length, chunk_size)
+
+
+def _iter_prefix(f, length, chunk_size):
+    with f:
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+class OrderedRowWriter:
+    """
+    Writes rows that finish out of order to a sink in their original order.
+    Rows are buffered only until the gap before them is filled, so memory is bounded by
+    the number of rows in flight. Every contiguous run written is flushed straight away.
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.next_position = 0
+        self.written = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def put(self, position, values):
+        with self._lock:
+            self._pending[position] = values
+            wrote = False
+            while self.next_position in self._pending:
+                self.sink.write_row(self._pending.pop(self.next_position))
+                self.next_position += 1
+                self.written += 1
+                wrote = True
+            if wrote:
+                self.sink.flush()
+
+    def close(self):
+        """Closes the sink. Raises if rows are still missing, since the output would have a gap."""
+        with self._lock:
+            if self._pending:
+                missing = self.next_position
+                self.sink.close()
+                raise RuntimeError(f"Output is missing row {missing + 1}; {len(self._pending)} later rows were not written.")
+            self.sink.close()
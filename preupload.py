@@ -0,0 +1,111 @@
+# preupload.py
+
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+
+DEFAULT_RETENTION_SECONDS = 3600  # Prepared uploads that are never used are forgotten after an hour
+
+
+class PreparedUpload:
+    """A file the browser sent ahead of the form, being uploaded to Gemini in the background."""
+
+    def __init__(self, kind, filename, local_path):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.filename = filename
+        self.local_path = local_path
+        self.future = Future()  # Resolves to the ACTIVE Gemini file, or None on failure
+        self.created_at = time.time()
+
+    @property
+    def status(self):
+        if not self.future.done():
+            return "processing"
+        return "ready" if self.future.result() is not None else "failed"
+
+    def to_dict(self):
+        return {"id": self.id, "kind": self.kind, "filename": self.filename, "status": self.status}
+
+
+class PreparedUploadRegistry:
+    """
+    Starts Gemini uploads as soon as a file is picked, so the final form POST only has to
+    reference the upload id. `start_upload(local_path, mime_type, sha256)` must return a
+    Future of the Gemini file (see app.start_gemini_upload); the blocking part of the upload
+    runs on a small pool and the processing wait is handed off to that Future.
+    """
+
+    def __init__(self, start_upload=None, max_workers=4, retention_seconds=DEFAULT_RETENTION_SECONDS):
+        self.start_upload = start_upload
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="preupload")
+        self._uploads = {}
+        self._lock = threading.Lock()
+
+    def configure(self, start_upload=None, retention_seconds=None):
+        with self._lock:
+            if start_upload is not None:
+                self.start_upload = start_upload
+            if retention_seconds is not None:
+                self.retention_seconds = retention_seconds
+
+    def submit(self, kind, filename, local_path, mime_type=None, sha256=None):
+        """Registers a saved file and starts uploading it to Gemini; returns the PreparedUpload."""
+        self.prune()
+        prepared = PreparedUpload(kind, filename, local_path)
+        with self._lock:
+            self._uploads[prepared.id] = prepared
+        self._executor.submit(self._run, prepared, mime_type, sha256)
+        print(f"[PREUPLOAD {prepared.id}] Started background upload of '{filename}' ({kind}).")
+        return prepared
+
+    def _run(self, prepared, mime_type, sha256):
+        def finish(upload_future):
+            try:
+                result = upload_future.result()
+            except Exception as e:
+                print(f"[PREUPLOAD {prepared.id}] ERROR: {e}")
+                result = None
+            self._remove_local(prepared)
+            prepared.future.set_result(result)
+            print(f"[PREUPLOAD {prepared.id}] {prepared.status}.")
+
+        try:
+            self.start_upload(prepared.local_path, mime_type, sha256).add_done_callback(finish)
+        except Exception as e:
+            failed = Future()
+            failed.set_exception(e)
+            finish(failed)
+
+    @staticmethod
+    def _remove_local(prepared):
+        # The local copy is only needed for the upload itself
+        if prepared.local_path and os.path.exists(prepared.local_path):
+            try:
+                os.remove(prepared.local_path)
+            except OSError as e:
+                print(f"[PREUPLOAD {prepared.id}] Could not remove {prepared.local_path}: {e}")
+
+    def get(self, upload_id, kind=None):
+        """Returns the prepared upload with this id (and kind, if given), or None."""
+        with self._lock:
+            prepared = self._uploads.get(upload_id)
+        if prepared is None or (kind is not None and prepared.kind != kind):
+            return None
+        return prepared
+
+    def prune(self):
+        """Forgets prepared uploads older than the retention window."""
+        cutoff = time.time() - self.retention_seconds
+        with self._lock:
+            expired = [upload_id for upload_id, prepared in self._uploads.items()
+                       if prepared.future.done() and prepared.created_at < cutoff]
+            for upload_id in expired:
+                del self._uploads[upload_id]
+
+
+# Shared instance; app.py plugs in start_gemini_upload at startup
+prepared_uploads = PreparedUploadRegistry()
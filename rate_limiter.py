@@ -0,0 +1,163 @@
+# rate_limiter.py
+
+import os
+import re
+import threading
+import time
+
+# Fallback quota for models without an explicit entry (Gemini free tier flash limits)
+DEFAULT_RPM = int(os.environ.get('GEMINI_DEFAULT_RPM', 15))
+DEFAULT_TPM = int(os.environ.get('GEMINI_DEFAULT_TPM', 1000000))
+
+# Adaptive pacing (requests per second) for sequential story runs
+PACER_INITIAL_RATE = float(os.environ.get('GEMINI_PACER_INITIAL_RATE', 0.5))
+PACER_MIN_RATE = 0.05
+PACER_MAX_RATE = float(os.environ.get('GEMINI_PACER_MAX_RATE', 10))
+PACER_INCREASE = 0.1  # Added to the rate after every successful call
+
+
+def estimate_tokens(text):
+    """Rough token count for quota purposes (~4 characters per token)."""
+    if not text:
+        return 0
+    return max(1, len(str(text)) // 4)
+
+
+# google.api_core exception types for HTTP 429, matched by name so the check needs no import
+RATE_LIMIT_EXCEPTION_NAMES = {'ResourceExhausted', 'TooManyRequests'}
+
+
+def is_rate_limit_error(error):
+    """
+    True if an API error (exception or message) is a 429 / quota exhaustion.
+    Only 429, RESOURCE_EXHAUSTED and quota count: e.g. "Deadline exceeded" is a timeout.
+    """
+    if isinstance(error, BaseException) and type(error).__name__ in RATE_LIMIT_EXCEPTION_NAMES:
+        return True
+    error_str = str(error).lower()
+    return ("429" in error_str or "quota" in error_str or "resource_exhausted" in error_str
+            or "resource has been exhausted" in error_str)
+
+
+def parse_retry_delay(error_str):
+    """Extracts the server-recommended `retry_delay { seconds: N }` from an error message, or None."""
+    retry_match = re.search(r"retry_delay\s*{\s*seconds:\s*(\d+)", str(error_str))
+    if retry_match:
+        return int(retry_match.group(1))
+    return None
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `capacity` units per `period` seconds.
+    Reservations may push the balance negative; the caller then waits until it is paid back,
+    which keeps waiting callers in arrival order.
+    """
+
+    def __init__(self, capacity, period=60.0):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / period
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+
+    def _refill(self, now):
+        # `now` may predate a bucket created after it was read, so never refill backwards
+        elapsed = max(0.0, now - self.last_refill)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.last_refill = max(self.last_refill, now)
+
+    def reserve(self, amount, now):
+        """Takes `amount` from the bucket and returns how many seconds to wait before using it."""
+        self._refill(now)
+        self.tokens -= min(float(amount), self.capacity)
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+
+class RateLimiter:
+    """
+    Process-wide Gemini quota guard with a requests-per-minute and a tokens-per-minute
+    bucket for every model. Every Gemini call should go through acquire() first.
+    """
+
+    def __init__(self, limits=None, default_rpm=DEFAULT_RPM, default_tpm=DEFAULT_TPM):
+        self._limits = dict(limits or {})
+        self._default = {'rpm': default_rpm, 'tpm': default_tpm}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def configure(self, limits):
+        """Replaces the per-model limits, e.g. {'gemini-2.0-flash': {'rpm': 15, 'tpm': 1000000}}."""
+        with self._lock:
+            self._limits = dict(limits or {})
+            self._buckets = {}
+
+    def _buckets_for(self, model):
+        buckets = self._buckets.get(model)
+        if buckets is None:
+            limit = self._limits.get(model, self._default)
+            buckets = (TokenBucket(limit.get('rpm', self._default['rpm'])),
+                       TokenBucket(limit.get('tpm', self._default['tpm'])))
+            self._buckets[model] = buckets
+        return buckets
+
+    def reserve(self, model, tokens=0):
+        """Books one request and `tokens` tokens for `model`; returns the seconds to wait."""
+        with self._lock:
+            now = time.monotonic()
+            requests_bucket, tokens_bucket = self._buckets_for(model)
+            wait = requests_bucket.reserve(1, now)
+            if tokens:
+                wait = max(wait, tokens_bucket.reserve(tokens, now))
+            return wait
+
+    def acquire(self, model, tokens=0):
+        """Blocks just long enough to stay within the model's RPM and TPM quota."""
+        wait = self.reserve(model, tokens)
+        if wait > 0:
+            print(f"[RATE LIMIT] Waiting {wait:.1f}s for '{model}' quota...")
+            time.sleep(wait)
+        return wait
+
+
+class AdaptivePacer:
+    """
+    AIMD pacing for a stream of Gemini calls: the request rate grows additively while calls
+    succeed and is halved on a 429. A server-provided retry_delay also pushes back the next call.
+    """
+
+    def __init__(self, initial_rate=PACER_INITIAL_RATE, min_rate=PACER_MIN_RATE,
+                 max_rate=PACER_MAX_RATE, increase=PACER_INCREASE):
+        self.rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Blocks until the next call may start at the current rate."""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_slot)
+            self._next_slot = start + 1.0 / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_rate_limited(self, retry_delay=None):
+        """Halves the rate; if the server said how long to wait, nothing starts before then."""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            if retry_delay:
+                self._next_slot = max(self._next_slot, time.monotonic() + retry_delay)
+        print(f"[PACER] Rate limited, slowing down to {self.rate:.2f} requests/s"
+              + (f" (server asked for {retry_delay}s)" if retry_delay else ""))
+
+
+# Shared instance used by every module that talks to Gemini
+gemini_limiter = RateLimiter()
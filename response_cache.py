@@ -0,0 +1,173 @@
+# response_cache.py
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_CACHE_PATH = os.environ.get('RESPONSE_CACHE_PATH', os.path.join('cache', 'responses.sqlite3'))
+DEFAULT_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 200 * 1024 * 1024))  # 200 MB
+DEFAULT_MAX_AGE_SECONDS = int(os.environ.get('RESPONSE_CACHE_MAX_AGE_SECONDS', 30 * 24 * 3600))  # 30 days
+MEMORY_ENTRIES = 2048  # Hot entries kept in process memory in front of SQLite
+TOUCH_INTERVAL_SECONDS = 60  # Memory hits refresh the SQLite access time at most this often
+
+
+def make_cache_key(model, prompt, config=None):
+    """Hashes the model name, prompt text and generation config into a cache key."""
+    payload = json.dumps({'model': model, 'prompt': prompt, 'config': config or {}},
+                         sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Disk-backed cache of Gemini text responses with size- and age-based LRU eviction.
+    Lookups are served from an in-memory LRU first, then from SQLite.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES, max_age_seconds=DEFAULT_MAX_AGE_SECONDS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()  # key -> (text, created_at, touched_at)
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def configure(self, path=None, max_bytes=None, max_age_seconds=None):
+        """Changes the storage location or limits; the database is (re)opened lazily."""
+        with self._lock:
+            if path and path != self.path:
+                if self._conn:
+                    self._conn.close()
+                    self._conn = None
+                self.path = path
+                self._memory.clear()
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            if max_age_seconds is not None:
+                self.max_age_seconds = max_age_seconds
+
+    def _db(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+                " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at)")
+            self._conn.commit()
+        return self._conn
+
+    def _touch(self, key, now):
+        try:
+            db = self._db()
+            db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            db.commit()
+        except sqlite3.Error as e:
+            print(f"[CACHE] Touch failed: {e}")
+
+    def _remember(self, key, text, created_at, touched_at=None):
+        self._memory[key] = (text, created_at, touched_at or created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > MEMORY_ENTRIES:
+            self._memory.popitem(last=False)
+
+    def get(self, model, prompt, config=None):
+        """Returns the cached response text, or None on a miss."""
+        key = make_cache_key(model, prompt, config)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and now - entry[1] <= self.max_age_seconds:
+                self._memory.move_to_end(key)
+                if now - entry[2] > TOUCH_INTERVAL_SECONDS:
+                    # Keep the on-disk LRU order in step, or hot entries would be evicted first
+                    self._touch(key, now)
+                    self._memory[key] = (entry[0], entry[1], now)
+                self.hits += 1
+                return entry[0]
+
+            try:
+                db = self._db()
+                row = db.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row and now - row[1] <= self.max_age_seconds:
+                    db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                    db.commit()
+                    self._remember(key, row[0], row[1], now)
+                    self.hits += 1
+                    return row[0]
+            except sqlite3.Error as e:
+                print(f"[CACHE] Lookup failed: {e}")
+
+            self._memory.pop(key, None)
+            self.misses += 1
+            return None
+
+    def set(self, model, prompt, text, config=None):
+        """Stores a successful response and evicts old entries if over budget."""
+        if not text:
+            return
+        key = make_cache_key(model, prompt, config)
+        now = time.time()
+        with self._lock:
+            self._remember(key, text, now)
+            try:
+                db = self._db()
+                db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, text, len(text.encode('utf-8')), now, now),
+                )
+                db.commit()
+                self._evict(db, now)
+            except sqlite3.Error as e:
+                print(f"[CACHE] Store failed: {e}")
+
+    def _evict(self, db, now):
+        db.execute("DELETE FROM responses WHERE created_at < ?", (now - self.max_age_seconds,))
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total > self.max_bytes:
+            # Drop least recently used entries until we are back under the limit
+            excess = total - self.max_bytes
+            doomed = []
+            for key, size in db.execute("SELECT key, size FROM responses ORDER BY accessed_at ASC"):
+                doomed.append((key,))
+                excess -= size
+                if excess <= 0:
+                    break
+            db.executemany("DELETE FROM responses WHERE key = ?", doomed)
+            for (key,) in doomed:
+                self._memory.pop(key, None)
+            print(f"[CACHE] Evicted {len(doomed)} entries to stay under {self.max_bytes} bytes.")
+        db.commit()
+
+    def stats(self):
+        """Returns hit/miss counters and the current size of the cache."""
+        with self._lock:
+            entries, size = 0, 0
+            try:
+                entries, size = self._db().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            except sqlite3.Error as e:
+                print(f"[CACHE] Stats failed: {e}")
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'entries': entries,
+                'bytes': size,
+                'max_bytes': self.max_bytes,
+            }
+
+
+# Shared instance used by every module that caches Gemini responses
+response_cache = ResponseCache()
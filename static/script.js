@@ -184,4 +184,133 @@ document.addEventListener('DOMContentLoaded', (event) => {
     }
     // --- End Prompt Library Logic ---
 
+    // --- Background Job Progress Logic (pages rendered with a job id) ---
+    document.querySelectorAll('.job-progress').forEach(panel => {
+        const statusUrl = panel.dataset.statusUrl;
+        const bar = panel.querySelector('.job-bar');
+        const message = panel.querySelector('.job-message');
+        const title = panel.querySelector('.job-title');
+        const download = panel.querySelector('.job-download');
+        const partial = panel.querySelector('.job-partial');
+        if (!statusUrl) return;
+        let lastEvent = 0;  // Per-item events already handed to the page
+
+        const poll = () => {
+            fetch(`${statusUrl}?since=${lastEvent}`)
+                .then(response => response.json())
+                .then(job => {
+                    if (job.error && !job.status) {
+                        if (message) message.textContent = job.error;
+                        return;
+                    }
+                    (job.events || []).forEach(jobEvent => {
+                        lastEvent = Math.max(lastEvent, jobEvent.seq);
+                        panel.dispatchEvent(new CustomEvent('job:event', { detail: jobEvent }));
+                    });
+                    if (bar) bar.style.width = `${job.percent}%`;
+                    if (message) {
+                        const counts = job.total ? ` (${job.done}/${job.total})` : '';
+                        message.textContent = `${job.message}${counts}`;
+                    }
+                    if (partial) partial.style.display = job.has_partial ? 'inline-block' : 'none';
+                    if (job.status === 'completed') {
+                        if (title) title.textContent = 'Processing Complete';
+                        if (download && job.has_result) download.style.display = 'inline-block';
+                        panel.dispatchEvent(new CustomEvent('job:completed', { detail: job }));
+                    } else if (job.status === 'failed') {
+                        if (title) title.textContent = 'Processing Failed';
+                        if (message) message.textContent = job.error || job.message;
+                        panel.dispatchEvent(new CustomEvent('job:failed', { detail: job }));
+                    } else {
+                        panel.dispatchEvent(new CustomEvent('job:progress', { detail: job }));
+                        setTimeout(poll, 2000);
+                    }
+                })
+                .catch(err => {
+                    console.error('Failed to fetch job status: ', err);
+                    setTimeout(poll, 5000);
+                });
+        };
+        poll();
+    });
+    // --- End Background Job Progress Logic ---
+
+    // --- Eager Upload Logic (file inputs with data-preupload-kind) ---
+    // The file is sent to /uploads as soon as it is picked, so Gemini can process it while the
+    // prompt is being typed; the form then submits only the upload id instead of the bytes.
+    document.querySelectorAll('input[type="file"][data-preupload-kind]').forEach(fileInput => {
+        const form = fileInput.closest('form');
+        const uploadIdInput = form ? form.querySelector('input[name="upload_id"]') : null;
+        const status = form ? form.querySelector('.preupload-status') : null;
+        const uploadUrl = fileInput.dataset.preuploadUrl;
+        if (!form || !uploadIdInput || !uploadUrl) return;
+        let state = null;
+
+        const showStatus = (text) => { if (status) status.textContent = text; };
+        const fail = (text) => {
+            state = 'failed';
+            uploadIdInput.value = '';  // Fall back to sending the file with the form
+            showStatus(text);
+        };
+
+        const poll = (uploadId) => {
+            fetch(`${uploadUrl}/${uploadId}`)
+                .then(response => response.json())
+                .then(upload => {
+                    if (uploadIdInput.value !== uploadId) return;  // A different file was picked meanwhile
+                    if (upload.error) return fail(upload.error);
+                    state = upload.status;
+                    if (upload.status === 'ready') {
+                        showStatus(`${upload.filename} is uploaded and ready.`);
+                    } else if (upload.status === 'failed') {
+                        fail(`Upload of ${upload.filename} failed; it will be sent with the form instead.`);
+                    } else {
+                        setTimeout(() => poll(uploadId), 1500);
+                    }
+                })
+                .catch(err => {
+                    console.error('Failed to fetch upload status: ', err);
+                    setTimeout(() => poll(uploadId), 5000);
+                });
+        };
+
+        fileInput.addEventListener('change', () => {
+            uploadIdInput.value = '';
+            state = null;
+            const file = fileInput.files[0];
+            if (!file) { showStatus(''); return; }
+
+            const data = new FormData();
+            data.append('kind', fileInput.dataset.preuploadKind);
+            data.append('file', file);
+            state = 'sending';
+            showStatus(`Uploading ${file.name}...`);
+            fetch(uploadUrl, { method: 'POST', body: data })
+                .then(response => response.json())
+                .then(upload => {
+                    if (fileInput.files[0] !== file) return;
+                    if (upload.error) return fail(upload.error);
+                    uploadIdInput.value = upload.id;
+                    state = upload.status;
+                    showStatus(`Processing ${upload.filename}...`);
+                    poll(upload.id);
+                })
+                .catch(err => {
+                    console.error('Failed to pre-upload file: ', err);
+                    fail('');
+                });
+        });
+
+        form.addEventListener('submit', () => {
+            // Don't send the bytes again once the server has them
+            if (uploadIdInput.value && state !== 'failed') {
+                fileInput.required = false;
+                fileInput.disabled = true;
+            }
+        });
+        // Re-enable the input when the page is restored from the back/forward cache
+        window.addEventListener('pageshow', () => { fileInput.disabled = false; });
+    });
+    // --- End Eager Upload Logic ---
+
 }); // End DOMContentLoaded
\ No newline at end of file
@@ -1,23 +1,39 @@
-import pandas as pd
 import time
 import base64
 import os
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from google import genai
 from google.genai import types
+from rate_limiter import gemini_limiter, estimate_tokens, is_rate_limit_error, parse_retry_delay, AdaptivePacer
+from response_cache import response_cache
+from story_context import StoryContextBuilder
+from excel_stream import count_rows, iter_rows, read_header
+from output_sink import OrderedRowWriter, open_sink
+
+STORY_MODEL = "gemini-2.0-flash"
+MAX_RATE_LIMIT_RETRIES = 5
+DEFAULT_CONCURRENCY = 4  # Sentences in flight at once
+
+def generate_text(prompt, pacer=None):
+    """
+    Send a text prompt to Gemini and return the streamed response text.
+    429s are retried; an optional AdaptivePacer sets the pace and learns from successes and 429s.
+    """
+    model = STORY_MODEL
+
+    # Re-runs of the same story are answered from the response cache
+    cached_text = response_cache.get(model, prompt, {"response_mime_type": "text/plain"})
+    if cached_text is not None:
+        return cached_text
 
-def generate_prompt(full_story, current_sentence):
-    """Generate a prompt using Gemini API"""
     client = genai.Client(
         vertexai=True,
         project="",
         location="",
     )
-
-    model = "gemini-2.0-flash"
-    prompt = f"[Full_story]\n{full_story}\n[Sentence i]\n{current_sentence}\nGenerate a prompt text of this sentence"
     
     contents = [
         types.Content(
@@ -31,90 +47,165 @@ def generate_prompt(full_story, current_sentence):
         response_mime_type="text/plain",
     )
 
-    response_text = ""
-    try:
-        response_stream = client.models.generate_content_stream(
-            model=model,
-            contents=contents,
-            config=generate_content_config,
-        )
-        
-        for chunk in response_stream:
-            response_text += chunk.text if chunk.text else ""
-    except Exception as e:
-        # Make sure to fully consume the stream even on error
+    for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+        response_text = ""
         try:
-            # If response_stream exists, exhaust it to avoid "Response not read" errors
-            if 'response_stream' in locals():
-                for _ in response_stream:
-                    pass
-        except Exception as exhaust_error:
-            print(f"Error exhausting stream: {exhaust_error}")
-        return f"Error: {str(e)}"
+            if pacer:
+                pacer.wait()
+            gemini_limiter.acquire(model, estimate_tokens(prompt))
+            response_stream = client.models.generate_content_stream(
+                model=model,
+                contents=contents,
+                config=generate_content_config,
+            )
+            
+            for chunk in response_stream:
+                response_text += chunk.text if chunk.text else ""
+            break
+        except Exception as e:
+            # Make sure to fully consume the stream even on error
+            try:
+                # If response_stream exists, exhaust it to avoid "Response not read" errors
+                if 'response_stream' in locals():
+                    for _ in response_stream:
+                        pass
+            except Exception as exhaust_error:
+                print(f"Error exhausting stream: {exhaust_error}")
+
+            if is_rate_limit_error(e) and attempt < MAX_RATE_LIMIT_RETRIES:
+                retry_delay = parse_retry_delay(e)
+                if pacer:
+                    pacer.on_rate_limited(retry_delay)
+                else:
+                    time.sleep(retry_delay if retry_delay is not None else 2 ** (attempt + 1))
+                continue
+            return f"Error: {str(e)}"
     
+    if pacer:
+        pacer.on_success()
+    response_cache.set(model, prompt, response_text, {"response_mime_type": "text/plain"})
     return response_text
 
-def process_excel(file_path, progress_var=None, status_var=None):
-    """Process the Excel file and generate prompts for each sentence"""
+def generate_prompt(full_story, current_sentence, pacer=None):
+    """Generate a prompt using Gemini API"""
+    prompt = f"[Full_story]\n{full_story}\n[Sentence i]\n{current_sentence}\nGenerate a prompt text of this sentence"
+    return generate_text(prompt, pacer)
+
+def summarize_story(previous_summary, new_text):
+    """Fold the next part of the story into the running summary used by StoryContextBuilder"""
+    prompt = (
+        f"[Summary so far]\n{previous_summary or '(story just started)'}\n"
+        f"[Next part of the story]\n{new_text}\n"
+        "Update the summary so it covers the whole story so far: keep the characters, setting and key events. "
+        "Write at most 150 words and only the summary."
+    )
+    summary = generate_text(prompt)
+    if summary.startswith("Error:"):
+        raise RuntimeError(summary)
+    return summary
+
+def process_excel(file_path, progress_var=None, status_var=None, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Process the Excel file and generate prompts for each sentence.
+    Rows are streamed from the workbook and each sentence is sent as soon as it is read;
+    prompts only depend on the input sentences, so up to `concurrency` sentences are
+    sent at once and results are written back to their own rows.
+    """
+    writer = None
     try:
-        # Read the Excel file
-        df = pd.read_excel(file_path)
+        header = read_header(file_path)
         
         # Ensure the first column exists
-        if df.shape[1] < 1:
+        if len(header) < 1:
             return "Error: Excel file must have at least one column"
         
-        # Get the sentences from the first column
-        sentences = df.iloc[:, 0].tolist()
-        
         # Create a new column for generated prompts if it doesn't exist
-        if df.shape[1] < 2:
-            df["Generated Prompt"] = ""
-        
-        total_sentences = len(sentences)
+        if len(header) < 2:
+            header.append("Generated Prompt")
         
         # Update status if available
         if status_var:
             status_var.set("Processing sentences...")
         
-        # Process each sentence
-        for i, sentence in enumerate(sentences):
-            # Skip empty sentences
-            if pd.isna(sentence) or sentence.strip() == "":
-                continue
+        # Story context grows incrementally and stays bounded (recent sentences + running summary)
+        story_context = StoryContextBuilder(summarize=summarize_story)
+        # Speeds up while calls succeed and backs off on 429s (replaces the fixed 4-second sleep)
+        pacer = AdaptivePacer()
+        # Row count from the sheet dimensions, for progress while the file is still being read
+        expected = count_rows(file_path) or 0
+        
+        # Rows are written in order as soon as they finish; only rows in flight stay in memory
+        output_file = file_path.rsplit(".", 1)[0] + "_with_prompts.xlsx"
+        writer = OrderedRowWriter(open_sink(output_file, header))
+        rows = {}
+        futures = {}
+        processed = 0
+        
+        def collect(done_futures):
+            nonlocal processed
+            for future in done_futures:
+                i = futures.pop(future)
+                try:
+                    generated_prompt = future.result()
+                except Exception as e:
+                    generated_prompt = f"Error: {str(e)}"
                 
-            # Create the full story from processed sentences
-            if i == 0:
-                full_story = ""
-            else:
-                full_story = "\n".join(sentences[:i])
-            
-            # Generate prompt
-            generated_prompt = generate_prompt(full_story, sentence)
-            
-            # Store the result
-            df.iloc[i, 1] = generated_prompt
-            
-            # Update progress if available
-            if progress_var:
-                progress_var.set((i + 1) / total_sentences * 100)
-            
-            # Update status if available
-            if status_var:
-                status_var.set(f"Processed {i+1}/{total_sentences} sentences")
-            
-            # Wait 4 seconds between API calls (except for the last one)
-            if i < total_sentences - 1:
-                time.sleep(4)
+                # Store the result in the sentence's own row
+                row = rows.pop(i)
+                row[1] = generated_prompt
+                writer.put(i, row)
+                processed += 1
+                
+                # Update progress if available
+                if progress_var:
+                    progress_var.set(min(99.0, processed / max(expected, processed, 1) * 100))
+                
+                # Update status if available
+                if status_var:
+                    status_var.set(f"Processed {processed} sentences")
+        
+        # Fan the sentences out to a bounded worker pool while the file is being read
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            for i, values in iter_rows(file_path):
+                row = list(values) + [None] * (len(header) - len(values))
+                sentence = row[0]
+                # Skip empty sentences
+                if sentence is None or str(sentence).strip() == "":
+                    writer.put(i, row)
+                    continue
+                rows[i] = row
+                sentence = str(sentence)
+                futures[executor.submit(generate_prompt, story_context.context(), sentence, pacer)] = i
+                story_context.add(sentence)
+                # Keep the queue short so reading never runs far ahead of the API calls
+                if len(futures) >= max(1, concurrency) * 2:
+                    collect(wait(list(futures), return_when=FIRST_COMPLETED).done)
+            collect(as_completed(list(futures)))
+        
+        if progress_var:
+            progress_var.set(100)
+        if status_var:
+            status_var.set(f"Processed {processed}/{processed} sentences")
         
         # Save the results
-        output_file = file_path.rsplit(".", 1)[0] + "_with_prompts.xlsx"
-        df.to_excel(output_file, index=False)
+        finished, writer = writer, None
+        finished.close()
         
         return f"Processing completed. Results saved to {output_file}"
     
     except Exception as e:
         return f"Error: {str(e)}"
+    
+    finally:
+        if writer is not None:
+            # Failed part-way: save the rows written so far and drop the partial CSV copy
+            partial_path = writer.sink.partial_path
+            try:
+                writer.sink.close()
+            except Exception as e_close:
+                print(f"Could not close output file: {e_close}")
+            if partial_path and os.path.exists(partial_path) and partial_path != writer.sink.path:
+                os.remove(partial_path)
 
 class App:
     def __init__(self, root):
@@ -0,0 +1,64 @@
+# story_context.py
+
+from collections import deque
+
+# Sentences kept verbatim in every prompt
+DEFAULT_WINDOW = 20
+# How many sentences may fall out of the window before the running summary is refreshed
+DEFAULT_SUMMARY_EVERY = 25
+# Hard cap on the running summary so prompt size stays flat
+DEFAULT_MAX_SUMMARY_CHARS = 2000
+
+
+class StoryContextBuilder:
+    """
+    Builds the [Full_story] context for sentence-by-sentence prompt generation in linear time.
+    Keeps the last `window` sentences verbatim plus a running summary of everything older,
+    so the prompt stays roughly the same size no matter how long the story gets.
+
+    `summarize(previous_summary, new_text)` is called every `summary_every` sentences that
+    leave the window and must return the refreshed summary. Without it, older sentences
+    are simply dropped.
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW, summary_every=DEFAULT_SUMMARY_EVERY, summarize=None,
+                 separator="\n", max_summary_chars=DEFAULT_MAX_SUMMARY_CHARS):
+        self.window = window
+        self.summary_every = summary_every
+        self.summarize = summarize
+        self.separator = separator
+        self.max_summary_chars = max_summary_chars
+        self.summary = ""
+        self._recent = deque()
+        self._pending = []  # Sentences that left the window but are not summarized yet
+
+    def add(self, sentence):
+        """Appends a sentence to the story."""
+        self._recent.append(sentence)
+        if len(self._recent) > self.window:
+            self._pending.append(self._recent.popleft())
+            if len(self._pending) >= self.summary_every:
+                self._refresh_summary()
+
+    def _refresh_summary(self):
+        new_text = self.separator.join(self._pending)
+        self._pending = []
+        if not self.summarize:
+            return
+        try:
+            summary = self.summarize(self.summary, new_text)
+        except Exception as e:
+            print(f"Could not refresh story summary, keeping the previous one: {e}")
+            return
+        if summary:
+            self.summary = summary.strip()[-self.max_summary_chars:]
+
+    def context(self):
+        """
+        Returns the bounded story context: the running summary, sentences waiting to be
+        summarized and the recent window (at most window + summary_every sentences).
+        """
+        recent = self.separator.join(self._pending + list(self._recent))
+        if not self.summary:
+            return recent
+        return f"Summary of the story so far: {self.summary}{self.separator}{recent}"
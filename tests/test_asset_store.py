@@ -0,0 +1,92 @@
+import os
+import time
+
+import pytest
+
+import asset_store as asset_store_module
+from asset_store import AssetStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = AssetStore(directory=str(tmp_path / "assets"), index_path=str(tmp_path / "assets.sqlite3"),
+                       max_bytes=1000, max_age_seconds=3600)
+    yield store
+    if store._conn:
+        store._conn.close()
+
+
+def age(store, name, seconds):
+    store._db().execute("UPDATE assets SET accessed_at = ? WHERE name = ?", (time.time() - seconds, name))
+    store._db().commit()
+
+
+def test_identical_bytes_stored_once(store):
+    first = store.put(b"same image", ".png")
+    assert store.put(b"same image", "png") == first
+    assert store.deduplicated == 1
+    assert store.stats()['entries'] == 1 and store.stats()['bytes'] == len(b"same image")
+    assert store.path(first).endswith(first)
+
+
+def test_unknown_or_invalid_names(store):
+    assert store.path("../../etc/passwd") is None
+    assert store.path("0" * 64 + ".png") is None
+
+
+def test_lru_eviction_keeps_new_and_recent_assets(store):
+    old = store.put(b"a" * 400, ".png")
+    used = store.put(b"b" * 400, ".png")
+    age(store, old, 2000)
+    age(store, used, 1000)
+    store.path(used)  # Touch: "old" is now the least recently used
+    newest = store.put(b"c" * 400, ".png")
+    assert store.path(old) is None
+    assert store.path(used) and store.path(newest)
+    assert store.stats()['bytes'] == 800
+
+
+def test_just_inserted_asset_survives_when_everything_is_recent(store):
+    store.put(b"a" * 600, ".png")
+    big = store.put(b"b" * 600, ".png")
+    # Both are part of the current burst: the store goes over quota rather than drop them
+    assert store.path(big)
+    assert store.stats()['bytes'] == 1200
+
+
+def test_just_inserted_asset_is_never_evicted(store, monkeypatch):
+    monkeypatch.setattr(asset_store_module, 'RECENT_ASSET_SECONDS', 0)
+    store.put(b"a" * 600, ".png")
+    huge = store.put(b"b" * 1500, ".png")
+    assert store.path(huge)
+
+
+def test_expired_assets_and_derivatives_removed(store):
+    expired = store.put(b"old", ".png")
+    derivative = os.path.join(store.directory, expired[:2], expired.split('.')[0] + ".thumb.webp")
+    with open(derivative, 'wb') as f:
+        f.write(b"thumb")
+    age(store, expired, 7200)
+    store.put(b"new", ".png")
+    assert store.path(expired) is None
+    assert not os.path.exists(derivative)
+    assert store.stats()['bytes'] == 3
+
+
+def test_running_total_reloaded_from_index(store, tmp_path):
+    store.put(b"x" * 10, ".png")
+    reopened = AssetStore(directory=store.directory, index_path=store.index_path)
+    assert reopened.stats()['bytes'] == 10
+    reopened._conn.close()
+
+
+def test_manifest_keeps_order_and_skips_missing(store):
+    manifest_id = store.create_manifest('generated')
+    first = store.put(b"one", ".png")
+    second = store.put(b"two", ".jpg")
+    store.add_to_manifest(manifest_id, second, "b.jpg")
+    store.add_to_manifest(manifest_id, first, "a.png")
+    assert store.manifest(manifest_id) == [(second, "b.jpg"), (first, "a.png")]
+    assert store.manifest(manifest_id, kind='edited') == []
+    os.remove(store._file_path(second))
+    assert store.manifest(manifest_id) == [(first, "a.png")]
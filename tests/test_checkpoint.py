@@ -0,0 +1,54 @@
+import hashlib
+import time
+
+import pytest
+
+from checkpoint import CheckpointStore, file_sha256, make_job_key
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = CheckpointStore(path=str(tmp_path / "checkpoints.sqlite3"))
+    yield store
+    if store._conn:
+        store._conn.close()
+
+
+def test_file_sha256_reads_in_chunks(tmp_path):
+    path = tmp_path / "input.xlsx"
+    path.write_bytes(b"x" * 10000)
+    assert file_sha256(str(path), chunk_size=1000) == hashlib.sha256(b"x" * 10000).hexdigest()
+
+
+def test_job_key_depends_on_every_part():
+    key = make_job_key('excel_row', 'digest', 'Text', 'prompt')
+    assert key == make_job_key('excel_row', 'digest', 'Text', 'prompt')
+    assert key != make_job_key('excel_row', 'digest', 'Text', 'other prompt')
+
+
+def test_record_completed_and_clear(store):
+    key = make_job_key('job')
+    store.record(key, 2, "third")
+    store.record(key, 0, "first")
+    store.record(key, 0, "first, retried")
+    store.record(make_job_key('other job'), 1, "elsewhere")
+    assert store.completed(key) == {0: "first, retried", 2: "third"}
+    store.clear(key)
+    assert store.completed(key) == {}
+    assert store.completed(make_job_key('other job')) == {1: "elsewhere"}
+
+
+def test_survives_restart(store):
+    store.record("key", 5, "done")
+    store._conn.close()
+    store._conn = None
+    assert CheckpointStore(path=store.path).completed("key") == {5: "done"}
+
+
+def test_abandoned_checkpoints_expire(store):
+    store.record("key", 0, "done")
+    store._conn.execute("UPDATE checkpoint_rows SET updated_at = ?", (time.time() - 3600,))
+    store._conn.commit()
+    reopened = CheckpointStore(path=store.path, max_age_seconds=60)
+    assert reopened.completed("key") == {}
+    reopened._conn.close()
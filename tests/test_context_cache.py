@@ -0,0 +1,69 @@
+import threading
+import time
+
+from context_cache import ContextCacheManager, LocalContextBackend
+
+
+class FailingBackend(LocalContextBackend):
+    def create(self, model, prefix, ttl_seconds):
+        self.created += 1
+        time.sleep(0.05)
+        raise RuntimeError("model does not support cached contents")
+
+
+def make_manager(backend):
+    return ContextCacheManager(backend, min_prefix_tokens=1)
+
+
+def test_prefix_registered_once_per_scope():
+    backend = LocalContextBackend(lambda model, prompt: prompt)
+    manager = make_manager(backend)
+    assert manager.generate("m", "PREFIX ", "row 1", scope="job") == "PREFIX row 1"
+    assert manager.generate("m", "PREFIX ", "row 2", scope="job") == "PREFIX row 2"
+    assert backend.created == 1
+
+
+def test_changed_prefix_replaces_entry_and_release_deletes():
+    backend = LocalContextBackend(lambda model, prompt: prompt)
+    manager = make_manager(backend)
+    manager.generate("m", "A", "1", scope="job")
+    manager.generate("m", "B", "1", scope="job")
+    assert (backend.created, backend.deleted) == (2, 1)
+    manager.release("job")
+    assert backend.deleted == 2
+
+
+def test_concurrent_callers_share_one_create():
+    backend = LocalContextBackend(lambda model, prompt: prompt)
+    manager = make_manager(backend)
+    threads = [threading.Thread(target=manager.generate, args=("m", "P", str(i), "job")) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert backend.created == 1
+
+
+def test_create_failure_falls_back_for_rest_of_scope():
+    backend = FailingBackend(lambda model, prompt: "cached")
+    manager = make_manager(backend)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        manager.generate("m", "P", "s", scope="job", fallback=lambda prompt: f"plain:{prompt}")))
+        for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["plain:Ps"] * 6
+    assert backend.created == 1
+
+    manager.release("job")
+    manager.generate("m", "P", "s", scope="job", fallback=lambda prompt: prompt)
+    assert backend.created == 2
+
+
+def test_small_prefix_not_cached():
+    manager = ContextCacheManager(LocalContextBackend(lambda model, prompt: prompt), min_prefix_tokens=4096)
+    assert not manager.should_cache("short template")
+    assert not ContextCacheManager(None, min_prefix_tokens=1).should_cache("x" * 100)
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from excel_profile import (TRUNCATED_MARKER, build_workbook_context, chunk_sheets, estimate_workbook_tokens,
+                           profile_sheet, raw_sheets)
+from rate_limiter import estimate_tokens
+
+
+def make_sheets(rows=2000):
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=rows)
+    big = pd.DataFrame({'x': x, 'y': x * 2 + rng.normal(scale=0.01, size=rows),
+                        'label': rng.choice(['alpha', 'beta', 'gamma'], size=rows)})
+    return {'big': big, 'small': pd.DataFrame({'t': ['hi', 'there']})}
+
+
+def test_profile_lists_columns_and_correlations():
+    profile = profile_sheet(make_sheets()['big'], 'big')
+    assert "(2000 rows x 3 columns)" in profile
+    assert "- label [" in profile and "top: gamma" in profile
+    assert "- x ~ y: r=1.00" in profile
+    assert "Representative rows:" in profile
+
+
+@pytest.mark.parametrize("mode", ['profile', 'hybrid', 'raw'])
+def test_context_fits_budget(mode):
+    text, _ = build_workbook_context(make_sheets(), mode, token_budget=2000)
+    assert estimate_tokens(text) <= 2000 + 10
+
+
+def test_raw_fallback_reports_truncation():
+    text, truncated = raw_sheets(make_sheets(), max_chars=500)
+    assert truncated and text.endswith(TRUNCATED_MARKER)
+    text, truncated = raw_sheets({'small': make_sheets()['small']}, max_chars=500)
+    assert not truncated and "hi\nthere" in text
+
+
+def test_mapreduce_is_not_a_context_mode():
+    with pytest.raises(ValueError):
+        build_workbook_context(make_sheets(), 'mapreduce')
+    with pytest.raises(ValueError):
+        build_workbook_context(make_sheets(), 'everything')
+
+
+def test_chunks_cover_every_row_in_order():
+    sheets = make_sheets()
+    chunks = list(chunk_sheets(sheets, chunk_tokens=2000))
+    assert len(chunks) > 2
+    big_chunks = [chunk for chunk in chunks if chunk[0] == 'big']
+    assert big_chunks[0][1] == 1 and big_chunks[-1][2] == 2000
+    for previous, current in zip(big_chunks, big_chunks[1:]):
+        assert current[1] == previous[2] + 1
+    for _, first_row, last_row, csv_text in chunks:
+        assert csv_text.count("\n") == last_row - first_row + 2  # Header plus rows
+        assert estimate_tokens(csv_text) <= 2000 * 1.1
+
+
+def test_estimate_close_to_full_render():
+    sheets = make_sheets(rows=5000)
+    full, _ = raw_sheets(sheets, max_chars=10 ** 9)
+    assert estimate_workbook_tokens(sheets) == pytest.approx(estimate_tokens(full), rel=0.1)
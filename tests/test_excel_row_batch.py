@@ -0,0 +1,79 @@
+import json
+import os
+from types import SimpleNamespace
+
+import nltk
+import pytest
+
+
+@pytest.fixture(scope="module")
+def app_module(tmp_path_factory):
+    """Imports app.py inside a scratch directory (it creates its upload folders on import)."""
+    workdir = tmp_path_factory.mktemp("app")
+    previous_dir = os.getcwd()
+    os.environ.setdefault("GEMINI_API_KEY", "test-key")
+    download = nltk.download
+    nltk.download = lambda *args, **kwargs: True
+    os.chdir(workdir)
+    try:
+        import app
+        app.response_cache.configure(path=str(workdir / "responses.sqlite3"))
+        app.gemini_limiter.configure({})
+        yield app
+    finally:
+        nltk.download = download
+        os.chdir(previous_dir)
+
+
+class FakeModel:
+    """Answers batch prompts with `batch_reply(prompt)` and single-row prompts with their row text."""
+
+    def __init__(self, batch_reply):
+        self.batch_reply = batch_reply
+        self.prompts = []
+
+    def generate_content(self, prompt):
+        self.prompts.append(prompt)
+        if "numbered input texts" in prompt:
+            return SimpleNamespace(text=self.batch_reply(prompt))
+        return SimpleNamespace(text="single:" + prompt.rsplit("Input Text from Excel Row: ", 1)[1])
+
+
+def test_iter_row_batches_respects_size_and_token_budget(app_module):
+    rows = [(0, "a"), (1, "b"), (2, "c"), (3, "x" * 400), (4, "d")]
+    batches = list(app_module.iter_row_batches(iter(rows), batch_size=2, token_budget=50))
+    # A row over the budget gets a batch of its own
+    assert batches == [[(0, "a"), (1, "b")], [(2, "c")], [(3, "x" * 400)], [(4, "d")]]
+    assert list(app_module.iter_row_batches([], batch_size=2, token_budget=50)) == []
+
+
+def test_parse_batch_response_accepts_fences_and_wrappers(app_module):
+    reply = '```json\n[{"id": 2, "output": "two"}, {"id": "1", "output": 1}, {"id": 3}]\n```'
+    assert app_module.parse_batch_response(reply, [1, 2]) == {1: "1", 2: "two"}
+    wrapped = json.dumps({"results": [{"id": 1, "output": "one"}]})
+    assert app_module.parse_batch_response(wrapped, [1]) == {1: "one"}
+
+
+def test_parse_batch_response_rejects_incomplete_or_malformed_replies(app_module):
+    with pytest.raises(ValueError):
+        app_module.parse_batch_response('[{"id": 1, "output": "one"}]', [1, 2])
+    with pytest.raises(ValueError):
+        app_module.parse_batch_response("Sure! Here are the answers.", [1])
+
+
+def test_batch_reply_is_split_back_into_rows(app_module):
+    model = FakeModel(lambda prompt: json.dumps([{"id": 1, "output": "A"}, {"id": 2, "output": "B"}]))
+    batch = [(0, "first row"), (1, "second row")]
+    assert app_module.process_excel_row_batch(model, "Split template", batch, total_rows=2) == {0: "A", 1: "B"}
+    assert len(model.prompts) == 1
+    # Answered rows are served from the cache next time
+    assert app_module.process_excel_row_batch(model, "Split template", batch, total_rows=2) == {0: "A", 1: "B"}
+    assert len(model.prompts) == 1
+
+
+def test_malformed_batch_reply_falls_back_to_single_rows(app_module):
+    model = FakeModel(lambda prompt: "not json at all")
+    batch = [(0, "row one"), (1, "row two")]
+    outputs = app_module.process_excel_row_batch(model, "Fallback template", batch, total_rows=2)
+    assert outputs == {0: "single:row one", 1: "single:row two"}
+    assert len(model.prompts) == 3  # One batch request, then one request per row
@@ -0,0 +1,106 @@
+import datetime
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+from excel_stream import cell_text, count_rows, iter_column, iter_rows, read_header
+from workbook_cache import WorkbookCache
+
+
+def test_cell_text_matches_between_pandas_and_openpyxl_values():
+    assert cell_text(np.float64(1.0)) == cell_text(1) == "1"
+    assert cell_text(1.5) == "1.5"
+    assert cell_text(pd.Timestamp("2024-03-01 12:30")) == cell_text(datetime.datetime(2024, 3, 1, 12, 30))
+    assert cell_text(np.bool_(True)) == cell_text(True) == "True"
+
+
+def test_cell_text_empty_values():
+    assert cell_text(None) == ""
+    assert cell_text(float("nan")) == ""
+    assert cell_text(pd.NaT) == ""
+    assert cell_text("  text ") == "  text "
+
+
+def test_streamed_sidecar_round_trip(tmp_path):
+    cache = WorkbookCache(directory=str(tmp_path))
+    writer = cache.stream_writer("digest", "column-text-A")
+    for value in ["a", "", "c"]:
+        writer.append(value)
+    assert cache.open_stream("digest", "column-text-A") is None  # Not visible before commit
+    writer.commit()
+    assert list(cache.open_stream("digest", "column-text-A")) == ["a", "", "c"]
+
+
+def test_discarded_sidecar_leaves_nothing(tmp_path):
+    cache = WorkbookCache(directory=str(tmp_path))
+    writer = cache.stream_writer("digest", "column-text-A")
+    writer.append("a")
+    writer.discard()
+    assert cache.open_stream("digest", "column-text-A") is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def write_workbook(path, rows):
+    workbook = Workbook()
+    for row in rows:
+        workbook.active.append(row)
+    workbook.save(path)
+    return str(path)
+
+
+def test_iter_rows_matches_pandas(tmp_path):
+    path = write_workbook(tmp_path / "in.xlsx", [["Text", "N"], ["a", 1], [None, None], ["c", 3.5], [None, None]])
+    assert read_header(path) == ["Text", "N"]
+    assert count_rows(path) == 4
+    rows = list(iter_rows(path))
+    # Blank rows in the middle are kept, trailing ones dropped (as pandas does)
+    assert rows == [(0, ("a", 1)), (1, (None, None)), (2, ("c", 3.5))]
+    df = pd.read_excel(path)
+    assert len(df) == len(rows)
+    assert [cell_text(v) for v in df["N"]] == [cell_text(values[1]) for _, values in rows]
+
+
+def test_iter_column_by_name_and_position(tmp_path):
+    path = write_workbook(tmp_path / "in.xlsx", [["Text", "N"], ["a", 1], ["b"]])
+    assert list(iter_column(path, "N")) == [(0, 1), (1, None)]
+    assert list(iter_column(path, 0)) == [(0, "a"), (1, "b")]
+    with pytest.raises(KeyError):
+        list(iter_column(path, "Missing"))
+
+
+def test_load_sheets_parses_once_per_content_hash(tmp_path):
+    cache = WorkbookCache(directory=str(tmp_path / "cache"))
+    path = write_workbook(tmp_path / "in.xlsx", [["Text"], ["a"], ["b"]])
+    first = cache.load_sheets(path)
+    assert cache.stats()['misses'] == 1 and cache.stats()['hits'] == 0
+    second = cache.load_sheets(path)
+    assert cache.stats()['hits'] == 1
+    assert list(second) == list(first) and second["Sheet"]["Text"].tolist() == ["a", "b"]
+
+
+def test_unreadable_sidecar_is_dropped_and_reparsed(tmp_path):
+    cache = WorkbookCache(directory=str(tmp_path / "cache"))
+    path = write_workbook(tmp_path / "in.xlsx", [["Text"], ["a"]])
+    cache.load_sheets(path, digest="digest")
+    sidecar = cache._path("digest", "sheets")
+    with open(sidecar, 'wb') as f:
+        f.write(b"not a pickle")
+    assert cache.get("digest", "sheets") is None
+    assert cache.load_sheets(path, digest="digest")["Sheet"]["Text"].tolist() == ["a"]
+
+
+def test_evict_removes_least_recently_used_sidecars(tmp_path):
+    cache = WorkbookCache(directory=str(tmp_path), max_bytes=10 ** 9)
+    for age, name in enumerate(["old", "used", "new"]):
+        cache.put("digest", name, "x" * 1000)
+        mtime = time.time() - 100 + age * 10
+        os.utime(cache._path("digest", name), (mtime, mtime))
+    assert cache.get("digest", "used") is not None  # Reading marks it as recently used
+    cache.max_bytes = 2500
+    cache.evict()
+    assert cache.get("digest", "old") is None
+    assert cache.get("digest", "used") is not None and cache.get("digest", "new") is not None
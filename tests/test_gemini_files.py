@@ -0,0 +1,99 @@
+import datetime
+import hashlib
+import io
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from gemini_files import FileProcessingPoller, GeminiFileIndex, save_and_hash
+
+
+def fake_file(name, state):
+    return SimpleNamespace(name=name, state=SimpleNamespace(name=state))
+
+
+def test_poller_resolves_when_processing_ends():
+    polls = {}
+
+    def get_file(name):
+        polls[name] = polls.get(name, 0) + 1
+        return fake_file(name, "ACTIVE" if polls[name] >= 2 else "PROCESSING")
+
+    poller = FileProcessingPoller(get_file, initial_interval=0.01, max_interval=0.02)
+    future = poller.watch(fake_file("files/a", "PROCESSING"))
+    assert future.result(timeout=5).state.name == "ACTIVE"
+    assert polls["files/a"] == 2
+
+
+def test_slow_callback_does_not_stall_polling():
+    poller = FileProcessingPoller(lambda name: fake_file(name, "ACTIVE"), initial_interval=0.01)
+    release = threading.Event()
+    slow = poller.watch(fake_file("files/slow", "PROCESSING"))
+    slow.add_done_callback(lambda _: release.wait(5))  # e.g. a slow remote delete
+    time.sleep(0.1)
+    started = time.monotonic()
+    fast = poller.watch(fake_file("files/fast", "PROCESSING"))
+    fast.result(timeout=2)
+    assert time.monotonic() - started < 1
+    release.set()
+
+
+def test_timeout():
+    poller = FileProcessingPoller(lambda name: fake_file(name, "PROCESSING"), initial_interval=0.01,
+                                  timeout_seconds=0.05)
+    with pytest.raises(TimeoutError):
+        poller.watch(fake_file("files/stuck", "PROCESSING")).result(timeout=5)
+
+
+def test_finished_file_resolves_immediately():
+    poller = FileProcessingPoller(lambda name: pytest.fail("should not poll"))
+    assert poller.watch(fake_file("files/done", "ACTIVE")).done()
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = GeminiFileIndex(path=str(tmp_path / "gemini_files.sqlite3"), reuse_margin_seconds=3600)
+    yield index
+    if index._conn:
+        index._conn.close()
+
+
+def uploaded(name, hours_left):
+    expiration = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=hours_left)
+    return SimpleNamespace(name=name, uri=f"https://example/{name}", expiration_time=expiration)
+
+
+def test_save_and_hash(tmp_path):
+    path = tmp_path / "upload.pdf"
+    assert save_and_hash(io.BytesIO(b"pdf bytes"), str(path), chunk_size=3) == hashlib.sha256(b"pdf bytes").hexdigest()
+    assert path.read_bytes() == b"pdf bytes"
+
+
+def test_lookup_by_digest_and_mime_type(index):
+    index.record("digest", "application/pdf", uploaded("files/a", 40))
+    assert index.lookup("digest", "application/pdf") == "files/a"
+    assert index.lookup("digest", "image/png") is None
+    assert index.lookup("other", "application/pdf") is None
+    assert index.stats() == {'entries': 1, 'hits': 1, 'misses': 2}
+
+
+def test_files_close_to_expiry_are_not_reused(index):
+    index.record("digest", None, uploaded("files/old", 0.5))  # Inside the one hour margin
+    assert index.lookup("digest") is None
+    assert index.stats()['entries'] == 0
+
+
+def test_forget_drops_every_entry_for_a_file(index):
+    index.record("digest", "image/png", uploaded("files/a", 40))
+    index.record("digest", "image/jpeg", uploaded("files/a", 40))
+    index.record("other", "image/png", uploaded("files/b", 40))
+    index.forget("files/a")
+    assert index.lookup("digest", "image/png") is None and index.lookup("digest", "image/jpeg") is None
+    assert index.lookup("other", "image/png") == "files/b"
+
+
+def test_missing_expiration_uses_default_ttl(index):
+    index.record("digest", None, SimpleNamespace(name="files/c"))
+    assert index.lookup("digest") == "files/c"
@@ -0,0 +1,78 @@
+import os
+import threading
+from concurrent.futures import Future
+
+import PIL.Image
+
+from image_derivatives import DerivativePool, build_derivatives, derivative_path
+
+SIZES = {'thumb': 32, 'preview': 128}
+
+
+def save_image(path, size=(400, 200), mode='RGB'):
+    PIL.Image.new(mode, size, (200, 100, 50, 128) if mode == 'RGBA' else (200, 100, 50)).save(path)
+    return str(path)
+
+
+def test_build_derivatives_writes_every_variant(tmp_path):
+    original = save_image(tmp_path / "photo.png", mode='RGBA')
+    build_derivatives(original, SIZES, quality=70)
+    assert derivative_path(original, 'thumb') == str(tmp_path / "photo.thumb.webp")
+    with PIL.Image.open(derivative_path(original, 'preview')) as preview:
+        assert preview.format == 'WEBP' and preview.size == (128, 64)
+        assert 'A' in preview.getbands()  # Transparency survives
+    with PIL.Image.open(derivative_path(original, 'thumb')) as thumb:
+        assert thumb.size == (32, 16)
+    assert sorted(os.listdir(tmp_path)) == ["photo.png", "photo.preview.webp", "photo.thumb.webp"]
+
+
+def test_build_derivatives_keeps_existing_variants(tmp_path):
+    original = save_image(tmp_path / "photo.png")
+    build_derivatives(original, SIZES)
+    thumb = derivative_path(original, 'thumb')
+    os.utime(thumb, (1, 1))
+    build_derivatives(original, SIZES)
+    assert os.path.getmtime(thumb) == 1
+
+
+def test_ensure_returns_existing_derivative_without_building(tmp_path):
+    original = save_image(tmp_path / "photo.png")
+    build_derivatives(original, SIZES)
+    pool = DerivativePool(sizes=SIZES)
+    builds = []
+    pool._build = lambda path: builds.append(path)
+    assert pool.ensure(original, 'thumb') == derivative_path(original, 'thumb')
+    assert builds == []
+    assert pool.ensure(original, 'huge') is None
+
+
+def test_ensure_waits_for_a_pending_build(tmp_path):
+    original = save_image(tmp_path / "photo.png")
+    pool = DerivativePool(sizes=SIZES)
+    builds = []
+    pool._build = lambda path: builds.append(path)
+    pending = Future()
+    pool._pending[original] = pending
+
+    def finish_build():
+        build_derivatives(original, SIZES)
+        pending.set_result(None)
+
+    threading.Timer(0.1, finish_build).start()
+    assert pool.ensure(original, 'preview', timeout=5) == derivative_path(original, 'preview')
+    assert builds == []  # The pending build was used instead of a second one
+
+
+def test_submit_builds_in_the_background(tmp_path):
+    original = save_image(tmp_path / "photo.png")
+    pool = DerivativePool(max_workers=1, sizes=SIZES)
+    future = pool.submit(original)
+    future.result(timeout=10)
+    assert all(os.path.exists(derivative_path(original, variant)) for variant in SIZES)
+    assert pool.submit(original) is None  # Nothing left to build
+
+
+def test_ensure_returns_none_for_unreadable_images(tmp_path):
+    broken = tmp_path / "broken.png"
+    broken.write_bytes(b"not an image")
+    assert DerivativePool(sizes=SIZES).ensure(str(broken), 'thumb') is None
@@ -0,0 +1,65 @@
+import io
+
+import PIL.Image
+import pytest
+
+from image_prep import prepare_image
+
+
+def save(tmp_path, name, image, **params):
+    path = tmp_path / name
+    image.save(path, **params)
+    return str(path)
+
+
+def noisy(size, mode='RGB'):
+    return PIL.Image.effect_noise(size, 64).convert(mode)
+
+
+def test_small_image_passed_through_untouched(tmp_path):
+    path = save(tmp_path, "small.png", noisy((200, 100)))
+    prepared = prepare_image(path, max_side=512)
+    with open(path, 'rb') as f:
+        assert prepared.data == f.read()
+    assert prepared.mime_type == 'image/png' and not prepared.reencoded
+    assert prepared.describe().startswith("sent as is")
+
+
+def test_large_image_downscaled_to_jpeg(tmp_path):
+    path = save(tmp_path, "large.png", noisy((2000, 1000)))
+    prepared = prepare_image(path, max_side=512)
+    assert prepared.reencoded and prepared.mime_type == 'image/jpeg'
+    assert prepared.bytes_saved > 0
+    with PIL.Image.open(io.BytesIO(prepared.data)) as image:
+        assert image.size == (512, 256)
+
+
+def test_transparency_kept_as_png(tmp_path):
+    path = save(tmp_path, "alpha.png", noisy((1200, 600), 'RGBA'))
+    prepared = prepare_image(path, max_side=300)
+    assert prepared.mime_type == 'image/png'
+    with PIL.Image.open(io.BytesIO(prepared.data)) as image:
+        assert image.mode == 'RGBA' and max(image.size) == 300
+
+
+def test_exif_rotation_applied_and_metadata_stripped(tmp_path):
+    exif = PIL.Image.Exif()
+    exif[0x0112] = 6  # Rotated 90 degrees clockwise
+    path = save(tmp_path, "photo.jpg", noisy((1600, 800)), exif=exif.tobytes())
+    prepared = prepare_image(path, max_side=400)
+    with PIL.Image.open(io.BytesIO(prepared.data)) as image:
+        assert image.size == (200, 400)
+        assert not image.getexif()
+
+
+def test_unsupported_format_reencoded(tmp_path):
+    path = save(tmp_path, "scan.bmp", noisy((100, 100)))
+    prepared = prepare_image(path, max_side=512)
+    assert prepared.reencoded and prepared.mime_type == 'image/jpeg'
+
+
+def test_not_an_image(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_text("hello")
+    with pytest.raises(PIL.UnidentifiedImageError):
+        prepare_image(str(path))
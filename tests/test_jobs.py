@@ -0,0 +1,61 @@
+import threading
+import time
+
+from jobs import JobManager
+
+
+def wait_until_finished(job, timeout=5):
+    deadline = time.time() + timeout
+    while not job.finished and time.time() < deadline:
+        time.sleep(0.01)
+    return job.to_dict()
+
+
+def test_completed_job_reports_progress_and_result():
+    manager = JobManager(max_workers=1)
+
+    def work(job, count):
+        job.set_total(count)
+        for _ in range(count):
+            job.advance(message="step")
+        job.set_result("out.txt", "out.txt")
+
+    status = wait_until_finished(manager.submit('test', work, 3))
+    assert status['status'] == 'completed'
+    assert (status['done'], status['total'], status['percent']) == (3, 3, 100.0)
+    assert status['has_result'] and status['message'] == 'step'
+
+
+def test_failed_job_records_error():
+    manager = JobManager(max_workers=1)
+
+    def work(job):
+        raise ValueError("bad input")
+
+    status = wait_until_finished(manager.submit('test', work))
+    assert status['status'] == 'failed'
+    assert status['error'] == 'bad input' and status['message'] == 'Failed: bad input'
+
+
+def test_status_moves_from_queued_to_running():
+    manager = JobManager(max_workers=1)
+    started, release = threading.Event(), threading.Event()
+
+    def work(job):
+        started.set()
+        release.wait(5)
+
+    job = manager.submit('test', work)
+    started.wait(5)
+    assert job.to_dict()['status'] == 'running'
+    release.set()
+    assert wait_until_finished(job)['status'] == 'completed'
+    assert manager.get(job.id) is job
+
+
+def test_events_since():
+    manager = JobManager(max_workers=1)
+    job = manager.submit('test', lambda job: [job.add_event(item=n) for n in range(3)])
+    wait_until_finished(job)
+    assert [event['item'] for event in job.events_since(1)] == [1, 2]
+    assert job.to_dict()['event_count'] == 3
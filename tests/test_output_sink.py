@@ -0,0 +1,76 @@
+import csv
+import json
+import os
+
+import pytest
+from openpyxl import load_workbook
+
+from output_sink import OrderedRowWriter, open_complete_lines, open_sink
+
+
+def test_rows_written_in_original_order(tmp_path):
+    path = str(tmp_path / "out.csv")
+    writer = OrderedRowWriter(open_sink(path, ['AI Output', 'Input']))
+    writer.put(2, ['c', '3'])
+    writer.put(0, ['a', '1'])
+    assert writer.written == 1  # Row 2 waits for row 1
+    writer.put(1, ['b', '2'])
+    writer.close()
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        assert list(csv.reader(f)) == [['AI Output', 'Input'], ['a', '1'], ['b', '2'], ['c', '3']]
+
+
+def test_close_with_gap_raises(tmp_path):
+    writer = OrderedRowWriter(open_sink(str(tmp_path / "out.jsonl"), ['AI Output']))
+    writer.put(1, ['b'])
+    with pytest.raises(RuntimeError, match="missing row 1"):
+        writer.close()
+
+
+def test_jsonl_sink(tmp_path):
+    path = str(tmp_path / "out.jsonl")
+    writer = OrderedRowWriter(open_sink(path, ['AI Output', 'Input']))
+    writer.put(0, ['a', 1])
+    writer.close()
+    with open(path, encoding='utf-8') as f:
+        assert [json.loads(line) for line in f] == [{'AI Output': 'a', 'Input': 1}]
+
+
+def test_xlsx_sink_keeps_csv_partial_until_closed(tmp_path):
+    path = str(tmp_path / "out.xlsx")
+    sink = open_sink(path, ['AI Output'])
+    writer = OrderedRowWriter(sink)
+    writer.put(0, ['a'])
+    partial_path = sink.partial_path
+    assert partial_path.endswith('.partial.csv') and os.path.exists(partial_path)
+    writer.close()
+    assert not os.path.exists(partial_path) and sink.partial_path is None
+    assert [row for row in load_workbook(path).active.values] == [('AI Output',), ('a',)]
+
+
+def test_unsupported_format(tmp_path):
+    with pytest.raises(ValueError):
+        open_sink(str(tmp_path / "out.txt"), ['AI Output'])
+
+
+def test_complete_lines_cut_at_last_newline(tmp_path):
+    path = tmp_path / "partial.csv"
+    path.write_bytes(b"a,1\nb,2\nc,")
+    length, chunks = open_complete_lines(str(path), chunk_size=3)
+    assert length == 8
+    assert b"".join(chunks) == b"a,1\nb,2\n"
+
+
+def test_complete_lines_survive_removal(tmp_path):
+    path = tmp_path / "partial.csv"
+    path.write_bytes(b"x" * 10 + b"\n")
+    length, chunks = open_complete_lines(str(path))
+    os.remove(path)
+    assert b"".join(chunks) == b"x" * 10 + b"\n"
+
+
+def test_no_complete_line(tmp_path):
+    path = tmp_path / "partial.csv"
+    path.write_bytes(b"half a line")
+    length, chunks = open_complete_lines(str(path))
+    assert (length, b"".join(chunks)) == (0, b"")
@@ -0,0 +1,68 @@
+from concurrent.futures import Future
+
+from preupload import PreparedUploadRegistry
+
+
+def saved_file(tmp_path, name="clip.mp4"):
+    path = tmp_path / name
+    path.write_bytes(b"data")
+    return str(path)
+
+
+def test_upload_becomes_ready_and_local_copy_is_removed(tmp_path):
+    started = []
+
+    def start_upload(local_path, mime_type, sha256):
+        started.append((local_path, mime_type, sha256))
+        future = Future()
+        future.set_result("files/abc")
+        return future
+
+    registry = PreparedUploadRegistry(start_upload=start_upload)
+    path = saved_file(tmp_path)
+    prepared = registry.submit("video", "clip.mp4", path, mime_type="video/mp4", sha256="digest")
+    assert prepared.future.result(timeout=5) == "files/abc"
+    assert prepared.to_dict() == {"id": prepared.id, "kind": "video", "filename": "clip.mp4", "status": "ready"}
+    assert started == [(path, "video/mp4", "digest")]
+    assert not (tmp_path / "clip.mp4").exists()
+
+
+def test_lookup_checks_the_kind(tmp_path):
+    pending = Future()
+    registry = PreparedUploadRegistry(start_upload=lambda *args: pending)
+    prepared = registry.submit("pdf", "doc.pdf", saved_file(tmp_path, "doc.pdf"))
+    assert registry.get(prepared.id, "pdf") is prepared
+    assert registry.get(prepared.id) is prepared
+    assert registry.get(prepared.id, "video") is None
+    assert registry.get("unknown") is None
+    assert prepared.status == "processing"
+    pending.set_result(None)
+    assert prepared.future.result(timeout=5) is None
+    assert prepared.status == "failed"
+
+
+def test_upload_errors_mark_the_upload_failed(tmp_path):
+    def start_upload(local_path, mime_type, sha256):
+        raise RuntimeError("quota exceeded")
+
+    registry = PreparedUploadRegistry(start_upload=start_upload)
+    prepared = registry.submit("audio", "a.mp3", saved_file(tmp_path, "a.mp3"))
+    assert prepared.future.result(timeout=5) is None
+    assert prepared.status == "failed"
+    assert not (tmp_path / "a.mp3").exists()
+
+
+def test_prune_forgets_only_finished_expired_uploads(tmp_path):
+    done = Future()
+    done.set_result("files/done")
+    pending = Future()
+    futures = iter([done, pending])
+    registry = PreparedUploadRegistry(start_upload=lambda *args: next(futures), retention_seconds=60)
+    finished = registry.submit("image", "a.png", saved_file(tmp_path, "a.png"))
+    running = registry.submit("image", "b.png", saved_file(tmp_path, "b.png"))
+    finished.future.result(timeout=5)
+    finished.created_at -= 120
+    running.created_at -= 120
+    registry.prune()
+    assert registry.get(finished.id) is None
+    assert registry.get(running.id) is running  # Still uploading, so kept
@@ -0,0 +1,66 @@
+import pytest
+
+from rate_limiter import (AdaptivePacer, RateLimiter, TokenBucket, estimate_tokens, is_rate_limit_error,
+                          parse_retry_delay)
+
+
+class ResourceExhausted(Exception):
+    pass
+
+
+@pytest.mark.parametrize("message", [
+    "429 Too Many Requests",
+    "Quota exceeded for metric generate_content_requests",
+    "RESOURCE_EXHAUSTED",
+    "Resource has been exhausted (e.g. check quota).",
+])
+def test_rate_limit_messages(message):
+    assert is_rate_limit_error(message)
+    assert is_rate_limit_error(RuntimeError(message))
+
+
+@pytest.mark.parametrize("message", ["504 Deadline exceeded", "400 Maximum length exceeded", "500 Internal error"])
+def test_other_errors_are_not_rate_limits(message):
+    assert not is_rate_limit_error(message)
+
+
+def test_rate_limit_exception_type():
+    assert is_rate_limit_error(ResourceExhausted("slow down"))
+
+
+def test_parse_retry_delay():
+    assert parse_retry_delay("429 ... retry_delay {\n  seconds: 17\n}") == 17
+    assert parse_retry_delay("429 Too Many Requests") is None
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abc") == 1
+    assert estimate_tokens("x" * 400) == 100
+
+
+def test_token_bucket_waits_once_empty():
+    bucket = TokenBucket(2, period=60.0)
+    now = bucket.last_refill
+    assert bucket.reserve(1, now) == 0.0
+    assert bucket.reserve(1, now) == 0.0
+    assert bucket.reserve(1, now) == pytest.approx(30.0)
+
+
+def test_rate_limiter_uses_per_model_limits():
+    limiter = RateLimiter({'fast': {'rpm': 60, 'tpm': 1000}}, default_rpm=1)
+    assert limiter.reserve('fast', 10) == 0.0
+    assert limiter.reserve('fast', 990) == 0.0
+    assert limiter.reserve('fast', 60) == pytest.approx(3.6, rel=0.05)  # TPM bucket is empty
+    assert limiter.reserve('other') == 0.0
+    assert limiter.reserve('other') == pytest.approx(60.0, rel=0.05)  # default 1 RPM
+
+
+def test_adaptive_pacer_halves_on_rate_limit_and_grows_on_success():
+    pacer = AdaptivePacer(initial_rate=1.0, min_rate=0.1, max_rate=2.0, increase=0.5)
+    pacer.on_rate_limited()
+    assert pacer.rate == 0.5
+    pacer.on_success()
+    pacer.on_success()
+    pacer.on_success()
+    assert pacer.rate == 2.0
@@ -0,0 +1,62 @@
+import time
+
+import pytest
+
+import response_cache as response_cache_module
+from response_cache import ResponseCache, make_cache_key
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "responses.sqlite3"), max_bytes=25, max_age_seconds=3600)
+    yield cache
+    if cache._conn:
+        cache._conn.close()
+
+
+def test_key_depends_on_model_prompt_and_config():
+    key = make_cache_key("m", "p")
+    assert key == make_cache_key("m", "p", {})
+    assert len({key, make_cache_key("n", "p"), make_cache_key("m", "q"), make_cache_key("m", "p", {'batch': True})}) == 4
+
+
+def test_hit_miss_and_config_namespace(cache):
+    assert cache.get("m", "p") is None
+    cache.set("m", "p", "answer")
+    assert cache.get("m", "p") == "answer"
+    assert cache.get("m", "p", {'batch': True}) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_empty_responses_not_cached(cache):
+    cache.set("m", "p", "")
+    assert cache.get("m", "p") is None
+
+
+def test_served_from_disk_after_restart(cache):
+    cache.set("m", "p", "answer")
+    reopened = ResponseCache(path=cache.path)
+    assert reopened.get("m", "p") == "answer"
+    reopened._conn.close()
+
+
+def test_lru_eviction_spares_recently_read_entries(cache, monkeypatch):
+    monkeypatch.setattr(response_cache_module, 'TOUCH_INTERVAL_SECONDS', 0)
+    cache.set("m", "a", "a" * 10)
+    time.sleep(0.01)
+    cache.set("m", "b", "b" * 10)
+    time.sleep(0.01)
+    assert cache.get("m", "a")  # Memory hit, must still count as a use on disk
+    time.sleep(0.01)
+    cache.set("m", "c", "c" * 10)  # Over 25 bytes: the least recently used entry goes
+    reopened = ResponseCache(path=cache.path)
+    assert reopened.get("m", "a") and reopened.get("m", "c")
+    assert reopened.get("m", "b") is None
+    reopened._conn.close()
+
+
+def test_expired_entries_are_misses(cache):
+    cache.set("m", "p", "answer")
+    cache.max_age_seconds = 0
+    time.sleep(0.01)
+    assert cache.get("m", "p") is None
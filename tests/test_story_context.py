@@ -0,0 +1,48 @@
+from story_context import StoryContextBuilder
+
+
+def test_context_keeps_only_the_recent_window_without_summarize():
+    builder = StoryContextBuilder(window=3, summary_every=2, separator=" ")
+    for sentence in ["s1", "s2", "s3", "s4"]:
+        builder.add(sentence)
+    assert builder.context() == "s1 s2 s3 s4"  # s1 waits to be summarized
+    builder.add("s5")
+    assert builder.context() == "s3 s4 s5"  # s1 and s2 dropped, no summary
+    assert builder.summary == ""
+
+
+def test_summary_is_refreshed_every_summary_every_sentences():
+    calls = []
+
+    def summarize(previous, new_text):
+        calls.append((previous, new_text))
+        return f"{previous}+{new_text}".strip("+")
+
+    builder = StoryContextBuilder(window=2, summary_every=2, summarize=summarize, separator=" ")
+    for sentence in ["a", "b", "c", "d", "e", "f"]:
+        builder.add(sentence)
+    assert calls == [("", "a b"), ("a b", "c d")]
+    assert builder.context() == "Summary of the story so far: a b+c d e f"
+
+
+def test_summary_is_capped():
+    builder = StoryContextBuilder(window=1, summary_every=1, summarize=lambda previous, new: "x" * 50 + "end",
+                                  max_summary_chars=10)
+    builder.add("a")
+    builder.add("b")
+    assert builder.summary == "xxxxxxxend"
+
+
+def test_failed_summarize_keeps_previous_summary():
+    results = iter(["first summary"])
+
+    def summarize(previous, new_text):
+        return next(results)  # StopIteration on the second call
+
+    builder = StoryContextBuilder(window=1, summary_every=1, summarize=summarize, separator=" ")
+    builder.add("a")
+    builder.add("b")
+    assert builder.summary == "first summary"
+    builder.add("c")
+    assert builder.summary == "first summary"
+    assert builder.context() == "Summary of the story so far: first summary c"
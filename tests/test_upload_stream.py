@@ -0,0 +1,58 @@
+import hashlib
+import io
+
+import pytest
+from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from upload_stream import HashingUploadStream, store_upload
+
+
+def test_small_upload_stays_in_memory(tmp_path):
+    stream = HashingUploadStream(str(tmp_path / "spool"), max_memory_bytes=10)
+    stream.write(b"hello")
+    assert stream.path is None
+    assert not (tmp_path / "spool").exists()
+    stream.seek(0)
+    assert stream.read() == b"hello"
+    assert stream.save_to(str(tmp_path / "saved.txt")) == hashlib.sha256(b"hello").hexdigest()
+    assert (tmp_path / "saved.txt").read_bytes() == b"hello"
+
+
+def test_large_upload_spills_and_is_moved_into_place(tmp_path):
+    stream = HashingUploadStream(str(tmp_path), max_memory_bytes=10, filename="clip.mp4")
+    stream.write(b"0123456789")
+    assert stream.path is None
+    stream.write(b"abc")  # Crosses the threshold
+    spilled = stream.path
+    assert spilled is not None and spilled.endswith(".mp4")
+    saved = tmp_path / "saved.mp4"
+    assert stream.save_to(str(saved)) == hashlib.sha256(b"0123456789abc").hexdigest()
+    assert saved.read_bytes() == b"0123456789abc"
+    assert not (tmp_path / spilled).exists()
+    stream.close()
+    assert saved.exists()  # Closing after save_to leaves the saved file alone
+
+
+def test_unsaved_spill_is_removed_on_close(tmp_path):
+    stream = HashingUploadStream(str(tmp_path), max_memory_bytes=4)
+    stream.write(b"too big")
+    spilled = stream.path
+    stream.close()
+    assert stream.closed
+    assert list(tmp_path.iterdir()) == []
+    assert spilled is not None
+
+
+def test_max_bytes_is_enforced_while_writing(tmp_path):
+    stream = HashingUploadStream(str(tmp_path), max_bytes=5)
+    stream.write(b"12345")
+    with pytest.raises(RequestEntityTooLarge):
+        stream.write(b"6")
+    stream.close()
+
+
+def test_store_upload_handles_plain_streams(tmp_path):
+    storage = FileStorage(stream=io.BytesIO(b"plain"), filename="a.txt")
+    assert store_upload(storage, str(tmp_path / "a.txt")) == hashlib.sha256(b"plain").hexdigest()
+    assert (tmp_path / "a.txt").read_bytes() == b"plain"
@@ -0,0 +1,65 @@
+import io
+import os
+import time
+import zipfile
+
+from zip_stream import ArchiveCache, iter_zip
+
+
+def make_files(tmp_path):
+    image = tmp_path / "a.png"
+    image.write_bytes(b"\x89PNG" + os.urandom(2000))
+    text = tmp_path / "b.txt"
+    text.write_bytes(b"hello " * 1000)
+    return [("a.png", str(image)), ("b.txt", str(text))]
+
+
+def test_iter_zip_streams_valid_archive(tmp_path):
+    entries = make_files(tmp_path)
+    chunks = list(iter_zip(entries, chunk_size=512))
+    assert len(chunks) > 2
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+        assert archive.testzip() is None
+        assert archive.getinfo("a.png").compress_type == zipfile.ZIP_STORED
+        assert archive.getinfo("b.txt").compress_type == zipfile.ZIP_DEFLATED
+        assert archive.read("b.txt") == b"hello " * 1000
+
+
+def test_stream_caches_archive(tmp_path):
+    entries = make_files(tmp_path)
+    cache = ArchiveCache(directory=str(tmp_path / "archives"))
+    key = ArchiveCache.key([("a.png", "sha-a"), ("b.txt", "sha-b")])
+    assert cache.get(key) is None
+    data = b"".join(cache.stream(key, entries))
+    with open(cache.get(key), 'rb') as f:
+        assert f.read() == data
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_abandoned_stream_is_not_cached(tmp_path):
+    entries = make_files(tmp_path)
+    cache = ArchiveCache(directory=str(tmp_path / "archives"))
+    stream = cache.stream("k", entries, chunk_size=256)
+    next(stream)
+    stream.close()  # Client went away
+    assert cache.get("k") is None
+    assert os.listdir(cache.directory) == []
+
+
+def test_evict_removes_least_recently_used(tmp_path):
+    directory = tmp_path / "archives"
+    directory.mkdir()
+    cache = ArchiveCache(directory=str(directory), max_bytes=250)
+    for number, key in enumerate(["old", "used", "new"]):
+        path = directory / f"{key}.zip"
+        path.write_bytes(b"x" * 100)
+        os.utime(path, (time.time() - 100 + number, time.time() - 100 + number))
+    assert cache.get("old")  # Touching it makes "used" the least recently used
+    cache.evict()
+    assert sorted(os.listdir(directory)) == ["new.zip", "old.zip"]
+
+
+def test_get_after_eviction_is_a_miss(tmp_path):
+    cache = ArchiveCache(directory=str(tmp_path / "archives"))
+    os.makedirs(cache.directory)
+    assert cache.get("gone") is None
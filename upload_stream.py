@@ -0,0 +1,115 @@
+# upload_stream.py
+
+import hashlib
+import io
+import os
+import tempfile
+
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from gemini_files import save_and_hash
+
+DEFAULT_MAX_MEMORY_BYTES = 512 * 1024  # Same threshold werkzeug uses before spooling to disk
+
+
+class HashingUploadStream(io.RawIOBase):
+    """
+    Upload target handed to werkzeug's multipart parser (Request._get_file_stream).
+    While the parser writes the file it is hashed and size-checked, kept in memory up to
+    `max_memory_bytes` and only then spilled to a temporary file in `spool_dir`.
+    save_to() moves the spilled file into place instead of copying it, so a large upload
+    is written to disk exactly once before it is sent on to Gemini.
+    """
+
+    def __init__(self, spool_dir, max_memory_bytes=DEFAULT_MAX_MEMORY_BYTES, max_bytes=None, filename=None):
+        super().__init__()
+        self.spool_dir = spool_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_bytes = max_bytes
+        self.filename = filename
+        self.size = 0
+        self.path = None  # Set once the upload has spilled to disk
+        self._digest = hashlib.sha256()
+        self._file = io.BytesIO()
+
+    @property
+    def sha256(self):
+        return self._digest.hexdigest()
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            raise RequestEntityTooLarge(f"Uploaded file is larger than {self.max_bytes} bytes.")
+        self._digest.update(data)
+        if self.path is None and self.size > self.max_memory_bytes:
+            self._spill()
+        return self._file.write(data)
+
+    def _spill(self):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        suffix = os.path.splitext(self.filename or '')[1]
+        fd, self.path = tempfile.mkstemp(prefix='spool-', suffix=suffix, dir=self.spool_dir)
+        spilled = os.fdopen(fd, 'w+b')
+        spilled.write(self._file.getvalue())
+        self._file = spilled
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def readinto(self, buffer):
+        data = self._file.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def readline(self, size=-1):
+        return self._file.readline(size)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def flush(self):
+        if not self._file.closed:  # RawIOBase.close() flushes after close() closed the file
+            self._file.flush()
+
+    def save_to(self, path):
+        """Puts the upload at `path` (a rename when it already spilled to disk) and returns its SHA-256."""
+        if self.path is not None:
+            self._file.close()
+            os.replace(self.path, path)
+            self.path = None
+            self._file = open(path, 'rb')
+        else:
+            with open(path, 'wb') as f:
+                f.write(self._file.getvalue())
+        return self.sha256
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+            if self.path and os.path.exists(self.path):
+                os.remove(self.path)  # Spilled upload that was never saved
+        super().close()
+
+
+def store_upload(file_storage, path):
+    """
+    Saves an uploaded FileStorage to `path` and returns its SHA-256, reusing the hash and
+    spilled file of a HashingUploadStream when the request was parsed with one.
+    """
+    stream = file_storage.stream
+    if isinstance(stream, HashingUploadStream):
+        return stream.save_to(path)
+    stream.seek(0)
+    return save_and_hash(stream, path)
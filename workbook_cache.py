@@ -0,0 +1,188 @@
+# workbook_cache.py
+
+import os
+import pickle
+import threading
+import time
+
+import pandas as pd
+
+from checkpoint import file_sha256
+
+DEFAULT_CACHE_DIR = os.environ.get('WORKBOOK_CACHE_DIR', os.path.join('cache', 'workbooks'))
+DEFAULT_MAX_BYTES = int(os.environ.get('WORKBOOK_CACHE_MAX_BYTES', 1024 * 1024 * 1024))  # 1 GB
+SIDECAR_EXTENSION = '.pkl'
+
+
+class WorkbookCache:
+    """
+    Sidecar cache of parsed workbooks, keyed by the SHA-256 of the uploaded file.
+    Parsed sheets (or single columns) are pickled next to each other in `directory`, so a
+    repeat upload of the same file skips Excel parsing entirely. Files are evicted least
+    recently used first once the directory grows past `max_bytes`.
+    pyarrow is not a dependency here, so frames are stored with pickle rather than Parquet.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def configure(self, directory=None, max_bytes=None):
+        with self._lock:
+            if directory:
+                self.directory = directory
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+
+    def _path(self, digest, name):
+        safe_name = "".join(c if c.isalnum() or c in '-_' else '_' for c in name)
+        return os.path.join(self.directory, f"{digest}-{safe_name}{SIDECAR_EXTENSION}")
+
+    def get(self, digest, name):
+        """Returns the object stored for (digest, name), or None."""
+        path = self._path(digest, name)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        except Exception as e:
+            print(f"[WORKBOOK CACHE] Dropping unreadable sidecar {path}: {e}")
+            self._remove(path)
+            with self._lock:
+                self.misses += 1
+            return None
+        os.utime(path)  # Mark as recently used for LRU eviction
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def put(self, digest, name, value):
+        """Stores `value` for (digest, name) atomically, then evicts old sidecars if needed."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(digest, name)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+        except Exception as e:
+            print(f"[WORKBOOK CACHE] Could not store sidecar {path}: {e}")
+            self._remove(temp_path)
+            return
+        self.evict()
+
+    def open_stream(self, digest, name):
+        """
+        Returns an iterator over the values written for (digest, name) with stream_writer(),
+        read one at a time from disk, or None if there is no such sidecar.
+        """
+        path = self._path(digest, name)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        os.utime(path)  # Mark as recently used for LRU eviction
+        with self._lock:
+            self.hits += 1
+        return self._iter_stream(f)
+
+    @staticmethod
+    def _iter_stream(f):
+        with f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
+
+    def stream_writer(self, digest, name):
+        """Starts a sidecar for (digest, name) that is written one value at a time (see SidecarWriter)."""
+        os.makedirs(self.directory, exist_ok=True)
+        return SidecarWriter(self, self._path(digest, name))
+
+    def load_sheets(self, path, digest=None):
+        """
+        Returns {sheet_name: DataFrame} for every sheet of the workbook at `path`, parsing it
+        only if no sidecar exists for its content hash.
+        """
+        digest = digest or file_sha256(path)
+        sheets = self.get(digest, 'sheets')
+        if sheets is not None:
+            print(f"[WORKBOOK CACHE] Reusing parsed sheets for {os.path.basename(path)}.")
+            return sheets
+        started = time.time()
+        sheets = pd.read_excel(path, sheet_name=None)
+        print(f"[WORKBOOK CACHE] Parsed {os.path.basename(path)} in {time.time() - started:.1f}s.")
+        self.put(digest, 'sheets', sheets)
+        return sheets
+
+    def evict(self):
+        """Removes least recently used sidecars until the directory fits `max_bytes`."""
+        with self._lock:
+            try:
+                entries = []
+                for name in os.listdir(self.directory):
+                    if name.endswith(SIDECAR_EXTENSION):
+                        stat = os.stat(os.path.join(self.directory, name))
+                        entries.append((stat.st_mtime, stat.st_size, name))
+            except FileNotFoundError:
+                return
+            total_bytes = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total_bytes <= self.max_bytes:
+                    break
+                self._remove(os.path.join(self.directory, name))
+                total_bytes -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'directory': self.directory, 'max_bytes': self.max_bytes}
+
+
+class SidecarWriter:
+    """
+    Appends values to a sidecar as they are produced, so large columns never have to be held
+    in memory. Nothing is visible in the cache until commit(); discard() drops the file.
+    """
+
+    def __init__(self, cache, path):
+        self.cache = cache
+        self.path = path
+        self.temp_path = f"{path}.{threading.get_ident()}.tmp"
+        self._file = open(self.temp_path, 'wb')
+
+    def append(self, value):
+        pickle.dump(value, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def commit(self):
+        try:
+            self._file.close()
+            os.replace(self.temp_path, self.path)
+        except Exception as e:
+            print(f"[WORKBOOK CACHE] Could not store sidecar {self.path}: {e}")
+            self.discard()
+            return
+        self.cache.evict()
+
+    def discard(self):
+        self._file.close()
+        self.cache._remove(self.temp_path)
+
+
+# Shared instance used by the Excel features
+workbook_cache = WorkbookCache()
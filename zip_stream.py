@@ -0,0 +1,159 @@
+# zip_stream.py
+
+import hashlib
+import io
+import json
+import os
+import threading
+import zipfile
+
+DEFAULT_CACHE_DIR = os.environ.get('ARCHIVE_CACHE_DIR', os.path.join('cache', 'archives'))
+DEFAULT_MAX_BYTES = int(os.environ.get('ARCHIVE_CACHE_MAX_BYTES', 1024 * 1024 * 1024))  # 1 GB
+CHUNK_SIZE = 256 * 1024
+
+# Already-compressed formats gain nothing from deflate, so they are stored as they are
+STORED_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.webp', '.mp3', '.mp4', '.mov', '.webm', '.zip', '.xlsx', '.pdf'}
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, non-seekable target for ZipFile that hands written bytes back in chunks."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_zip(entries, chunk_size=CHUNK_SIZE):
+    """
+    Yields a ZIP archive of `entries` ((arcname, path) pairs) chunk by chunk while it is being
+    written, so memory stays at about one chunk however many files there are and the first
+    bytes go out right away. Compressed media is stored, everything else deflated.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w') as archive:
+        for arcname, path in entries:
+            info = zipfile.ZipInfo.from_file(path, arcname)
+            stored = os.path.splitext(arcname)[1].lower() in STORED_EXTENSIONS
+            info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+            with open(path, 'rb') as source, archive.open(info, 'w') as target:
+                for chunk in iter(lambda: source.read(chunk_size), b''):
+                    target.write(chunk)
+                    data = sink.take()
+                    if data:
+                        yield data
+            data = sink.take()
+            if data:
+                yield data
+    yield sink.take()  # Central directory
+
+
+class ArchiveCache:
+    """
+    Keeps finished ZIP archives keyed by their exact contents, so downloading the same set of
+    files again is served from disk instead of being rebuilt. stream() sends the archive while
+    writing it to the cache; least recently used archives are removed above `max_bytes`.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def configure(self, directory=None, max_bytes=None):
+        with self._lock:
+            if directory:
+                self.directory = directory
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(parts):
+        """Stable key for an ordered list of (arcname, content id) pairs."""
+        return hashlib.sha256(json.dumps(list(parts), ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.zip")
+
+    def get(self, key):
+        """Returns the path of the cached archive for `key`, or None."""
+        path = self._path(key)
+        with self._lock:
+            try:
+                # Touched under the lock, so evict() cannot remove it in between
+                os.utime(path)  # Mark as recently used for LRU eviction
+            except FileNotFoundError:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return path
+
+    def stream(self, key, entries, chunk_size=CHUNK_SIZE):
+        """Yields the archive of `entries` (see iter_zip) and stores it under `key` once it is complete."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        completed = False
+        try:
+            with open(temp_path, 'wb') as cache_file:
+                for chunk in iter_zip(entries, chunk_size):
+                    cache_file.write(chunk)
+                    yield chunk
+            os.replace(temp_path, path)
+            completed = True
+        finally:
+            if not completed:
+                # Client went away or a file vanished: don't keep a truncated archive
+                self._remove(temp_path)
+        self.evict()
+
+    def evict(self):
+        """Removes least recently used archives until the directory fits `max_bytes`."""
+        with self._lock:
+            try:
+                entries = []
+                for name in os.listdir(self.directory):
+                    if name.endswith('.zip'):
+                        stat = os.stat(os.path.join(self.directory, name))
+                        entries.append((stat.st_mtime, stat.st_size, name))
+            except FileNotFoundError:
+                return
+            total_bytes = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total_bytes <= self.max_bytes:
+                    break
+                self._remove(os.path.join(self.directory, name))
+                total_bytes -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'directory': self.directory, 'max_bytes': self.max_bytes}
+
+
+# Shared instance used by the image download routes
+archive_cache = ArchiveCache()